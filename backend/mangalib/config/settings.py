@@ -129,6 +129,156 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+
+# File storage
+# https://docs.djangoproject.com/en/4.2/ref/settings/#storages
+# Manga posters, backgrounds, pages and their variants are stored once per
+# distinct content under media/blobs/; run collect_image_blobs to delete the
+# blobs no row refers to any more.
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+    "images": {
+        "BACKEND": "manga.storage.ContentAddressedStorage",
+    },
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Cached API responses live in their own cache so they can be moved to a
+# shared backend, e.g. "django.core.cache.backends.filebased.FileBasedCache"
+# with LOCATION BASE_DIR / "cache" / "responses", when running several workers.
+# Invalidation only reaches the processes sharing a cache: with the local
+# memory backends below, changes made by management commands (ingest_chapters,
+# collect_image_blobs --adopt, generate_image_derivatives, the backfills) stay
+# invisible to a running server until its entries expire, i.e. up to
+# RESPONSE_CACHE_TIMEOUT, FEED_MAX_STALENESS or, for chapter archive
+# manifests, CHAPTER_ARCHIVE_MANIFEST_TIMEOUT. Move both "default" and
+# "responses" to a shared backend in production; the commands warn otherwise.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "default",
+    },
+    "responses": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "responses",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+RESPONSE_CACHE_ALIAS = "responses"
+
+RESPONSE_CACHE_TIMEOUT = 10 * 60
+
+
+# Cached statistics
+# Seconds a manga's user-list statistics stay cached; saving or deleting a
+# MangaUserList row drops the entry early.
+
+USER_LIST_CACHE_TIMEOUT = 60 * 60
+
+
+# Comment threads
+# Upper bounds for the reply tree rendered under each top-level comment;
+# clients may ask for less with ?depth= and ?replies=.
+
+COMMENT_TREE_MAX_DEPTH = 5
+
+COMMENT_TREE_MAX_REPLIES = 50
+
+
+# Manga view counting
+# Views are buffered in memory, deduplicated per viewer within the window
+# (seconds) and written every VIEW_COUNT_FLUSH_INTERVAL seconds in batches of
+# VIEW_COUNT_BATCH_SIZE manga. Set the interval to None to disable the
+# background flush; views are then written to the database as they are
+# recorded.
+
+VIEW_COUNT_DEDUP_WINDOW = 30 * 60
+
+VIEW_COUNT_FLUSH_INTERVAL = 10
+
+VIEW_COUNT_BATCH_SIZE = 500
+
+
+# Home page feeds
+# Popular/new manga and latest chapter lists are built once and shared by all
+# readers. They are rebuilt after a Manga or Chapter write, by the
+# refresh_feeds command, or at the latest FEED_MAX_STALENESS seconds after
+# they were built (view counts change without signals).
+
+FEED_MAX_STALENESS = 5 * 60
+
+
+# Title suggestions
+# The autocomplete trie lives in each process's memory. Manga saves update it
+# in place; it is rebuilt from the database every SUGGEST_REFRESH_INTERVAL
+# seconds to pick up changes made elsewhere and fresh view counts.
+
+SUGGEST_REFRESH_INTERVAL = 10 * 60
+
+
+# Catalog facets
+# Genre/tag/type/status/age rating filters are evaluated on in-memory bitmaps
+# and handed to the database as an id list. Above this many ids (either
+# matching or excluded) the filter is expressed in SQL instead. The bitmaps
+# are rebuilt after a write in the same process, and at the latest
+# FACET_MAX_STALENESS seconds after they were built, since writes made by
+# other processes only reach a shared cache.
+
+FACET_MAX_FILTER_IDS = 5000
+
+FACET_MAX_STALENESS = 5 * 60
+
+
+# Image variants
+# Uploaded posters, backgrounds and pages are re-encoded at these widths in
+# every format of IMAGE_DERIVATIVE_FORMATS that Pillow can write (AVIF needs a
+# build with libavif). Encoding runs in a pool of IMAGE_DERIVATIVE_WORKERS
+# threads after the upload commits; 0 encodes inline instead.
+
+IMAGE_DERIVATIVE_WIDTHS = {
+    "poster": (160, 320, 640),
+    "background": (768, 1280, 1920),
+    "page": (480, 960, 1440),
+}
+
+IMAGE_DERIVATIVE_FORMATS = ("avif", "webp")
+
+IMAGE_DERIVATIVE_QUALITY = 80
+
+IMAGE_DERIVATIVE_WORKERS = 2
+
+
+# Chapter downloads
+# Chapters are streamed as uncompressed ZIP/CBZ archives. The archive layout
+# (entry sizes, CRCs and offsets) needs one pass over the page files, so it is
+# kept in the response cache until a page or the chapter changes, or for
+# CHAPTER_ARCHIVE_MANIFEST_TIMEOUT seconds.
+
+CHAPTER_ARCHIVE_MANIFEST_TIMEOUT = 24 * 60 * 60
+
+CHAPTER_ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+
+# Near-duplicate page report
+# The admin report compares every hashed page, so it is cached for
+# DUPLICATE_REPORT_TIMEOUT seconds per set of parameters and lists
+# DUPLICATE_REPORT_PAGE_SIZE page pairs per page. The find_duplicate_pages
+# command always computes a fresh report.
+
+DUPLICATE_REPORT_TIMEOUT = 15 * 60
+
+DUPLICATE_REPORT_PAGE_SIZE = 100
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.template.response import TemplateResponse
+from django.urls import path
 
+from .duplicates import MAX_DISTANCE, describe, get_report
 from .models import Manga, Genre, Author, Publisher, Painter, Volume, Chapter, Page, Rating, Comment, RatingComment
 
 
@@ -13,14 +18,53 @@ class ChapterAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('title',)}
 
 
+@admin.register(Page)
+class PageAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'page_number', 'width', 'height', 'file_size')
+    list_select_related = ('chapter__volume__manga',)
+    readonly_fields = ('width', 'height', 'file_size', 'content_hash', 'perceptual_hash')
+
+    def get_urls(self):
+        urls = [path('duplicates/', self.admin_site.admin_view(self.duplicates_view), name='manga_page_duplicates')]
+        return urls + super().get_urls()
+
+    def duplicates_view(self, request):
+        """Near-duplicate pages and chapters by perceptual hash; ``?distance=`` and ``?min_shared=`` tune it.
+
+        The report is cached and its page pairs are paginated; the
+        find_duplicate_pages command computes and lists everything at once.
+        """
+        try:
+            distance = min(max(int(request.GET.get('distance', 6)), 0), MAX_DISTANCE)
+            min_shared = min(max(float(request.GET.get('min_shared', 0.5)), 0), 1)
+        except ValueError:
+            distance, min_shared = 6, 0.5
+        report = get_report(distance, min_shared)
+        page_size = settings.DUPLICATE_REPORT_PAGE_SIZE
+        pairs = Paginator(report.pairs, page_size).get_page(request.GET.get('page'))
+        labels = describe(report, limit=page_size, offset=(pairs.number - 1) * page_size)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Near-duplicate pages',
+            'distance': distance,
+            'max_distance': MAX_DISTANCE,
+            'min_shared': min_shared,
+            'report': report,
+            'page_obj': pairs,
+            'chapters': [(labels.chapters[item.chapter_id], labels.chapters[item.other_id], item)
+                         for item in labels.matches],
+            'pairs': [(labels.pages[page[0]], page[0], labels.pages[other[0]], other[0], found)
+                      for found, page, other in labels.pairs],
+        }
+        return TemplateResponse(request, 'admin/manga/page/duplicates.html', context)
+
+
 admin.site.register(Genre)
 admin.site.register(Author)
 admin.site.register(Painter)
 admin.site.register(Publisher)
 admin.site.register(Volume)
-admin.site.register(Page)
 admin.site.register(Rating)
 admin.site.register(Comment)
 admin.site.register(RatingComment)
-
-
@@ -0,0 +1,171 @@
+import hashlib
+import posixpath
+import re
+import struct
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import response_cache
+from .models import Page
+
+# Uncompressed ("stored") entries with UTF-8 names; sizes and CRCs are known
+# up front, so no data descriptors are needed and every offset is fixed.
+VERSION = 20
+FLAGS = 0x0800
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+MAX_SIZE = 0xFFFFFFFF
+MAX_ENTRIES = 0xFFFF
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+def manifest_key(chapter_id):
+    return f"chapter-archive:{chapter_id}"
+
+
+def dos_datetime(value):
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    year = min(max(value.year, 1980), 2107)
+    return (value.hour << 11) | (value.minute << 5) | (value.second // 2), \
+        ((year - 1980) << 9) | (value.month << 5) | value.day
+
+
+def file_crc32(storage, name):
+    crc, size = 0, 0
+    with storage.open(name, "rb") as file:
+        while chunk := file.read(settings.CHAPTER_ARCHIVE_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    return crc, size
+
+
+def build_manifest(chapter):
+    """Names, sizes, CRCs and offsets of every entry of the chapter's archive.
+
+    Reads each page file once; the result is all that is needed to produce
+    any byte range of the archive without buffering it.
+    """
+    storage = Page._meta.get_field("image").storage
+    pages = list(chapter.pages.exclude(image="").order_by("page_number").values_list("page_number", "image"))
+    width = max([3] + [len(str(number)) for number, _ in pages])
+    time, date = dos_datetime(chapter.updated_at)
+    entries, offset = [], 0
+    for number, image in pages:
+        crc, size = file_crc32(storage, image)
+        name = f"{number:0{width}d}{posixpath.splitext(image)[1].lower()}"
+        entries.append({"name": name, "file": image, "size": size, "crc": crc, "offset": offset})
+        offset += LOCAL_HEADER.size + len(name.encode()) + size
+    directory_size = sum(CENTRAL_HEADER.size + len(entry["name"].encode()) for entry in entries)
+    total = offset + directory_size + END_RECORD.size
+    if total > MAX_SIZE or len(entries) > MAX_ENTRIES:
+        raise ArchiveTooLarge(f"Chapter {chapter.pk} does not fit in a ZIP archive without ZIP64")
+
+    volume_number = chapter.volume.volume_number
+    manifest = {
+        "filename": f"{chapter.manga.subtitle} - Vol {volume_number} Ch {chapter.chapter_number}",
+        "time": time, "date": date, "entries": entries,
+        "directory_offset": offset, "directory_size": directory_size, "size": total,
+    }
+    digest = hashlib.sha1(repr(sorted(manifest.items())).encode()).hexdigest()
+    manifest["etag"] = f'"{digest}"'
+    return manifest
+
+
+def get_manifest(chapter_id, load_chapter):
+    """The cached manifest of a chapter, rebuilt after the chapter, its pages or its manga change.
+
+    ``load_chapter`` is only called on a miss, so a hit needs no query.
+    """
+    cache = response_cache.get_cache()
+    entry = cache.get(manifest_key(chapter_id))
+    if entry is not None and response_cache.get_generations(entry["generations"]) == entry["generations"]:
+        return entry["manifest"]
+    chapter = load_chapter()
+    scopes = [f"chapter:{chapter.pk}", f"manga:{chapter.manga_id}"]
+    generations = response_cache.get_generations(scopes)
+    manifest = build_manifest(chapter)
+    cache.set(manifest_key(chapter.pk), {"manifest": manifest, "generations": generations},
+              settings.CHAPTER_ARCHIVE_MANIFEST_TIMEOUT)
+    return manifest
+
+
+def local_header(manifest, entry):
+    name = entry["name"].encode()
+    return LOCAL_HEADER.pack(0x04034B50, VERSION, FLAGS, 0, manifest["time"], manifest["date"],
+                             entry["crc"], entry["size"], entry["size"], len(name), 0) + name
+
+
+def central_directory(manifest):
+    records = []
+    for entry in manifest["entries"]:
+        name = entry["name"].encode()
+        records.append(CENTRAL_HEADER.pack(0x02014B50, VERSION, VERSION, FLAGS, 0, manifest["time"],
+                                           manifest["date"], entry["crc"], entry["size"], entry["size"],
+                                           len(name), 0, 0, 0, 0, 0, entry["offset"]) + name)
+    count = len(manifest["entries"])
+    records.append(END_RECORD.pack(0x06054B50, 0, 0, count, count, manifest["directory_size"],
+                                   manifest["directory_offset"], 0))
+    return b"".join(records)
+
+
+def segments(manifest):
+    """``(offset, length, data_or_file)`` for each consecutive piece of the archive."""
+    for entry in manifest["entries"]:
+        header = local_header(manifest, entry)
+        yield entry["offset"], len(header), header
+        yield entry["offset"] + len(header), entry["size"], entry["file"]
+    directory = central_directory(manifest)
+    yield manifest["directory_offset"], len(directory), directory
+
+
+def stream(manifest, start=0, end=None):
+    """Yield bytes ``start`` to ``end`` (inclusive) of the archive, one chunk at a time."""
+    storage = Page._meta.get_field("image").storage
+    end = manifest["size"] - 1 if end is None else end
+    chunk_size = settings.CHAPTER_ARCHIVE_CHUNK_SIZE
+    for offset, length, content in segments(manifest):
+        if offset + length <= start or length == 0:
+            continue
+        if offset > end:
+            break
+        first, last = max(start - offset, 0), min(end - offset, length - 1)
+        if isinstance(content, bytes):
+            yield content[first:last + 1]
+            continue
+        with storage.open(content, "rb") as file:
+            file.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = file.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise OSError(f"{content} is shorter than when the archive manifest was built")
+                remaining -= len(chunk)
+                yield chunk
+
+
+def parse_range(header, size):
+    """``(start, end)`` of a single ``bytes=`` range, ``None`` to send everything.
+
+    Raises ``ValueError`` when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
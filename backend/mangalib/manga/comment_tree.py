@@ -0,0 +1,44 @@
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Comment
+
+
+class CommentTree:
+    """Replies for a set of top-level comments, loaded up front.
+
+    Replies are loaded one level at a time, starting from the roots, with
+    one query per level that keeps at most ``max_replies`` per parent; the
+    cost follows the part of the thread that is rendered, not its full
+    size. Serializers then walk the tree without touching the database.
+    """
+
+    def __init__(self, roots, children=None):
+        self.root_ids = {root.pk for root in roots}
+        self.children = children or {}
+
+    def __contains__(self, comment):
+        return comment.pk in self.root_ids
+
+    def get_replies(self, comment):
+        return self.children.get(comment.pk, [])
+
+    @classmethod
+    def load(cls, roots, max_depth, max_replies):
+        """Build the tree below ``roots``, keeping ``max_replies`` per comment and ``max_depth`` levels."""
+        roots = list(roots)
+        children = {}
+        level = roots
+        for _ in range(max_depth):
+            if not level:
+                break
+            rank = Window(RowNumber(), partition_by=[F("parent_id")], order_by=F("pk").asc())
+            replies = (Comment.objects.filter(parent_id__in=[comment.pk for comment in level])
+                       .annotate(rank=rank).filter(rank__lte=max_replies)
+                       .select_related("author").order_by("pk"))
+            for comment in level:
+                children[comment.pk] = []
+            for reply in replies:
+                children[reply.parent_id].append(reply)
+            level = [reply for comment in level for reply in children[comment.pk]]
+        return cls(roots, children)
@@ -0,0 +1,125 @@
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Pillow format names of the variant encodings, in order of preference.
+FORMATS = {"avif": "AVIF", "webp": "WEBP"}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_formats():
+    """Configured variant formats this Pillow build can encode (AVIF needs libavif)."""
+    Image.init()
+    writable = set(Image.SAVE)
+    return [name for name in settings.IMAGE_DERIVATIVE_FORMATS if FORMATS[name] in writable]
+
+
+def get_widths(kind, original_width):
+    """Configured widths below the original; small originals get one variant at their own width."""
+    widths = [width for width in settings.IMAGE_DERIVATIVE_WIDTHS[kind] if width < original_width]
+    return widths or [original_width]
+
+
+def variant_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{stem}-{width}w.{extension}")
+
+
+def generate(storage, name, kind):
+    """Encode every configured width and format of the image ``name`` and store them next to it.
+
+    Returns the variants as ``{"name", "format", "width", "height", "size"}``
+    dicts, smallest first.
+    """
+    with storage.open(name, "rb") as file, Image.open(file) as original:
+        original = ImageOps.exif_transpose(original)
+        original = original.convert("RGBA" if "A" in original.getbands() else "RGB")
+        variants = []
+        for width in get_widths(kind, original.width):
+            height = max(1, round(original.height * width / original.width))
+            resized = original.resize((width, height), Image.LANCZOS) if width != original.width else original
+            for extension in get_formats():
+                buffer = io.BytesIO()
+                resized.save(buffer, FORMATS[extension], quality=settings.IMAGE_DERIVATIVE_QUALITY)
+                target = variant_name(name, width, extension)
+                if storage.exists(target):
+                    storage.delete(target)
+                target = storage.save(target, ContentFile(buffer.getvalue()))
+                variants.append({"name": target, "format": extension, "width": width,
+                                 "height": height, "size": buffer.tell()})
+    return variants
+
+
+def build_variants(model_label, pk, field, variants_field, kind, stale=()):
+    """Generate the variants of one image field and record them on the row.
+
+    The row is only updated while it still points at the same file, so a
+    newer upload that raced this task keeps its own variants.
+    """
+    model = apps.get_model(model_label)
+    obj = model.objects.filter(pk=pk).only(field).first()
+    if obj is None or not getattr(obj, field):
+        return None
+    field_file = getattr(obj, field)
+    variants = generate(field_file.storage, field_file.name, kind)
+    model.objects.filter(pk=pk, **{field: field_file.name}).update(**{variants_field: variants})
+    storage = field_file.storage
+    current = {variant["name"] for variant in variants}
+    for name in stale:
+        if name not in current:
+            storage.delete(name)
+    invalidate_responses(model_label, pk)
+    return variants
+
+
+def invalidate_responses(model_label, pk):
+    from . import response_cache
+    from .feeds import invalidate_feeds
+
+    if model_label == "manga.Manga":
+        response_cache.invalidate("catalog", f"manga:{pk}")
+        invalidate_feeds()
+    else:
+        page = apps.get_model(model_label).objects.filter(pk=pk).values("chapter_id", "manga_id").first()
+        if page:
+            response_cache.invalidate(f"chapter:{page['chapter_id']}", f"manga:{page['manga_id']}")
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+                                           thread_name_prefix="image-derivatives")
+        return _executor
+
+
+def run(*args):
+    try:
+        build_variants(*args)
+    except Exception:
+        logger.exception("Failed to build image variants for %s pk=%s", args[0], args[1])
+    finally:
+        close_old_connections()
+
+
+def schedule(instance, field, variants_field, kind, stale=()):
+    """Build variants in the worker pool once the current transaction commits."""
+    args = (instance._meta.label, instance.pk, field, variants_field, kind, tuple(stale))
+    if settings.IMAGE_DERIVATIVE_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(run, *args))
+    else:
+        transaction.on_commit(lambda: build_variants(*args))
@@ -0,0 +1,208 @@
+from functools import lru_cache
+from itertools import combinations
+from math import comb
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+# Largest distance the report accepts. Beyond it unrelated pages start to
+# match, and the search probes so many substrings that it approaches a scan.
+MAX_DISTANCE = 10
+
+
+def dhash(image):
+    """64-bit difference hash: whether each pixel of a 9x8 grayscale thumbnail is brighter than its right neighbour.
+
+    Robust to re-encoding, resizing and small level changes, so copies of a
+    page that differ byte for byte still land within a few bits of each other.
+    """
+    image = ImageOps.exif_transpose(image).convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return to_signed(value)
+
+
+def to_signed(value):
+    """Fit an unsigned 64-bit hash into a signed BigIntegerField."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def hamming(a, b):
+    return bin((a ^ b) & HASH_MASK).count("1")
+
+
+class MultiIndex:
+    """Multi-index hashing for hamming-radius search over 64-bit hashes.
+
+    Every hash is split into ``chunks`` substrings, each indexed in its own
+    table. Two hashes within ``radius`` bits differ in at most
+    ``radius // chunks`` bits in at least one substring (pigeonhole), so a
+    search only probes the substrings within that many bits of the query's
+    and checks the few hashes found there, instead of scanning them all.
+    """
+
+    def __init__(self, chunks=4):
+        self.chunks = chunks
+        self.width = HASH_BITS // chunks
+        self.tables = [{} for _ in range(chunks)]
+        self.items = {}
+
+    def parts(self, value):
+        mask = (1 << self.width) - 1
+        return [(value >> (index * self.width)) & mask for index in range(self.chunks)]
+
+    def add(self, value, item):
+        value &= HASH_MASK
+        items = self.items.get(value)
+        if items is None:
+            items = self.items[value] = []
+            for table, part in zip(self.tables, self.parts(value)):
+                table.setdefault(part, []).append(value)
+        items.append(item)
+
+    def search(self, value, radius):
+        """``(distance, item)`` for every item whose hash is within ``radius`` bits of ``value``."""
+        value &= HASH_MASK
+        flips = get_flips(self.width, radius // self.chunks)
+        candidates = set()
+        for table, part in zip(self.tables, self.parts(value)):
+            for flip in flips:
+                candidates.update(table.get(part ^ flip, ()))
+        found = []
+        for candidate in candidates:
+            distance = hamming(value, candidate)
+            if distance <= radius:
+                found.extend((distance, item) for item in self.items[candidate])
+        return found
+
+
+@lru_cache(maxsize=None)
+def get_flips(width, bits):
+    """Every ``width``-bit mask with at most ``bits`` bits set."""
+    return [sum(1 << position for position in positions)
+            for count in range(bits + 1) for positions in combinations(range(width), count)]
+
+
+def choose_chunks(count, radius):
+    """Substrings per hash that make a ``radius`` search among ``count`` hashes cheapest.
+
+    Fewer, wider substrings need many probes once ``radius`` grows; more,
+    narrower ones leave many hashes per probe. ``None`` when comparing with
+    every hash is cheaper than either.
+    """
+    best, best_cost = None, count
+    for chunks in (4, 8, 16):
+        width = HASH_BITS // chunks
+        probes = sum(comb(width, bits) for bits in range(radius // chunks + 1))
+        cost = chunks * probes * (1 + count / (1 << width))
+        if cost < best_cost:
+            best, best_cost = chunks, cost
+    return best
+
+
+def find_near_duplicates(pages, distance, ignore=(0,)):
+    """Pairs of pages whose perceptual hashes differ in at most ``distance`` bits.
+
+    ``pages`` are ``(page_id, chapter_id, hash)`` tuples. Hashes in
+    ``ignore`` (by default the one of flat, blank pages) are skipped.
+    Returns ``(distance, page, other)`` with ``page`` the lower id, closest
+    pairs first.
+    """
+    groups = {}
+    for page in pages:
+        if page[2] is not None and page[2] not in ignore:
+            groups.setdefault(page[2] & HASH_MASK, []).append(page)
+    chunks = choose_chunks(len(groups), distance)
+    if chunks is None:
+        def search(value, radius):
+            return [(found, page) for other, group in groups.items()
+                    if (found := hamming(value, other)) <= radius for page in group]
+    else:
+        index = MultiIndex(chunks)
+        for value, group in groups.items():
+            for page in group:
+                index.add(value, page)
+        search = index.search
+    pairs = []
+    for value, group in groups.items():
+        for found, other in search(value, distance):
+            pairs.extend((found, page, other) for page in group if other[0] > page[0])
+    pairs.sort(key=lambda pair: (pair[0], pair[1][0], pair[2][0]))
+    return pairs
+
+
+def group_chapters(pairs, page_counts, min_shared=0.5):
+    """Chapter pairs where at least ``min_shared`` of the smaller chapter's pages have a near-duplicate in the other."""
+    matched = {}
+    for _, page, other in pairs:
+        if page[1] != other[1]:
+            key = tuple(sorted((page[1], other[1])))
+            pages = matched.setdefault(key, (set(), set()))
+            pages[key.index(page[1])].add(page[0])
+            pages[key.index(other[1])].add(other[0])
+    chapters = []
+    for (chapter, other), (pages, other_pages) in matched.items():
+        shared = min(len(pages), len(other_pages))
+        smaller = min(page_counts.get(chapter, 0), page_counts.get(other, 0)) or 1
+        if shared / smaller >= min_shared:
+            chapters.append(SimpleNamespace(chapter_id=chapter, other_id=other, shared=shared,
+                                            ratio=shared / smaller))
+    chapters.sort(key=lambda item: (-item.ratio, -item.shared, item.chapter_id, item.other_id))
+    return chapters
+
+
+def build_report(distance, min_shared=0.5, queryset=None):
+    """Near-duplicate pages and chapters across the whole catalog (or ``queryset`` of pages)."""
+    from .models import Page
+
+    queryset = Page.objects.all() if queryset is None else queryset
+    rows = list(queryset.exclude(perceptual_hash=None).values_list("pk", "chapter_id", "perceptual_hash"))
+    pairs = find_near_duplicates(rows, distance)
+    page_counts = dict(queryset.order_by().values("chapter_id").annotate(total=Count("pk"))
+                       .values_list("chapter_id", "total"))
+    return SimpleNamespace(pages=len(rows), pairs=pairs, chapters=group_chapters(pairs, page_counts, min_shared))
+
+
+def get_report(distance, min_shared=0.5):
+    """``build_report`` for the whole catalog, cached for ``DUPLICATE_REPORT_TIMEOUT`` seconds."""
+    key = f"duplicate-report:{distance}:{min_shared}"
+    report = cache.get(key)
+    if report is None:
+        report = build_report(distance, min_shared)
+        cache.set(key, report, settings.DUPLICATE_REPORT_TIMEOUT)
+    return report
+
+
+def chapter_label(chapter):
+    return f"{chapter.manga.subtitle} vol. {chapter.volume.volume_number} ch. {chapter.chapter_number}"
+
+
+def describe(report, limit=None, offset=0):
+    """Labels for the pages and chapters of ``report``, limited to ``limit`` page pairs from ``offset``.
+
+    ``pairs`` and ``matches`` (the chapter pairs) leave out whatever was
+    deleted since the report was built.
+    """
+    from .models import Chapter, Page
+
+    pairs = report.pairs[offset:offset + limit] if limit else report.pairs[offset:]
+    page_ids = {page[0] for _, *pair in pairs for page in pair}
+    chapter_ids = {chapter_id for item in report.chapters for chapter_id in (item.chapter_id, item.other_id)}
+    pages = Page.objects.filter(pk__in=page_ids).select_related("chapter__volume", "manga")
+    chapters = Chapter.objects.filter(pk__in=chapter_ids).select_related("volume", "manga")
+    pages = {page.pk: f"{chapter_label(page.chapter)} p. {page.page_number}" for page in pages}
+    chapters = {chapter.pk: chapter_label(chapter) for chapter in chapters}
+    return SimpleNamespace(
+        pairs=[pair for pair in pairs if pair[1][0] in pages and pair[2][0] in pages],
+        matches=[item for item in report.chapters if item.chapter_id in chapters and item.other_id in chapters],
+        pages=pages,
+        chapters=chapters,
+    )
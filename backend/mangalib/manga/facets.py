@@ -0,0 +1,181 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Manga
+
+GENERATION_KEY = "facets:generation"
+
+# Facet name -> how to filter it in the database when the id set is too big.
+FACETS = {
+    "genres": (Manga.genres.through, "genre_id"),
+    "tags": (Manga.tag.through, "tag_id"),
+    "type": (None, "type"),
+    "status": (None, "status"),
+    "age_rating": (None, "age_rating"),
+}
+
+
+def to_bitmap(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def from_bitmap(bitmap):
+    ids = []
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        while byte:
+            low = byte & -byte
+            ids.append(index * 8 + low.bit_length() - 1)
+            byte ^= low
+    return ids
+
+
+def popcount(bitmap):
+    return bin(bitmap).count("1")
+
+
+class Selection:
+    """Constraints per facet: match any of ``any``, all of ``all`` and none of ``none``."""
+
+    def __init__(self):
+        self.constraints = {}
+
+    def add(self, facet, mode, values):
+        if values:
+            self.constraints.setdefault(facet, {}).setdefault(mode, []).extend(values)
+
+    def __bool__(self):
+        return bool(self.constraints)
+
+    def items(self, skip=None):
+        return [(facet, modes) for facet, modes in self.constraints.items() if facet != skip]
+
+    def as_q(self):
+        """The same selection as database conditions, without row duplication."""
+        condition = Q()
+        for facet, modes in self.items():
+            if modes.get("any"):
+                condition &= facet_q(facet, modes["any"])
+            for value in modes.get("all", ()):
+                condition &= facet_q(facet, [value])
+            if modes.get("none"):
+                condition &= ~facet_q(facet, modes["none"])
+        return condition
+
+
+def facet_q(facet, values):
+    through, column = FACETS[facet]
+    if through is None:
+        return Q(**{f"{column}__in": values})
+    return Q(Exists(through.objects.filter(manga_id=OuterRef("pk"), **{f"{column}__in": values})))
+
+
+class FacetIndex:
+    """Bitmaps of manga ids for every genre, tag, type, status and age rating.
+
+    Bit ``n`` of a bitmap is set when manga ``n`` has that value, so a
+    selection is evaluated with ``&``, ``|`` and ``~`` over Python ints and
+    counted with a popcount. The index is rebuilt lazily, with one query per
+    relation, after ``invalidate_facets`` runs, or once it is older than
+    ``FACET_MAX_STALENESS`` seconds. The generation lives in the default
+    cache, so with a per-process cache only invalidations from the same
+    process are seen right away; writes made elsewhere (other workers,
+    management commands) show up after at most that many seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = None
+        self.built_at = None
+        # (every manga id, {facet: {value: bitmap}}), always replaced as a whole.
+        self.state = (0, {})
+
+    def build(self):
+        values = {facet: {} for facet in FACETS}
+        rows = Manga.objects.values_list("id", "type", "status", "age_rating")
+        for manga_id, *columns in rows.iterator():
+            for facet, value in zip(("type", "status", "age_rating"), columns):
+                values[facet].setdefault(value, []).append(manga_id)
+        for facet in ("genres", "tags"):
+            through, column = FACETS[facet]
+            for manga_id, value in through.objects.values_list("manga_id", column).iterator():
+                values[facet].setdefault(value, []).append(manga_id)
+        universe = to_bitmap(Manga.objects.values_list("id", flat=True).iterator())
+        bitmaps = {
+            facet: {value: to_bitmap(ids) for value, ids in facet_values.items()}
+            for facet, facet_values in values.items()
+        }
+        return universe, bitmaps
+
+    def is_current(self, generation):
+        return (generation == self.generation and self.built_at is not None
+                and time.monotonic() - self.built_at <= settings.FACET_MAX_STALENESS)
+
+    def refresh(self):
+        """The current ``(universe, bitmaps)``, rebuilt first if needed."""
+        generation = cache.get_or_set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        if not self.is_current(generation):
+            with self.lock:
+                if not self.is_current(generation):
+                    self.state = self.build()
+                    self.generation, self.built_at = generation, time.monotonic()
+        return self.state
+
+    def evaluate(self, selection, skip=None, state=None):
+        universe, bitmaps = state or self.refresh()
+        result = universe
+        for facet, modes in selection.items(skip):
+            values = bitmaps[facet]
+            if modes.get("any"):
+                matched = 0
+                for value in modes["any"]:
+                    matched |= values.get(value, 0)
+                result &= matched
+            for value in modes.get("all", ()):
+                result &= values.get(value, 0)
+            for value in modes.get("none", ()):
+                result &= ~values.get(value, 0)
+        return result
+
+    def filter(self, queryset, selection):
+        """Restrict ``queryset`` to the selection by id, or in SQL when too many ids would be sent."""
+        state = self.refresh()
+        matched = self.evaluate(selection, state=state)
+        if popcount(matched) <= settings.FACET_MAX_FILTER_IDS:
+            return queryset.filter(pk__in=from_bitmap(matched))
+        excluded = state[0] & ~matched
+        if popcount(excluded) <= settings.FACET_MAX_FILTER_IDS:
+            return queryset.exclude(pk__in=from_bitmap(excluded))
+        return queryset.filter(selection.as_q())
+
+    def counts(self, selection, restrict=None):
+        """Matching manga per facet value.
+
+        Each facet is counted against the selection without its own
+        constraints, so picking a genre does not hide the other genres.
+        """
+        state = self.refresh()
+        universe, bitmaps = state
+        restrict = universe if restrict is None else restrict
+        counts = {"total": popcount(self.evaluate(selection, state=state) & restrict)}
+        for facet, values in bitmaps.items():
+            base = self.evaluate(selection, skip=facet, state=state) & restrict
+            counts[facet] = {value: popcount(base & bitmap) for value, bitmap in sorted(values.items())}
+        return counts
+
+
+facet_index = FacetIndex()
+
+
+def invalidate_facets():
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
@@ -0,0 +1,81 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .models import Chapter, Manga
+from .serializers import (LatestChapterSerializer, MangaNewSerializer,
+                          MangaPopularNewChapters, MangaPopularSerializer)
+
+# Bump when the shape of a feed changes so old entries are never served.
+FEED_VERSION = 1
+GENERATION_KEY = "feeds:generation"
+
+
+def build_popular_manga():
+    queryset = Manga.objects.order_by('-view_count')[:10]
+    return MangaPopularSerializer(queryset, many=True).data
+
+
+def build_new_manga():
+    queryset = Manga.objects.order_by('-created_at')[:10]
+    return MangaNewSerializer(queryset, many=True).data
+
+
+def build_popular_manga_chapters():
+    mangas = list(Manga.objects.annotate(
+        latest_chapter_date=Max('chapters__created_at')
+    ).order_by('-view_count', '-latest_chapter_date')[:6])
+    last_chapters = Chapter.get_last_chapters([manga.pk for manga in mangas])
+    return MangaPopularNewChapters(mangas, many=True, context={'last_chapters': last_chapters}).data
+
+
+def build_latest_chapters():
+    queryset = (
+        Chapter.objects.select_related('volume', 'manga')
+        .annotate(pages_count=Count('pages'))
+        .order_by('-created_at')[:50]
+    )
+    return LatestChapterSerializer(queryset, many=True).data
+
+
+FEEDS = {
+    "popular_manga": build_popular_manga,
+    "new_manga": build_new_manga,
+    "popular_manga_chapters": build_popular_manga_chapters,
+    "latest_chapters": build_latest_chapters,
+}
+
+
+def get_generation():
+    return cache.get_or_set(GENERATION_KEY, 1, timeout=None)
+
+
+def invalidate_feeds():
+    """Retire every stored feed; they are rebuilt on their next read."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, timeout=None)
+
+
+def feed_cache_key(name, generation):
+    return f"feeds:v{FEED_VERSION}:{generation}:{name}"
+
+
+def refresh_feed(name, generation=None):
+    """Build a feed and store it as plain JSON data for at most FEED_MAX_STALENESS seconds."""
+    if generation is None:
+        generation = get_generation()
+    data = json.loads(json.dumps(FEEDS[name]()))
+    cache.set(feed_cache_key(name, generation), data, settings.FEED_MAX_STALENESS)
+    return data
+
+
+def get_feed(name):
+    generation = get_generation()
+    data = cache.get(feed_cache_key(name, generation))
+    if data is None:
+        data = refresh_feed(name, generation)
+    return data
@@ -1,30 +1,111 @@
-from django.db.models import Avg
+from django import forms
+from django.db.models import Q
 from django_filters import rest_framework as filters
+from django_filters.widgets import QueryArrayWidget
+from rest_framework.filters import OrderingFilter, SearchFilter
 
-from .models import Manga, Genre, Tag
+from . import search
+from .facets import Selection, facet_index, to_bitmap
+from .models import Manga
+
+
+class MangaSearchFilter(SearchFilter):
+    """Search through the full-text index, best matches first unless another ordering is requested.
+
+    Every word is matched as a prefix against titles, description, author
+    and painter names, genres and tags. Without the index (other database
+    vendors) this falls back to the plain ``LIKE`` search over ``search_fields``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not search.is_available():
+            return super().filter_queryset(request, queryset, view)
+        text = request.query_params.get(self.search_param, "")
+        queryset = search.search(queryset, text)
+        if "search_rank" in queryset.query.annotations and not request.query_params.get(OrderingFilter.ordering_param):
+            queryset = queryset.order_by("search_rank", "pk")
+        return queryset
+
+
+class FacetValuesField(forms.Field):
+    """A list of values given as ``?name=a&name=b`` or ``?name=a,b``."""
+
+    widget = QueryArrayWidget
+
+    def __init__(self, *args, coerce=str, **kwargs):
+        self.coerce = coerce
+        super().__init__(*args, **kwargs)
+
+    def clean(self, value):
+        values = [part.strip() for item in (value or []) for part in item.split(",") if part.strip()]
+        try:
+            return [self.coerce(item) for item in values]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Enter a list of valid values.", code="invalid_list")
+
+
+class FacetFilter(filters.Filter):
+    """Collects a facet constraint; ``MangaFilter`` evaluates all of them together."""
+
+    field_class = FacetValuesField
+
+    def __init__(self, facet, mode, *args, **kwargs):
+        self.facet = facet
+        self.mode = mode
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        return qs
 
 
 class MangaFilter(filters.FilterSet):
     chapters = filters.RangeFilter(field_name="chapters_count", label='Chapters count')
     release_year = filters.RangeFilter(field_name="release_year")
     rating = filters.RangeFilter(method="filter_by_rating", label="Rating")
-    age_rating = filters.CharFilter(field_name="age_rating")
-    genres = filters.ModelMultipleChoiceFilter(field_name="genres", queryset=Genre.objects.all())
-    tags = filters.ModelMultipleChoiceFilter(field_name="tag", queryset=Tag.objects.all())
-    type = filters.CharFilter(field_name="type")
-    status = filters.CharFilter(field_name="status")
+    age_rating = FacetFilter("age_rating", "any")
+    age_rating_exclude = FacetFilter("age_rating", "none")
+    genres = FacetFilter("genres", "any", coerce=int)
+    genres_all = FacetFilter("genres", "all", coerce=int)
+    genres_exclude = FacetFilter("genres", "none", coerce=int)
+    tags = FacetFilter("tags", "any", coerce=int)
+    tags_all = FacetFilter("tags", "all", coerce=int)
+    tags_exclude = FacetFilter("tags", "none", coerce=int)
+    type = FacetFilter("type", "any")
+    type_exclude = FacetFilter("type", "none")
+    status = FacetFilter("status", "any")
+    status_exclude = FacetFilter("status", "none")
 
     def filter_by_rating(self, queryset, name, values):
         rating_from = values.start or 0
         rating_to = values.stop or 10
-        queryset_with_rating = queryset.annotate(avg_rating=Avg('ratings__star')).filter(avg_rating__range=(rating_from, rating_to))
+        condition = Q(rating_summary__count__gt=0, rating_summary__average__range=(rating_from, rating_to))
         if not rating_from:
-            queryset_without_rating = queryset.filter(ratings__isnull=True)
-            queryset = queryset_with_rating | queryset_without_rating
-        else:
-            queryset = queryset_with_rating
-        return queryset.distinct()
+            condition |= Q(rating_summary__isnull=True) | Q(rating_summary__count=0)
+        return queryset.filter(condition)
+
+    def get_selection(self):
+        selection = Selection()
+        for name, value in self.form.cleaned_data.items():
+            facet_filter = self.filters[name]
+            if isinstance(facet_filter, FacetFilter):
+                selection.add(facet_filter.facet, facet_filter.mode, value)
+        return selection
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        selection = self.get_selection()
+        if selection:
+            queryset = facet_index.filter(queryset, selection)
+        return queryset
+
+    def get_facet_counts(self):
+        """Per-facet counts for the current selection, narrowed by the other active filters."""
+        restrict = None
+        if any(value for name, value in self.form.cleaned_data.items()
+               if not isinstance(self.filters[name], FacetFilter)):
+            restrict = to_bitmap(super().filter_queryset(self.queryset).values_list("pk", flat=True))
+        return facet_index.counts(self.get_selection(), restrict)
 
     class Meta:
         model = Manga
-        fields = ['chapters', 'release_year', 'rating', 'age_rating', 'type', 'status', 'genres']
\ No newline at end of file
+        fields = ['chapters', 'release_year', 'rating', 'age_rating', 'type', 'status', 'genres']
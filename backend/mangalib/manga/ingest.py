@@ -0,0 +1,221 @@
+import hashlib
+import io
+import os
+import posixpath
+import re
+import zipfile
+from types import SimpleNamespace
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from PIL import Image
+
+from . import derivatives
+from .duplicates import dhash
+from .models import Chapter, Manga, Page, Volume
+from .utils import page_image_directory
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"}
+ARCHIVE_EXTENSIONS = {".zip", ".cbz"}
+
+VOLUME_RE = re.compile(r"\b(?:vol(?:ume)?|v|том)[\s._-]*(\d+)", re.IGNORECASE)
+CHAPTER_RE = re.compile(r"\b(?:ch(?:apter)?|c|глава)[\s._-]*(\d+(?:[.,]\d+)?)", re.IGNORECASE)
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+class InvalidSource(Exception):
+    pass
+
+
+def natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def is_image(name):
+    filename = posixpath.basename(name)
+    return not filename.startswith(".") and posixpath.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def is_archive(name):
+    return os.path.splitext(name)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def parse_label(label, default_volume):
+    """Volume number, chapter number and title from a path like ``Vol 2/Chapter 10.5 - Title``."""
+    parts = [part for part in label.split("/") if part]
+    volume = VOLUME_RE.search(label)
+    volume_number = int(volume.group(1)) if volume else default_volume
+    name = parts[-1] if parts else ""
+    name, _, title = name.partition(" - ")
+    chapter = CHAPTER_RE.search(name)
+    if chapter is None:
+        remainder = VOLUME_RE.sub("", name)
+        chapter = NUMBER_RE.search(remainder)
+        if chapter is None:
+            raise InvalidSource(f"{label or '.'}: cannot tell the chapter number")
+        number = chapter.group()
+    else:
+        number = chapter.group(1)
+    whole, _, fraction = number.replace(",", ".").partition(".")
+    number = str(int(whole)) + (f".{fraction}" if fraction else "")
+    return volume_number, number, title.strip() or None
+
+
+def scan_archive(path, prefix=""):
+    with zipfile.ZipFile(path) as archive:
+        members = [info.filename for info in archive.infolist()
+                   if not info.is_dir() and is_image(info.filename) and "__MACOSX" not in info.filename]
+    groups = {}
+    for member in members:
+        groups.setdefault(posixpath.dirname(member), []).append(("zip", path, member))
+    if len(groups) == 1:
+        return [(prefix, pages) for pages in groups.values()]
+    return [(posixpath.join(prefix, directory), pages) for directory, pages in groups.items()]
+
+
+def scan_directory(root):
+    units = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".") and name != "__MACOSX"]
+        label = posixpath.normpath(posixpath.join(os.path.basename(os.path.abspath(root)),
+                                                  os.path.relpath(directory, root).replace(os.sep, "/")))
+        pages = [("file", os.path.join(directory, name), name) for name in filenames if is_image(name)]
+        if pages:
+            units.append((label, pages))
+        for name in filenames:
+            if is_archive(name):
+                units.extend(scan_archive(os.path.join(directory, name),
+                                          prefix=f"{label}/{os.path.splitext(name)[0]}"))
+    return units
+
+
+def scan(path, default_volume=1):
+    """Chapters found in a directory tree, zip or CBZ, in reading order.
+
+    Every directory or archive folder holding images is one chapter, its
+    pages ordered by file name. Volume and chapter numbers come from the
+    path ("Vol 2/Chapter 10.5 - Title"); chapters without a volume go to
+    ``default_volume``.
+    """
+    if os.path.isdir(path):
+        units = scan_directory(path)
+    elif is_archive(path):
+        units = scan_archive(path, prefix=os.path.splitext(os.path.basename(path))[0])
+    else:
+        raise InvalidSource(f"{path} is neither a directory nor a zip/CBZ archive")
+
+    chapters = {}
+    for label, pages in units:
+        volume_number, chapter_number, title = parse_label(label, default_volume)
+        key = (volume_number, chapter_number)
+        if key in chapters:
+            raise InvalidSource(f"{label}: volume {volume_number} chapter {chapter_number} appears twice")
+        pages.sort(key=lambda page: natural_key(page[-1]))
+        chapters[key] = SimpleNamespace(label=label, volume_number=volume_number, chapter_number=chapter_number,
+                                        title=title, pages=pages)
+    return sorted(chapters.values(), key=lambda chapter: (chapter.volume_number,
+                                                          Chapter.parse_sort_key(chapter.chapter_number)))
+
+
+def read_source(source):
+    kind, path, name = source
+    if kind == "zip":
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(name)
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def process_page(job):
+    """Decode, validate and store one page; runs in a worker process.
+
+    Returns ``(page_number, fields, error)`` where ``fields`` are the Page
+    columns derived from the file.
+    """
+    page_number, source, target, limits = job
+    try:
+        data = read_source(source)
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if width * height > limits["max_pixels"]:
+                raise ValueError(f"{width}x{height} is larger than {limits['max_pixels']} pixels")
+            image.load()
+            perceptual_hash = dhash(image)
+        if width < limits["min_width"] or height < limits["min_height"]:
+            raise ValueError(f"{width}x{height} is smaller than {limits['min_width']}x{limits['min_height']}")
+    except Exception as error:
+        return page_number, None, f"{source[-1]}: {error}"
+
+    storage = Page._meta.get_field("image").storage
+    if storage.exists(target):
+        storage.delete(target)
+    name = storage.save(target, ContentFile(data))
+    fields = {"image": name, "width": width, "height": height, "file_size": len(data),
+              "content_hash": hashlib.sha256(data).hexdigest(), "perceptual_hash": perceptual_hash,
+              "image_variants": []}
+    if limits["variants"]:
+        try:
+            fields["image_variants"] = derivatives.generate(storage, name, "page")
+        except Exception as error:
+            return page_number, fields, f"{source[-1]}: variants failed: {error}"
+    return page_number, fields, None
+
+
+def get_volumes(manga, numbers):
+    volumes = {}
+    for volume in Volume.objects.filter(manga=manga, volume_number__in=numbers).order_by("pk"):
+        volumes.setdefault(volume.volume_number, volume)
+    missing = [Volume(manga=manga, volume_number=number) for number in sorted(set(numbers) - set(volumes))]
+    for volume in Volume.objects.bulk_create(missing):
+        volumes[volume.volume_number] = volume
+    return volumes
+
+
+def ingest_chapter(manga, volume, source, run, limits):
+    """Create the chapter and its missing pages; existing pages are left alone.
+
+    ``run(process_page, jobs)`` processes the page files, in parallel or
+    inline. Nothing is written to the database when a page is invalid, so
+    the chapter can be fixed and ingested again.
+    """
+    chapter = Chapter.objects.filter(manga=manga, volume=volume, chapter_number=source.chapter_number).first()
+    existing = set()
+    if chapter is not None:
+        existing = set(chapter.pages.values_list("page_number", flat=True))
+    directory = page_image_directory(manga.subtitle, volume.volume_number, source.chapter_number)
+    storage = Page._meta.get_field("image").storage
+    jobs = [
+        (number, page, storage.generate_filename(f"{directory}/{page[-1].rsplit('/', 1)[-1]}"), limits)
+        for number, page in enumerate(source.pages, start=1) if number not in existing
+    ]
+    result = SimpleNamespace(chapter=chapter, created=False, pages=0, skipped=len(existing), errors=[])
+    if not jobs:
+        return result
+
+    processed = sorted(run(process_page, jobs), key=lambda item: item[0])
+    result.errors = [error for _, _, error in processed if error]
+    if any(fields is None for _, fields, _ in processed):
+        for _, fields, _ in processed:
+            if fields is not None:
+                storage.delete(fields["image"])
+                for variant in fields["image_variants"]:
+                    storage.delete(variant["name"])
+        return result
+
+    with transaction.atomic():
+        if chapter is None:
+            chapter = Chapter(volume=volume, manga=manga, chapter_number=source.chapter_number,
+                              volume_number=volume.volume_number,
+                              sort_key=Chapter.parse_sort_key(source.chapter_number),
+                              title=source.title, slug=f"chapter-{source.chapter_number}".replace(".", "-"))
+            Chapter.objects.bulk_create([chapter])
+            Manga.objects.filter(pk=manga.pk).update(chapters_count=F("chapters_count") + 1)
+            result.created = True
+        Page.objects.bulk_create(
+            [Page(chapter=chapter, manga=manga, page_number=number, **fields) for number, fields, _ in processed],
+            ignore_conflicts=True,
+        )
+    result.chapter = chapter
+    result.pages = len(processed)
+    return result
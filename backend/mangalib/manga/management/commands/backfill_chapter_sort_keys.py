@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from manga import response_cache
+from manga.feeds import invalidate_feeds
+from manga.models import Chapter
+
+
+class Command(BaseCommand):
+    help = "Recompute chapter sort keys from chapter numbers and copy volume numbers onto chapters"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        changed = []
+        chapters = (Chapter.objects.only("pk", "manga_id", "chapter_number", "sort_key", "volume_number")
+                    .annotate(current_volume_number=F("volume__volume_number")).order_by("pk"))
+        for chapter in chapters.iterator(chunk_size=batch_size):
+            sort_key = Chapter.parse_sort_key(chapter.chapter_number)
+            if (sort_key, chapter.current_volume_number) != (chapter.sort_key, chapter.volume_number):
+                chapter.sort_key, chapter.volume_number = sort_key, chapter.current_volume_number
+                changed.append(chapter)
+        Chapter.objects.bulk_update(changed, ["sort_key", "volume_number"], batch_size=batch_size)
+        if changed:
+            response_cache.invalidate("catalog", *{f"manga:{chapter.manga_id}" for chapter in changed})
+            invalidate_feeds()
+            if response_cache.is_process_local():
+                self.stdout.write(self.style.WARNING(response_cache.PROCESS_LOCAL_WARNING))
+        self.stdout.write(self.style.SUCCESS(f"Updated {len(changed)} chapter sort keys"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from manga import response_cache
+from manga.models import Page
+
+
+class Command(BaseCommand):
+    help = "Fill dimensions, byte sizes, content and perceptual hashes of pages uploaded before they were stored"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        pages = Page.objects.filter(Q(content_hash="") | Q(perceptual_hash=None)).exclude(image="").order_by("pk")
+        updated, missing = [], 0
+        for page in pages.iterator(chunk_size=options["batch_size"]):
+            try:
+                page.update_file_metadata()
+            except (FileNotFoundError, OSError):
+                missing += 1
+                continue
+            updated.append(page)
+            if len(updated) >= options["batch_size"]:
+                self.save(updated)
+                updated = []
+        self.save(updated)
+        if missing:
+            self.stdout.write(self.style.WARNING(f"{missing} pages have no readable image file"))
+
+    def save(self, pages):
+        if not pages:
+            return
+        Page.objects.bulk_update(pages, ["width", "height", "file_size", "content_hash", "perceptual_hash"])
+        response_cache.invalidate(*{f"chapter:{page.chapter_id}" for page in pages},
+                                  *{f"manga:{page.manga_id}" for page in pages})
+        self.stdout.write(self.style.SUCCESS(f"Updated {len(pages)} pages"))
@@ -0,0 +1,61 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from manga.models import Manga
+from manga.view_counter import ViewCounter
+
+
+class Command(BaseCommand):
+    help = ("Measure buffered view counting against one UPDATE per view. "
+            "Database writes run in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--views", type=int, default=100000)
+        parser.add_argument("--viewers", type=int, default=5000)
+        parser.add_argument("--naive-views", type=int, default=2000,
+                            help="Views written one UPDATE at a time for comparison")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        manga_ids = list(Manga.objects.values_list("pk", flat=True))
+        if not manga_ids:
+            raise CommandError("No manga in the database, seed some first")
+        rng = random.Random(options["seed"])
+        # Skew views towards a few hot titles, as on the home page.
+        weights = [1 / (rank + 1) for rank in range(len(manga_ids))]
+        views = [
+            (manga_id, f"user:{rng.randrange(options['viewers'])}")
+            for manga_id in rng.choices(manga_ids, weights, k=options["views"])
+        ]
+
+        counter = ViewCounter(dedup_window=60)
+        started = time.perf_counter()
+        for manga_id, viewer in views:
+            counter.record(manga_id, viewer)
+        record_time = time.perf_counter() - started
+        counted = sum(counter.pending.values())
+        titles = len(counter.pending)
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            written = counter.flush()
+            flush_time = time.perf_counter() - started
+
+            naive_views = views[:options["naive_views"]]
+            started = time.perf_counter()
+            for manga_id, _ in naive_views:
+                Manga.objects.filter(pk=manga_id).update(view_count=F("view_count") + 1)
+            naive_time = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"recorded {len(views)} views ({counted} after dedup) "
+                          f"in {record_time:.3f}s: {len(views) / record_time:,.0f} views/s")
+        self.stdout.write(f"flushed {written} views for {titles} manga "
+                          f"in {flush_time:.3f}s: {written / max(flush_time, 1e-9):,.0f} views/s")
+        self.stdout.write(f"naive UPDATE per view: {len(naive_views)} views in {naive_time:.3f}s: "
+                          f"{len(naive_views) / max(naive_time, 1e-9):,.0f} views/s")
+
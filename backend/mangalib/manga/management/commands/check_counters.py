@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from manga.models import Chapter, Comment, Genre, Manga, Rating, RatingComment, Tag
+from manga.utils import count_of, sum_of
+
+
+class Command(BaseCommand):
+    help = "Compare denormalized counters with the rows they count and optionally repair them"
+
+    counters = [
+        (Manga, "chapters_count", lambda: count_of(Chapter, "manga")),
+        (Manga, "ratings_count", lambda: count_of(Rating, "manga")),
+        (Comment, "score", lambda: sum_of(RatingComment, "comment", "vote")),
+        (Genre, "manga_count", lambda: count_of(Manga.genres.through, "genre")),
+        (Tag, "manga_count", lambda: count_of(Manga.tag.through, "tag")),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Overwrite wrong counters with the actual values")
+
+    def handle(self, *args, **options):
+        total_mismatches = 0
+        for model, field, actual in self.counters:
+            label = f"{model.__name__}.{field}"
+            mismatches = list(
+                model.objects.annotate(actual=actual()).exclude(**{field: F("actual")}).only("pk", field)
+            )
+            total_mismatches += len(mismatches)
+            for obj in mismatches:
+                self.stdout.write(f"{label} pk={obj.pk}: stored {getattr(obj, field)}, actual {obj.actual}")
+                setattr(obj, field, obj.actual)
+            if options["fix"] and mismatches:
+                model.objects.bulk_update(mismatches, [field], batch_size=500)
+                self.stdout.write(self.style.SUCCESS(f"{label}: fixed {len(mismatches)} rows"))
+
+        if not total_mismatches:
+            self.stdout.write(self.style.SUCCESS("All counters are consistent"))
+        elif not options["fix"]:
+            self.stdout.write(self.style.WARNING(f"{total_mismatches} inconsistent counters, rerun with --fix"))
@@ -0,0 +1,108 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from manga import response_cache
+from manga.feeds import invalidate_feeds
+from manga.models import Manga, Page
+from manga.storage import get_image_storage
+
+MODELS = (Manga, Page)
+
+
+class Command(BaseCommand):
+    help = ("Count references to the content-addressed image blobs and delete the blobs no manga or page "
+            "refers to any more. With --adopt, images stored before content addressing are moved into "
+            "blobs first, so duplicates among them are stored once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--adopt", action="store_true", help="Move legacy image files into blobs")
+        parser.add_argument("--min-age", type=int, default=60 * 60,
+                            help="Seconds a blob must exist before it can be collected, so uploads "
+                                 "whose rows are not committed yet are kept")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        storage = get_image_storage()
+        if options["adopt"]:
+            self.adopt(storage, dry_run=options["dry_run"])
+
+        references = self.count_references()
+        blobs = referenced = removed = removed_bytes = shared_bytes = 0
+        for name, size, age in storage.iter_blobs():
+            blobs += 1
+            referenced += references[name]
+            if references[name]:
+                shared_bytes += size * (references[name] - 1)
+            elif age >= options["min_age"]:
+                removed += 1
+                removed_bytes += size
+                if not options["dry_run"]:
+                    storage.purge(name)
+        for name, size, age in storage.iter_blobs(temporary=True):
+            if age >= options["min_age"] and not options["dry_run"]:
+                storage.purge(name)
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(f"{blobs} blobs, {referenced} references; "
+                          f"deduplication saves {shared_bytes} bytes")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} unreferenced blobs ({removed_bytes} bytes)"))
+
+    def count_references(self):
+        """How many image fields and variant lists point at each stored name."""
+        references = Counter()
+        for model in MODELS:
+            for field, variants_field, _ in model.image_variant_fields:
+                rows = model.objects.exclude(**{field: ""}).values_list(field, variants_field)
+                for name, variants in rows.iterator():
+                    references[name] += 1
+                    references.update(variant["name"] for variant in variants)
+        return references
+
+    def adopt(self, storage, dry_run=False):
+        adopted, missing, changed = {}, set(), {model: set() for model in MODELS}
+
+        def blob_for(name):
+            if not name or storage.is_blob(name) or name in missing:
+                return name
+            if name not in adopted:
+                if not storage.exists(name):
+                    missing.add(name)
+                    return name
+                with storage.open(name, "rb") as file:
+                    adopted[name] = name if dry_run else storage.save(name, file)
+            return adopted[name]
+
+        for model in MODELS:
+            for field, variants_field, _ in model.image_variant_fields:
+                rows = list(model.objects.exclude(**{field: ""}).values_list("pk", field, variants_field))
+                for pk, name, variants in rows:
+                    new_name = blob_for(name)
+                    new_variants = [{**variant, "name": blob_for(variant["name"])} for variant in variants]
+                    if (new_name, new_variants) == (name, variants) or dry_run:
+                        continue
+                    # Only rewrite rows that still point at the file that was adopted.
+                    model.objects.filter(pk=pk, **{field: name}).update(**{field: new_name,
+                                                                           variants_field: new_variants})
+                    changed[model].add(pk)
+
+        if not dry_run:
+            for name in adopted:
+                storage.delete(name)
+            self.invalidate(changed)
+        if missing:
+            self.stdout.write(self.style.WARNING(f"{len(missing)} referenced files do not exist"))
+        self.stdout.write(f"Adopted {len(adopted)} legacy files")
+
+    def invalidate(self, changed):
+        if not any(changed.values()):
+            return
+        pages = Page.objects.filter(pk__in=changed[Page]).values_list("chapter_id", "manga_id")
+        scopes = {"catalog"}
+        scopes.update(f"manga:{pk}" for pk in changed[Manga])
+        for chapter_id, manga_id in pages:
+            scopes.update((f"chapter:{chapter_id}", f"manga:{manga_id}"))
+        response_cache.invalidate(*scopes)
+        invalidate_feeds()
+        if response_cache.is_process_local():
+            self.stdout.write(self.style.WARNING(response_cache.PROCESS_LOCAL_WARNING))
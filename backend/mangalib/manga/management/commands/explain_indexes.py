@@ -0,0 +1,117 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from manga.models import Chapter, Comment, Manga, Page, Rating
+from manga.seeding import seed_catalog
+
+# Indexes and unique constraints matched to the API's hot queries.
+INDEXES = [
+    (Manga, "manga_view_count_idx"),
+    (Manga, "manga_created_idx"),
+    (Chapter, "chapter_manga_created_idx"),
+    (Chapter, "chapter_created_idx"),
+    (Page, "unique_chapter_page_number"),
+    (Comment, "comment_manga_root_idx"),
+    (Comment, "comment_manga_score_idx"),
+    (Comment, "comment_page_root_idx"),
+    (Comment, "comment_manga_reply_idx"),
+    (Rating, "unique_manga_rating"),
+]
+
+
+class Command(BaseCommand):
+    help = ("Seed a large catalog and print EXPLAIN plans and timings of the API's hot queries "
+            "with and without the query indexes. Everything runs in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--manga", type=int, default=1000)
+        parser.add_argument("--chapters", type=int, default=5, help="Chapters per volume")
+        parser.add_argument("--pages", type=int, default=15, help="Pages per chapter")
+        parser.add_argument("--comments", type=int, default=20, help="Comments per manga")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write("Seeding...")
+            catalog = seed_catalog(manga=options["manga"], volumes=2, chapters=options["chapters"],
+                                   pages=options["pages"], comments=options["comments"],
+                                   prefix="explain")
+            queries = self.get_queries(catalog)
+            self.analyze()
+            after = self.measure(queries, options["repeat"])
+            kept = self.drop_indexes()
+            self.analyze()
+            before = self.measure(queries, options["repeat"])
+            transaction.set_rollback(True)
+
+        if kept:
+            self.stdout.write(self.style.WARNING(f"Kept in the 'before' run: {', '.join(kept)}"))
+        for label, _ in queries:
+            (before_plan, before_time), (after_plan, after_time) = before[label], after[label]
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(f"  before ({before_time * 1000:.2f} ms):")
+            self.stdout.write(self.indent(before_plan))
+            self.stdout.write(f"  after ({after_time * 1000:.2f} ms, {before_time / max(after_time, 1e-9):.1f}x):")
+            self.stdout.write(self.indent(after_plan))
+
+    def get_queries(self, catalog):
+        manga = catalog.manga[len(catalog.manga) // 2]
+        chapter = catalog.chapters[len(catalog.chapters) // 2]
+        page = catalog.pages[len(catalog.pages) // 2]
+        root_comments = Comment.objects.filter(manga=manga, is_parent=False, is_page_comment=False)
+        return [
+            ("popular manga", Manga.objects.order_by("-view_count", "-pk")[:20]),
+            ("new manga", Manga.objects.order_by("-created_at", "-pk")[:20]),
+            ("popular manga with new chapters", Manga.objects.annotate(
+                latest_chapter_date=Max("chapters__created_at")
+            ).order_by("-view_count", "-latest_chapter_date")[:6]),
+            ("latest chapters", Chapter.objects.order_by("-created_at")[:50]),
+            ("chapter pages", Page.objects.filter(chapter=chapter).order_by("page_number")),
+            ("manga comments", root_comments.order_by("-created_at", "-pk")[:20]),
+            ("manga comments by score", root_comments.order_by("-score", "-pk")[:20]),
+            ("page comments", Comment.objects.filter(manga_page=page, is_parent=False).order_by("-created_at")[:20]),
+            ("comment replies", Comment.objects.filter(manga=manga, is_parent=True).order_by("pk")),
+            ("user rating", Rating.objects.filter(user=catalog.users[0], manga=manga)),
+        ]
+
+    def measure(self, queries, repeat):
+        results = {}
+        for label, queryset in queries:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - started)
+            results[label] = (queryset.explain(), min(timings))
+        return results
+
+    def drop_indexes(self):
+        """Drop the indexes; returns the constraints that had to be kept.
+
+        SQLite stores unique constraints inline in the table definition, so
+        they cannot be dropped without rebuilding the table.
+        """
+        editor = connection.schema_editor()
+        kept = []
+        with connection.cursor() as cursor:
+            for model, name in INDEXES:
+                index = next((index for index in model._meta.indexes if index.name == name), None)
+                if index is not None:
+                    cursor.execute(str(index.remove_sql(model, editor)))
+                elif connection.vendor == "sqlite":
+                    kept.append(name)
+                else:
+                    constraint = next(constraint for constraint in model._meta.constraints if constraint.name == name)
+                    cursor.execute(str(constraint.remove_sql(model, editor)))
+        return kept
+
+    def analyze(self):
+        if connection.vendor in ("sqlite", "postgresql"):
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+    def indent(self, text):
+        return "\n".join(f"    {line}" for line in text.splitlines())
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from manga.duplicates import MAX_DISTANCE, build_report, describe
+
+
+class Command(BaseCommand):
+    help = ("Report pages whose perceptual hashes are within --distance bits of each other, and chapters "
+            "that share at least --min-shared of their pages. Run backfill_page_metadata first for pages "
+            "uploaded before perceptual hashes were stored.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--distance", type=int, default=6, help=f"Maximum differing bits out of 64, at most {MAX_DISTANCE}")
+        parser.add_argument("--min-shared", type=float, default=0.5,
+                            help="Share of the smaller chapter's pages that must match")
+        parser.add_argument("--limit", type=int, default=100, help="Page pairs to list; 0 lists all")
+
+    def handle(self, *args, **options):
+        if not 0 <= options["distance"] <= MAX_DISTANCE:
+            raise CommandError(f"--distance must be between 0 and {MAX_DISTANCE}")
+        started = time.perf_counter()
+        report = build_report(options["distance"], options["min_shared"])
+        elapsed = time.perf_counter() - started
+        labels = describe(report, options["limit"])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Chapters ({len(report.chapters)})"))
+        for item in labels.matches:
+            self.stdout.write(f"  {labels.chapters[item.chapter_id]} ~ {labels.chapters[item.other_id]}: "
+                              f"{item.shared} pages ({item.ratio:.0%})")
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Pages ({len(report.pairs)})"))
+        for distance, page, other in labels.pairs:
+            self.stdout.write(f"  {labels.pages[page[0]]} ~ {labels.pages[other[0]]}: {distance} bits")
+        if len(labels.pairs) < len(report.pairs):
+            self.stdout.write(f"  ... {len(report.pairs) - len(labels.pairs)} more")
+        self.stdout.write(self.style.SUCCESS(
+            f"Compared {report.pages} pages in {elapsed:.2f}s: {len(report.pairs)} near-duplicate pairs, "
+            f"{len(report.chapters)} near-duplicate chapter pairs"
+        ))
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from manga import response_cache
+from manga.derivatives import build_variants
+from manga.models import Manga, Page
+
+
+class Command(BaseCommand):
+    help = "Generate resized WebP/AVIF variants for posters, backgrounds and pages that have none"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate variants that already exist")
+        parser.add_argument("--workers", type=int, default=4, help="Threads encoding images; 1 runs inline")
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model in (Manga, Page):
+            for field, variants_field, kind in model.image_variant_fields:
+                queryset = model.objects.exclude(**{field: ""})
+                if not options["all"]:
+                    queryset = queryset.filter(**{variants_field: []})
+                for pk, variants in queryset.values_list("pk", variants_field).iterator():
+                    stale = [variant["name"] for variant in variants]
+                    jobs.append((model._meta.label, pk, field, variants_field, kind, stale))
+
+        done = failed = 0
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                errors = list(executor.map(self.run, jobs))
+        else:
+            errors = [self.run(job, close_connection=False) for job in jobs]
+        for error in errors:
+            if error:
+                failed += 1
+                self.stderr.write(error)
+            else:
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f"Generated variants for {done} images, {failed} failed"))
+        if done and response_cache.is_process_local():
+            self.stdout.write(self.style.WARNING(response_cache.PROCESS_LOCAL_WARNING))
+
+    def run(self, job, close_connection=True):
+        try:
+            build_variants(*job)
+        except Exception as error:
+            return f"{job[0]} pk={job[1]} {job[2]}: {error}"
+        finally:
+            if close_connection:
+                close_old_connections()
+        return None
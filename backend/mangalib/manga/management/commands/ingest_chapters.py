@@ -0,0 +1,85 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from manga import ingest, response_cache
+from manga.feeds import invalidate_feeds
+from manga.models import Manga
+
+
+class Command(BaseCommand):
+    help = ("Import chapters from a directory, zip or CBZ: every folder of images is a chapter, "
+            "named like 'Vol 2/Chapter 10.5 - Title'. Chapters and pages that already exist are "
+            "skipped, so an interrupted import can be run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("manga", help="Slug or id of the manga")
+        parser.add_argument("path", help="Directory, .zip or .cbz to import")
+        parser.add_argument("--volume", type=int, default=1, help="Volume of chapters whose path names none")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Processes decoding and storing images; 1 runs inline")
+        parser.add_argument("--min-width", type=int, default=100)
+        parser.add_argument("--min-height", type=int, default=100)
+        parser.add_argument("--max-pixels", type=int, default=50_000_000)
+        parser.add_argument("--variants", action="store_true",
+                            help="Also encode WebP/AVIF variants in the workers (much slower)")
+
+    def handle(self, *args, **options):
+        lookup = {"pk": options["manga"]} if options["manga"].isdigit() else {"slug": options["manga"]}
+        manga = Manga.objects.filter(**lookup).only("id", "subtitle").first()
+        if manga is None:
+            raise CommandError(f"Manga {options['manga']!r} does not exist")
+        try:
+            sources = ingest.scan(options["path"], default_volume=options["volume"])
+        except (ingest.InvalidSource, OSError) as error:
+            raise CommandError(error)
+        if not sources:
+            raise CommandError(f"No images found in {options['path']}")
+
+        limits = {"min_width": options["min_width"], "min_height": options["min_height"],
+                  "max_pixels": options["max_pixels"], "variants": options["variants"]}
+        volumes = ingest.get_volumes(manga, [source.volume_number for source in sources])
+        started = time.perf_counter()
+        changed, failed = [], 0
+        executor = None
+        if options["workers"] > 1:
+            executor = ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup)
+        try:
+            def run(function, jobs):
+                if executor is None:
+                    return [function(job) for job in jobs]
+                return list(executor.map(function, jobs, chunksize=4))
+
+            for source in sources:
+                result = ingest.ingest_chapter(manga, volumes[source.volume_number], source, run, limits)
+                for error in result.errors:
+                    self.stderr.write(f"{source.label}: {error}")
+                if result.pages:
+                    changed.append(result.chapter)
+                    verb = "Created" if result.created else "Completed"
+                    self.stdout.write(f"{verb} volume {source.volume_number} chapter {source.chapter_number}: "
+                                      f"{result.pages} pages")
+                elif result.errors:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"Skipped {source.label}: invalid pages"))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            # bulk_create sends no signals, so do what the Chapter and Page receivers would have done.
+            if changed:
+                response_cache.invalidate("catalog", f"manga:{manga.pk}",
+                                          *(f"chapter:{chapter.pk}" for chapter in changed))
+                invalidate_feeds()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(changed)} chapters in {elapsed:.1f}s, "
+            f"{len(sources) - len(changed) - failed} already present, {failed} failed"
+        ))
+        if changed and response_cache.is_process_local():
+            self.stdout.write(self.style.WARNING(response_cache.PROCESS_LOCAL_WARNING))
+        if changed and not options["variants"]:
+            self.stdout.write("Run generate_image_derivatives to build the page variants")
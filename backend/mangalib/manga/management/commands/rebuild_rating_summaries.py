@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from manga.models import MangaRatingSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-manga rating summaries from the ratings table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("manga_ids", nargs="*", type=int, help="Only rebuild these manga")
+
+    def handle(self, *args, **options):
+        manga_ids = options["manga_ids"] or None
+        total = MangaRatingSummary.rebuild(manga_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} rating summaries"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from manga import response_cache, search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for manga"
+
+    def handle(self, *args, **options):
+        total = search.rebuild()
+        response_cache.invalidate("catalog")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} manga"))
+        if response_cache.is_process_local():
+            self.stdout.write(self.style.WARNING(response_cache.PROCESS_LOCAL_WARNING))
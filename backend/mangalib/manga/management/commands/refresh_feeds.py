@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from manga.feeds import FEEDS, refresh_feed
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cached home page feeds; run it from cron to keep them warm"
+
+    def add_arguments(self, parser):
+        parser.add_argument("feeds", nargs="*", help=f"Feeds to rebuild, default all of: {', '.join(FEEDS)}")
+
+    def handle(self, *args, **options):
+        names = options["feeds"] or list(FEEDS)
+        unknown = set(names) - set(FEEDS)
+        if unknown:
+            raise CommandError(f"Unknown feeds: {', '.join(sorted(unknown))}")
+        for name in names:
+            data = refresh_feed(name)
+            self.stdout.write(self.style.SUCCESS(f"{name}: {len(data)} items"))
@@ -0,0 +1,76 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    Manga = apps.get_model("manga", "Manga")
+    Rating = apps.get_model("manga", "Rating")
+    MangaRatingSummary = apps.get_model("manga", "MangaRatingSummary")
+
+    summaries = {
+        pk: MangaRatingSummary(manga_id=pk)
+        for pk in Manga.objects.values_list("pk", flat=True)
+    }
+    grouped = (
+        Rating.objects.values("manga_id", "star")
+        .annotate(total=models.Count("id"))
+        .order_by()
+    )
+    for row in grouped:
+        summary = summaries[row["manga_id"]]
+        summary.count += row["total"]
+        summary.total += row["star"] * row["total"]
+        if 1 <= row["star"] <= 10:
+            bucket = f"star_{row['star']}"
+            setattr(summary, bucket, getattr(summary, bucket) + row["total"])
+    for summary in summaries.values():
+        summary.average = summary.total / summary.count if summary.count else 0
+    MangaRatingSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0016_alter_chapter_chapter_number"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MangaRatingSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("total", models.PositiveIntegerField(default=0)),
+                ("average", models.FloatField(db_index=True, default=0)),
+                ("star_1", models.PositiveIntegerField(default=0)),
+                ("star_2", models.PositiveIntegerField(default=0)),
+                ("star_3", models.PositiveIntegerField(default=0)),
+                ("star_4", models.PositiveIntegerField(default=0)),
+                ("star_5", models.PositiveIntegerField(default=0)),
+                ("star_6", models.PositiveIntegerField(default=0)),
+                ("star_7", models.PositiveIntegerField(default=0)),
+                ("star_8", models.PositiveIntegerField(default=0)),
+                ("star_9", models.PositiveIntegerField(default=0)),
+                ("star_10", models.PositiveIntegerField(default=0)),
+                (
+                    "manga",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rating_summary",
+                        to="manga.manga",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+def count_chapters(apps, schema_editor):
+    Chapter = apps.get_model("manga", "Chapter")
+    Manga = apps.get_model("manga", "Manga")
+    Volume = apps.get_model("manga", "Volume")
+
+    Chapter.objects.filter(manga__isnull=True).update(
+        manga=models.Subquery(
+            Volume.objects.filter(pk=models.OuterRef("volume_id")).values("manga_id")[:1]
+        )
+    )
+    chapters = (
+        Chapter.objects.filter(manga=models.OuterRef("pk"))
+        .order_by()
+        .values("manga")
+        .annotate(total=models.Count("pk"))
+        .values("total")
+    )
+    Manga.objects.update(
+        chapters_count=models.functions.Coalesce(models.Subquery(chapters), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0017_mangaratingsummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manga",
+            name="chapters_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_chapters, migrations.RunPython.noop),
+    ]
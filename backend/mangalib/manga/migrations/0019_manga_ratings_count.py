@@ -0,0 +1,40 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+def count_ratings(apps, schema_editor):
+    Manga = apps.get_model("manga", "Manga")
+    Rating = apps.get_model("manga", "Rating")
+
+    ratings = (
+        Rating.objects.filter(manga=models.OuterRef("pk"))
+        .order_by()
+        .values("manga")
+        .annotate(total=models.Count("pk"))
+        .values("total")
+    )
+    Manga.objects.update(
+        ratings_count=models.functions.Coalesce(models.Subquery(ratings), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0018_manga_chapters_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manga",
+            name="ratings_count",
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name="manga",
+            name="chapters_count",
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(count_ratings, migrations.RunPython.noop),
+    ]
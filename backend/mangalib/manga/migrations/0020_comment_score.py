@@ -0,0 +1,62 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+def drop_duplicate_votes(apps, schema_editor):
+    RatingComment = apps.get_model("manga", "RatingComment")
+
+    latest = (
+        RatingComment.objects.values("user_id", "comment_id")
+        .annotate(keep=models.Max("pk"), total=models.Count("pk"))
+        .filter(total__gt=1)
+    )
+    for row in latest:
+        RatingComment.objects.filter(
+            user_id=row["user_id"], comment_id=row["comment_id"]
+        ).exclude(pk=row["keep"]).delete()
+
+
+def compute_scores(apps, schema_editor):
+    Comment = apps.get_model("manga", "Comment")
+    RatingComment = apps.get_model("manga", "RatingComment")
+
+    votes = (
+        RatingComment.objects.filter(comment=models.OuterRef("pk"))
+        .order_by()
+        .values("comment")
+        .annotate(total=models.Sum("vote"))
+        .values("total")
+    )
+    Comment.objects.update(
+        score=models.functions.Coalesce(models.Subquery(votes), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0019_manga_ratings_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="score",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["manga", "score"], name="comment_manga_score_idx"
+            ),
+        ),
+        migrations.RunPython(drop_duplicate_votes, migrations.RunPython.noop),
+        migrations.RunPython(compute_scores, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="ratingcomment",
+            constraint=models.UniqueConstraint(
+                fields=("user", "comment"), name="unique_comment_vote"
+            ),
+        ),
+    ]
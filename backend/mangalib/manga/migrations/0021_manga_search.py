@@ -0,0 +1,50 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    Manga = apps.get_model("manga", "Manga")
+    Author = apps.get_model("manga", "Author")
+    Painter = apps.get_model("manga", "Painter")
+    Genre = apps.get_model("manga", "Genre")
+    Tag = apps.get_model("manga", "Tag")
+    manga = Manga._meta.db_table
+    genres = Manga.genres.through._meta.db_table
+    tags = Manga.tag.through._meta.db_table
+
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS manga_search USING fts5("
+        "title, subtitle, description, people, tags, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+    )
+    schema_editor.execute(
+        "INSERT INTO manga_search (rowid, title, subtitle, description, people, tags) "
+        f"SELECT m.id, m.title, m.subtitle, m.description, "
+        f"COALESCE(a.name, '') || ' ' || COALESCE(p.name, ''), "
+        f"COALESCE((SELECT group_concat(g.name, ' ') FROM {genres} mg "
+        f"JOIN {Genre._meta.db_table} g ON g.id = mg.genre_id WHERE mg.manga_id = m.id), '') || ' ' || "
+        f"COALESCE((SELECT group_concat(t.name, ' ') FROM {tags} mt "
+        f"JOIN {Tag._meta.db_table} t ON t.id = mt.tag_id WHERE mt.manga_id = m.id), '') "
+        f"FROM {manga} m "
+        f"LEFT JOIN {Author._meta.db_table} a ON a.id = m.author_id "
+        f"LEFT JOIN {Painter._meta.db_table} p ON p.id = m.painter_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS manga_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0020_comment_score"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
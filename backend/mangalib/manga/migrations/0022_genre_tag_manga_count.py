@@ -0,0 +1,44 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def count_manga(apps, schema_editor):
+    Manga = apps.get_model("manga", "Manga")
+
+    for model_name, relation, column in (
+        ("Genre", "genres", "genre"),
+        ("Tag", "tag", "tag"),
+    ):
+        through = getattr(Manga, relation).through
+        manga = (
+            through.objects.filter(**{column: models.OuterRef("pk")})
+            .order_by()
+            .values(column)
+            .annotate(total=models.Count("pk"))
+            .values("total")
+        )
+        apps.get_model("manga", model_name).objects.update(
+            manga_count=models.functions.Coalesce(models.Subquery(manga), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0021_manga_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="genre",
+            name="manga_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="manga_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_manga, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:08
+
+import re
+
+from django.db import migrations, models
+
+
+def fill_sort_keys(apps, schema_editor):
+    Chapter = apps.get_model("manga", "Chapter")
+
+    chapters = []
+    for chapter in Chapter.objects.only("pk", "chapter_number").iterator(
+        chunk_size=2000
+    ):
+        match = re.search(r"\d+(?:[.,]\d+)?", chapter.chapter_number or "")
+        chapter.sort_key = float(match.group().replace(",", ".")) if match else 0
+        chapters.append(chapter)
+        if len(chapters) == 2000:
+            Chapter.objects.bulk_update(chapters, ["sort_key"])
+            chapters = []
+    Chapter.objects.bulk_update(chapters, ["sort_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0023_page_file_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chapter",
+            name="sort_key",
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="chapter",
+            index=models.Index(
+                fields=["manga", "sort_key", "id"], name="chapter_manga_sort_idx"
+            ),
+        ),
+    ]
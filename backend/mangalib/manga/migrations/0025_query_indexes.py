@@ -0,0 +1,135 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+def drop_duplicate_ratings(apps, schema_editor):
+    Manga = apps.get_model("manga", "Manga")
+    Rating = apps.get_model("manga", "Rating")
+    MangaRatingSummary = apps.get_model("manga", "MangaRatingSummary")
+
+    duplicates = (
+        Rating.objects.values("user_id", "manga_id")
+        .annotate(keep=models.Max("pk"), total=models.Count("pk"))
+        .filter(total__gt=1)
+    )
+    manga_ids = set()
+    for row in duplicates:
+        Rating.objects.filter(user_id=row["user_id"], manga_id=row["manga_id"]).exclude(
+            pk=row["keep"]
+        ).delete()
+        manga_ids.add(row["manga_id"])
+
+    stars = {
+        f"star_{star}": models.Count("pk", filter=models.Q(star=star))
+        for star in range(1, 11)
+    }
+    for manga_id in manga_ids:
+        summary = Rating.objects.filter(manga_id=manga_id).aggregate(
+            count=models.Count("pk"), total=models.Sum("star"), **stars
+        )
+        summary["total"] = summary["total"] or 0
+        summary["average"] = (
+            summary["total"] / summary["count"] if summary["count"] else 0
+        )
+        MangaRatingSummary.objects.update_or_create(manga_id=manga_id, defaults=summary)
+        Manga.objects.filter(pk=manga_id).update(ratings_count=summary["count"])
+
+
+def renumber_duplicate_pages(apps, schema_editor):
+    Page = apps.get_model("manga", "Page")
+
+    chapter_ids = (
+        Page.objects.values("chapter_id", "page_number")
+        .annotate(total=models.Count("pk"))
+        .filter(total__gt=1)
+        .values_list("chapter_id", flat=True)
+        .distinct()
+    )
+    for chapter_id in list(chapter_ids):
+        pages = list(
+            Page.objects.filter(chapter_id=chapter_id).order_by("page_number", "pk")
+        )
+        for number, page in enumerate(pages, 1):
+            page.page_number = number
+        Page.objects.bulk_update(pages, ["page_number"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0024_chapter_sort_key"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_ratings, migrations.RunPython.noop),
+        migrations.RunPython(renumber_duplicate_pages, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="comment",
+            name="comment_manga_score_idx",
+        ),
+        migrations.AddIndex(
+            model_name="chapter",
+            index=models.Index(
+                fields=["manga", "created_at"], name="chapter_manga_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chapter",
+            index=models.Index(fields=["created_at"], name="chapter_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("is_page_comment", False), ("is_parent", False)),
+                fields=["manga", "created_at", "id"],
+                name="comment_manga_root_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("is_page_comment", False), ("is_parent", False)),
+                fields=["manga", "score", "id"],
+                name="comment_manga_score_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("is_parent", False)),
+                fields=["manga_page", "created_at", "id"],
+                name="comment_page_root_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("is_parent", True)),
+                fields=["manga", "id"],
+                name="comment_manga_reply_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="manga",
+            index=models.Index(
+                fields=["view_count", "id"], name="manga_view_count_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="manga",
+            index=models.Index(fields=["created_at", "id"], name="manga_created_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="page",
+            constraint=models.UniqueConstraint(
+                fields=("chapter", "page_number"), name="unique_chapter_page_number"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="rating",
+            constraint=models.UniqueConstraint(
+                fields=("user", "manga"), name="unique_manga_rating"
+            ),
+        ),
+    ]
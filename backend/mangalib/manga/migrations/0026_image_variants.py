@@ -0,0 +1,28 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0025_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="manga",
+            name="backround_image_variants",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name="manga",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name="page",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
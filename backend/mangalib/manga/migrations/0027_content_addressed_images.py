@@ -0,0 +1,40 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:27
+
+from django.db import migrations, models
+import manga.storage
+import manga.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0026_image_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="manga",
+            name="backround_image",
+            field=models.ImageField(
+                blank=True,
+                storage=manga.storage.get_image_storage,
+                upload_to=manga.utils.background_image_upload_path,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="manga",
+            name="image",
+            field=models.ImageField(
+                storage=manga.storage.get_image_storage,
+                upload_to=manga.utils.poster_image_upload_path,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="page",
+            name="image",
+            field=models.ImageField(
+                storage=manga.storage.get_image_storage,
+                upload_to=manga.utils.page_image_upload_path,
+            ),
+        ),
+    ]
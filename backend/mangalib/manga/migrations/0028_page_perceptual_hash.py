@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0027_content_addressed_images"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="page",
+            name="perceptual_hash",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_volume_numbers(apps, schema_editor):
+    Chapter = apps.get_model("manga", "Chapter")
+    Volume = apps.get_model("manga", "Volume")
+
+    Chapter.objects.update(
+        volume_number=Subquery(Volume.objects.filter(pk=OuterRef("volume_id")).values("volume_number")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("manga", "0028_page_perceptual_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chapter",
+            name="volume_number",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_volume_numbers, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="chapter",
+            name="chapter_manga_sort_idx",
+        ),
+        migrations.AddIndex(
+            model_name="chapter",
+            index=models.Index(
+                fields=["manga", "volume_number", "sort_key", "id"], name="chapter_manga_sort_idx"
+            ),
+        ),
+    ]
@@ -1,13 +1,46 @@
-from django.db import models
-from django.db.models import Avg, Count
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from .utils import background_image_upload_path, poster_image_upload_path, page_image_upload_path
+from . import derivatives
+from .storage import get_image_storage
+from .utils import (background_image_upload_path, poster_image_upload_path, page_image_upload_path, count_of,
+                    file_dhash, file_sha256)
 
 User = get_user_model()
 
 
+class ImageVariantsMixin:
+    """Schedule image variants for every newly uploaded file in ``image_variant_fields``.
+
+    Each entry is ``(image field, variants JSON field, kind)``; ``kind`` picks
+    the widths in ``IMAGE_DERIVATIVE_WIDTHS``. Variants of a replaced file are
+    dropped right away and their files deleted once the new ones exist.
+    """
+
+    image_variant_fields = ()
+
+    def save(self, *args, **kwargs):
+        changed = []
+        for field, variants_field, kind in self.image_variant_fields:
+            field_file = getattr(self, field)
+            if field_file and not field_file._committed:
+                stale = [variant["name"] for variant in getattr(self, variants_field)]
+                changed.append((field, variants_field, kind, stale))
+                setattr(self, variants_field, [])
+        super().save(*args, **kwargs)
+        for field, variants_field, kind, stale in changed:
+            derivatives.schedule(self, field, variants_field, kind, stale)
+
+
 class AbstractModel(models.Model):
     name = models.CharField(max_length=50)
 
@@ -19,7 +52,7 @@ class AbstractModel(models.Model):
     
 
 class Genre(AbstractModel):
-    pass
+    manga_count = models.PositiveIntegerField(default=0)
 
 
 class Author(AbstractModel):
@@ -35,10 +68,10 @@ class Painter(AbstractModel):
 
 
 class Tag(AbstractModel):
-    pass
+    manga_count = models.PositiveIntegerField(default=0)
 
 
-class Manga(models.Model):
+class Manga(ImageVariantsMixin, models.Model):
     MANGA_TYPE = (
         ("manga", "Manga"),
         ("manhwa", "Manhwa"),
@@ -58,19 +91,31 @@ class Manga(models.Model):
         ("18+", "18+")
     )
 
+    USER_LIST_STATUSES = (
+        ("reading", "read"),
+        ("planned", "planned"),
+        ("dropped", "dropped"),
+        ("readed", "readed"),
+        ("favorite", "favorite"),
+    )
+
     title = models.CharField(max_length=300)
     subtitle = models.CharField(max_length=300)
     description = models.TextField()
     type = models.CharField(max_length=20, choices=MANGA_TYPE)
     age_rating = models.CharField(max_length=20, choices=AGE_RATING)
-    image = models.ImageField(upload_to=poster_image_upload_path)
+    image = models.ImageField(upload_to=poster_image_upload_path, storage=get_image_storage)
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
     related_manga = models.ManyToManyField("self", blank=True)
     release_year = models.PositiveIntegerField()
     status = models.CharField(max_length=30, choices=MANGA_STATUS, default="planned")
-    backround_image = models.ImageField(upload_to=background_image_upload_path, blank=True)
+    backround_image = models.ImageField(upload_to=background_image_upload_path, storage=get_image_storage, blank=True)
+    backround_image_variants = models.JSONField(default=list, blank=True, editable=False)
     genres = models.ManyToManyField(Genre)
     tag = models.ManyToManyField(Tag, blank=True)
     view_count = models.IntegerField(default=0)
+    chapters_count = models.PositiveIntegerField(default=0, db_index=True)
+    ratings_count = models.PositiveIntegerField(default=0, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='manga')
@@ -78,43 +123,92 @@ class Manga(models.Model):
     painter = models.ForeignKey(Painter, on_delete=models.CASCADE, related_name='manga')
     slug = models.SlugField(unique=True, null=True)
 
+    image_variant_fields = (
+        ("image", "image_variants", "poster"),
+        ("backround_image", "backround_image_variants", "background"),
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["view_count", "id"], name="manga_view_count_idx"),
+            models.Index(fields=["created_at", "id"], name="manga_created_idx"),
+        ]
+
     def __str__(self):
         return self.title
     
     def get_total_chapters(self):
-        total = 0
-        for volume in self.volumes.all():
-            total += volume.chapters.count()
-        return total
+        return self.chapters_count
     
+    def get_rating_summary(self):
+        try:
+            return self.rating_summary
+        except ObjectDoesNotExist:
+            return None
+
     def get_avg_rating(self):
-        avg_rating = self.ratings.aggregate(Avg('star')).get('star__avg')
-        return avg_rating or 0
-    
+        summary = self.get_rating_summary()
+        return summary.average if summary else 0
+
     def get_ratings(self):
-        ratings = self.ratings.all()
-        rating_counts = {i: 0 for i in range(1, 11)}
-        total_ratings = ratings.count()
-        for rating in ratings:
-            rating_counts[rating.star] += 1
-        rating_data = []
-        for star, total_rated in rating_counts.items():
-            percent = (total_rated / total_ratings) * 100 if total_ratings > 0 else 0
-            rating_data.append({"star": star, "total": total_rated, "percent": percent})
-        return {"total_rated": total_ratings, "ratings": rating_data}
+        summary = self.get_rating_summary()
+        if summary is None:
+            summary = MangaRatingSummary.from_ratings(self.ratings.all()).get(self.pk)
+        if summary is None:
+            summary = MangaRatingSummary(manga=self)
+        return summary.get_histogram()
+
+    @classmethod
+    def get_ratings_bulk(cls, manga_ids):
+        return MangaRatingSummary.histograms(manga_ids)
     
     def get_user_list(self):
-        user_list = [
-            {"status": "read", "total": self.readers.count()},
-            {"status": "planned", "total": self.plans.count()},
-            {"status": "dropped", "total": self.drops.count()},
-            {"status": "readed", "total": self.read.count()},
-            {"status": "favorite", "total": self.favorites.count()},
-        ]
-        total_users = sum(item["total"] for item in user_list)
-        for item in user_list:
-            item["percent"] = (item["total"] / total_users) * 100 if total_users > 0 else 0
-        return {"total_users": total_users, "user_list": user_list}
+        return Manga.get_user_list_bulk([self.pk])[self.pk]
+
+    @staticmethod
+    def user_list_cache_key(manga_id):
+        return f"manga:{manga_id}:user_list"
+
+    @classmethod
+    def get_user_list_bulk(cls, manga_ids):
+        """Return user-list statistics for many manga, keyed by manga id.
+
+        Cached entries are served as is; the rest are computed with one query
+        grouped by manga and list type, then cached until a MangaUserList row
+        of that manga changes.
+        """
+        manga_ids = list(manga_ids)
+        keys = {pk: cls.user_list_cache_key(pk) for pk in manga_ids}
+        cached = cache.get_many(keys.values())
+        stats = {pk: cached[key] for pk, key in keys.items() if key in cached}
+        missing = [pk for pk in manga_ids if pk not in stats]
+        if not missing:
+            return stats
+
+        MangaUserList = apps.get_model("users", "MangaUserList")
+        counts = {pk: {} for pk in missing}
+        grouped = (
+            MangaUserList.objects.filter(manga_id__in=missing)
+            .values("manga_id", "list_type")
+            .annotate(total=Count("id"))
+            .order_by()
+        )
+        for row in grouped:
+            counts[row["manga_id"]][row["list_type"]] = row["total"]
+
+        fresh = {}
+        for pk, totals in counts.items():
+            user_list = [
+                {"status": status, "total": totals.get(list_type, 0)}
+                for list_type, status in cls.USER_LIST_STATUSES
+            ]
+            total_users = sum(item["total"] for item in user_list)
+            for item in user_list:
+                item["percent"] = (item["total"] / total_users) * 100 if total_users > 0 else 0
+            fresh[pk] = {"total_users": total_users, "user_list": user_list}
+        cache.set_many({keys[pk]: data for pk, data in fresh.items()}, settings.USER_LIST_CACHE_TIMEOUT)
+        stats.update(fresh)
+        return stats
 
 
 class Volume(models.Model):
@@ -124,29 +218,126 @@ class Volume(models.Model):
     def __str__(self):
         return f"Manga: {self.manga.title} Volume: {self.volume_number}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            # Chapters keep a copy of the number for ordering.
+            self.chapters.exclude(volume_number=self.volume_number).update(volume_number=self.volume_number)
+
 
 class Chapter(models.Model):
     volume = models.ForeignKey(Volume, on_delete=models.CASCADE, related_name="chapters")
     manga = models.ForeignKey(Manga, on_delete=models.CASCADE, related_name="chapters", default=None, blank=True, null=True)
     chapter_number = models.CharField(max_length=1000)
+    volume_number = models.IntegerField(default=0, editable=False)
+    sort_key = models.FloatField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     title = models.CharField(max_length=100, null=True)
     slug = models.SlugField(null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["manga", "volume_number", "sort_key", "id"], name="chapter_manga_sort_idx"),
+            models.Index(fields=["manga", "created_at"], name="chapter_manga_created_idx"),
+            models.Index(fields=["created_at"], name="chapter_created_idx"),
+        ]
+
     def __str__(self):
         return f"Manga: {self.volume.manga.title}: Chapter: {self.title}"
 
-
-class Page(models.Model):
+    # Reading order: by volume, then by the chapter number's numeric value.
+    READING_ORDER = ("volume_number", "sort_key", "pk")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The manga the row belongs to in the database, to move the chapter count when it changes.
+        instance.saved_manga_id = instance.__dict__.get("manga_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.manga_id = self.volume.manga_id
+        self.volume_number = self.volume.volume_number
+        self.sort_key = self.parse_sort_key(self.chapter_number)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def parse_sort_key(chapter_number):
+        """Numeric value of the first number in ``chapter_number`` ("10.5", "Ch. 7,5"), 0 if there is none."""
+        match = re.search(r"\d+(?:[.,]\d+)?", chapter_number or "")
+        return float(match.group().replace(",", ".")) if match else 0
+
+    def get_previous_chapters(self):
+        return Chapter.objects.filter(
+            Q(volume_number__lt=self.volume_number)
+            | Q(volume_number=self.volume_number, sort_key__lt=self.sort_key)
+            | Q(volume_number=self.volume_number, sort_key=self.sort_key, pk__lt=self.pk),
+            manga_id=self.manga_id,
+        ).order_by(*(f"-{field}" for field in self.READING_ORDER))
+
+    def get_next_chapters(self):
+        return Chapter.objects.filter(
+            Q(volume_number__gt=self.volume_number)
+            | Q(volume_number=self.volume_number, sort_key__gt=self.sort_key)
+            | Q(volume_number=self.volume_number, sort_key=self.sort_key, pk__gt=self.pk),
+            manga_id=self.manga_id,
+        ).order_by(*self.READING_ORDER)
+
+    def with_neighbours(self):
+        """This chapter with its previous and next chapter, fetched by one indexed query."""
+        return Chapter.objects.filter(
+            Q(pk=self.pk)
+            | Q(pk=Subquery(self.get_previous_chapters().values("pk")[:1]))
+            | Q(pk=Subquery(self.get_next_chapters().values("pk")[:1]))
+        ).order_by(*self.READING_ORDER)
+
+    @classmethod
+    def get_last_chapters(cls, manga_ids):
+        """Map each manga id to its last chapter in reading order, in one query."""
+        last = (cls.objects.filter(manga_id=OuterRef("manga_id"))
+                .order_by(*(f"-{field}" for field in cls.READING_ORDER)).values("pk")[:1])
+        chapters = cls.objects.filter(manga_id__in=manga_ids, pk=Subquery(last)).select_related("volume")
+        return {chapter.manga_id: chapter for chapter in chapters}
+
+
+class Page(ImageVariantsMixin, models.Model):
     chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE, related_name="pages")
     manga = models.ForeignKey(Manga, on_delete=models.CASCADE, related_name="pages", default=None, blank=True, null=True)
     page_number = models.IntegerField()
-    image = models.ImageField(upload_to=page_image_upload_path)
+    image = models.ImageField(upload_to=page_image_upload_path, storage=get_image_storage)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
+
+    image_variant_fields = (("image", "image_variants", "page"),)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["chapter", "page_number"], name="unique_chapter_page_number"),
+        ]
 
     def __str__(self):
         return f"Manga: {self.chapter.volume.manga.title} Page number: {self.page_number}"
 
+    def save(self, *args, **kwargs):
+        # Only a new upload is read here; rows saved before the metadata
+        # columns existed are filled by the backfill command.
+        if self.image and not self.image._committed:
+            self.update_file_metadata()
+        super().save(*args, **kwargs)
+
+    def update_file_metadata(self):
+        """Fill the dimensions, byte size, sha256 and perceptual hash of the image from its file."""
+        self.width, self.height = self.image.width, self.image.height
+        self.file_size = self.image.size
+        self.content_hash = file_sha256(self.image)
+        self.perceptual_hash = file_dhash(self.image)
+
 
 class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -156,9 +347,21 @@ class Comment(models.Model):
     is_page_comment = models.BooleanField(default=False)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
     is_parent = models.BooleanField(default=False)
+    score = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["manga", "created_at", "id"], name="comment_manga_root_idx",
+                         condition=Q(is_parent=False, is_page_comment=False)),
+            models.Index(fields=["manga", "score", "id"], name="comment_manga_score_idx",
+                         condition=Q(is_parent=False, is_page_comment=False)),
+            models.Index(fields=["manga_page", "created_at", "id"], name="comment_page_root_idx",
+                         condition=Q(is_parent=False)),
+            models.Index(fields=["manga", "id"], name="comment_manga_reply_idx", condition=Q(is_parent=True)),
+        ]
+
     def __str__(self):
         return f'Author {self.author} Manga: {self.manga.title}'
 
@@ -168,6 +371,11 @@ class RatingComment(models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="ratings")
     vote = models.IntegerField(choices=[(1, 'Like'), (-1, 'Dislike')])
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "comment"], name="unique_comment_vote"),
+        ]
+
 
 class Rating(models.Model):
     user = models.ForeignKey(
@@ -179,6 +387,137 @@ class Rating(models.Model):
     )
     manga = models.ForeignKey(Manga, on_delete=models.CASCADE, related_name="ratings")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "manga"], name="unique_manga_rating"),
+        ]
+
     def __str__(self):
         return f"User {self.user.username} Manga: {self.manga.title} Rating: {self.star}"
-    
+
+
+class MangaRatingSummary(models.Model):
+    STARS = range(1, 11)
+
+    manga = models.OneToOneField(Manga, on_delete=models.CASCADE, related_name="rating_summary")
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0, db_index=True)
+    star_1 = models.PositiveIntegerField(default=0)
+    star_2 = models.PositiveIntegerField(default=0)
+    star_3 = models.PositiveIntegerField(default=0)
+    star_4 = models.PositiveIntegerField(default=0)
+    star_5 = models.PositiveIntegerField(default=0)
+    star_6 = models.PositiveIntegerField(default=0)
+    star_7 = models.PositiveIntegerField(default=0)
+    star_8 = models.PositiveIntegerField(default=0)
+    star_9 = models.PositiveIntegerField(default=0)
+    star_10 = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Manga: {self.manga_id} Ratings: {self.count} Average: {self.average:.2f}"
+
+    @staticmethod
+    def bucket(star):
+        return f"star_{star}"
+
+    def get_histogram(self):
+        rating_data = []
+        for star in self.STARS:
+            total_rated = getattr(self, self.bucket(star))
+            percent = (total_rated / self.count) * 100 if self.count > 0 else 0
+            rating_data.append({"star": star, "total": total_rated, "percent": percent})
+        return {"total_rated": self.count, "ratings": rating_data}
+
+    @classmethod
+    def apply(cls, manga_id, added=None, removed=None):
+        """Shift the summary of a manga by one added and/or removed star.
+
+        Runs as a single UPDATE built from F() expressions, so concurrent votes
+        never overwrite each other. A missing summary row is rebuilt from the
+        ratings table instead, which already reflects the change.
+        """
+        count_delta = (added is not None) - (removed is not None)
+        total_delta = (added or 0) - (removed or 0)
+        bucket_deltas = {}
+        if added in cls.STARS:
+            bucket_deltas[cls.bucket(added)] = bucket_deltas.get(cls.bucket(added), 0) + 1
+        if removed in cls.STARS:
+            bucket_deltas[cls.bucket(removed)] = bucket_deltas.get(cls.bucket(removed), 0) - 1
+        changes = {bucket: F(bucket) + delta for bucket, delta in bucket_deltas.items() if delta}
+        updated = cls.objects.filter(manga_id=manga_id).update(
+            count=F("count") + count_delta,
+            total=F("total") + total_delta,
+            average=Coalesce(
+                Cast(F("total") + total_delta, FloatField()) / NullIf(F("count") + count_delta, 0),
+                Value(0.0),
+            ),
+            **changes,
+        )
+        if not updated:
+            cls.rebuild([manga_id])
+        elif count_delta:
+            Manga.objects.filter(pk=manga_id).update(ratings_count=F("ratings_count") + count_delta)
+
+    @classmethod
+    def from_ratings(cls, ratings, summaries=None):
+        """Build unsaved summaries from one grouped query over ``ratings``.
+
+        Returns a dict keyed by manga id. When ``summaries`` is passed, only
+        those entries are filled and ratings of other manga are ignored.
+        """
+        fill_all = summaries is None
+        summaries = {} if fill_all else summaries
+        grouped = ratings.values("manga_id", "star").annotate(total=Count("id")).order_by()
+        for row in grouped:
+            summary = summaries.get(row["manga_id"])
+            if summary is None:
+                if not fill_all:
+                    continue
+                summary = summaries[row["manga_id"]] = cls(manga_id=row["manga_id"])
+            summary.count += row["total"]
+            summary.total += row["star"] * row["total"]
+            if row["star"] in cls.STARS:
+                bucket = cls.bucket(row["star"])
+                setattr(summary, bucket, getattr(summary, bucket) + row["total"])
+        for summary in summaries.values():
+            summary.average = summary.total / summary.count if summary.count else 0
+        return summaries
+
+    @classmethod
+    def histograms(cls, manga_ids):
+        """Return rating histograms for many manga, keyed by manga id.
+
+        Reads the stored summaries in one query and falls back to a single
+        grouped query over ratings for manga that have no summary yet.
+        """
+        manga_ids = list(manga_ids)
+        summaries = {summary.manga_id: summary for summary in cls.objects.filter(manga_id__in=manga_ids)}
+        missing = [pk for pk in manga_ids if pk not in summaries]
+        if missing:
+            summaries.update(cls.from_ratings(Rating.objects.filter(manga_id__in=missing)))
+        return {
+            pk: (summaries.get(pk) or cls(manga_id=pk)).get_histogram()
+            for pk in manga_ids
+        }
+
+    @classmethod
+    def rebuild(cls, manga_ids=None):
+        """Recompute summaries from scratch, for the given manga or the whole catalog."""
+        mangas = Manga.objects.all()
+        ratings = Rating.objects.all()
+        if manga_ids is not None:
+            mangas = mangas.filter(pk__in=manga_ids)
+            ratings = ratings.filter(manga_id__in=manga_ids)
+
+        summaries = {pk: cls(manga_id=pk) for pk in mangas.values_list("pk", flat=True)}
+        cls.from_ratings(ratings, summaries)
+
+        with transaction.atomic():
+            existing = cls.objects.all()
+            if manga_ids is not None:
+                existing = existing.filter(manga_id__in=manga_ids)
+            existing.delete()
+            cls.objects.bulk_create(summaries.values(), batch_size=500)
+            mangas.update(ratings_count=count_of(Rating, "manga"))
+        return len(summaries)
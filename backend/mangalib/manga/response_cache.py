@@ -0,0 +1,151 @@
+import hashlib
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+HITS_KEY = "response-cache:hits"
+MISSES_KEY = "response-cache:misses"
+
+PROCESS_LOCAL_WARNING = (
+    "The response and feed caches are local to this process, so servers keep their cached responses until "
+    "they expire. Use a shared cache backend for changes made by commands to show up right away."
+)
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def generation_key(scope):
+    return f"response-cache:generation:{scope}"
+
+
+def get_generations(scopes):
+    """The current generation of each scope.
+
+    A scope without a stored generation (never invalidated, or culled from
+    the cache) gets a fresh one, so entries built before its generation was
+    lost can never match again.
+    """
+    cache = get_cache()
+    keys = {scope: generation_key(scope) for scope in scopes}
+    stored = cache.get_many(keys.values())
+    missing = {key: uuid.uuid4().hex for key in keys.values() if key not in stored}
+    if missing:
+        for key, generation in missing.items():
+            cache.add(key, generation, timeout=None)
+        stored.update(cache.get_many(missing))
+    return {scope: stored.get(key, missing.get(key)) for scope, key in keys.items()}
+
+
+def is_process_local():
+    """Whether invalidations made here stay in this process, e.g. when run from a management command."""
+    return any(isinstance(caches[alias], LocMemCache) for alias in ("default", settings.RESPONSE_CACHE_ALIAS))
+
+
+def invalidate(*scopes):
+    """Retire every cached response that depends on one of ``scopes``."""
+    get_cache().set_many({generation_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats():
+    stored = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = stored.get(HITS_KEY, 0), stored.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0}
+
+
+def get_etag(data):
+    return f'"{hashlib.sha1(JSONRenderer().render(data)).hexdigest()}"'
+
+
+def not_modified(request, etag):
+    return etag in (tag.strip() for tag in request.headers.get("If-None-Match", "").split(","))
+
+
+def response_cache_key(request):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+        if value != ""
+    )
+    raw = f"{request.path}?{urlencode(params)}"
+    return f"response-cache:entry:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def cached_response(*scopes):
+    """Cache successful GET responses of a view method.
+
+    Entries are keyed on the path plus the sorted, non-empty query
+    parameters. Each entry remembers the generation of every scope it was
+    built from; ``invalidate`` replaces a scope's generation, which turns
+    all entries built from it into misses. ``{pk}`` and ``{obj.<field>}``
+    placeholders in a scope are filled from the view's object, which is
+    loaded once (see ``ResponseCacheMixin``) before the method runs.
+
+    Responses carry a strong ETag; a matching ``If-None-Match`` is answered
+    with 304, straight from the cache on a hit.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method != "GET":
+                return method(view, request, *args, **kwargs)
+
+            cache = get_cache()
+            key = response_cache_key(request)
+            entry = cache.get(key)
+            if entry is not None and get_generations(entry["generations"]) == entry["generations"]:
+                count(HITS_KEY)
+                view.cached_pk = entry["pk"]
+                headers = {"X-Cache": "HIT", "ETag": entry["etag"]}
+                if not_modified(request, entry["etag"]):
+                    return Response(status=304, headers=headers)
+                return Response(entry["data"], status=entry["status"], headers=headers)
+
+            count(MISSES_KEY)
+            # Read the generations before the data: an invalidation landing
+            # while the view runs then makes this entry a miss instead of
+            # storing stale data under the new generation.
+            obj = view.get_object() if any("{" in scope for scope in scopes) else None
+            pk = view.cached_pk = getattr(obj, "pk", None)
+            generations = get_generations([scope.format(pk=pk, obj=obj) for scope in scopes])
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                etag = response["ETag"] = get_etag(response.data)
+                entry = {"data": response.data, "status": response.status_code, "pk": pk,
+                         "generations": generations, "etag": etag}
+                cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+                if not_modified(request, etag):
+                    response = Response(status=304, headers={"ETag": etag})
+            response["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
+
+
+class ResponseCacheMixin:
+    """Reuse the object loaded by the view when a cached response needs its primary key."""
+
+    cached_pk = None
+
+    def get_object(self):
+        if not hasattr(self, "_object"):
+            self._object = super().get_object()
+        return self._object
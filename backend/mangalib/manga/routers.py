@@ -4,7 +4,8 @@ from rest_framework import routers
 from .views import (MangaViewSet,
                     GenresListAPIView, 
                     MangaTypeAPIView, 
-                    CommentViewSet, TagListAPIView, ChapterViewSet, RatingViewSet)
+                    CommentViewSet, TagListAPIView, ChapterViewSet, RatingViewSet,
+                    ResponseCacheStatsAPIView)
 
 
 router = routers.DefaultRouter()
@@ -17,7 +18,8 @@ urlpatterns = [
     path("rating/user_rating/<int:manga_pk>/", RatingViewSet.as_view({"get": "user_rating"})),
     path("genres/", GenresListAPIView.as_view()),
     path("tags/", TagListAPIView.as_view()),
-    path("types/", MangaTypeAPIView.as_view())
+    path("types/", MangaTypeAPIView.as_view()),
+    path("cache/stats/", ResponseCacheStatsAPIView.as_view()),
 ]
 
 urlpatterns += router.urls
\ No newline at end of file
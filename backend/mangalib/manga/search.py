@@ -0,0 +1,114 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Manga
+
+TABLE = "manga_search"
+# bm25() weights for title, subtitle, description, people and tags.
+WEIGHTS = (10.0, 8.0, 1.0, 4.0, 2.0)
+BATCH_SIZE = 2000
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    "title, subtitle, description, people, tags, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+)
+
+_available = False
+
+
+def is_available():
+    """Whether the FTS5 index exists; other database vendors fall back to LIKE search."""
+    global _available
+    if not _available and connection.vendor == "sqlite":
+        _available = TABLE in connection.introspection.table_names()
+    return _available
+
+
+def build_match_query(text):
+    """Turn free user input into an FTS5 query where every word must match as a prefix."""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def matching_ids(match):
+    return RawSQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [match])
+
+
+def rank(match):
+    weights = ", ".join(str(weight) for weight in WEIGHTS)
+    return RawSQL(
+        f"SELECT bm25({TABLE}, {weights}) FROM {TABLE} "
+        f"WHERE {TABLE} MATCH %s AND rowid = {Manga._meta.db_table}.id",
+        [match],
+        output_field=FloatField(),
+    )
+
+
+def search(queryset, text):
+    """Filter ``queryset`` to manga matching ``text`` and annotate ``search_rank`` (lower is better)."""
+    match = build_match_query(text)
+    if match is None:
+        return queryset
+    return queryset.filter(pk__in=matching_ids(match)).annotate(search_rank=rank(match))
+
+
+def get_documents(manga_ids):
+    mangas = (
+        Manga.objects.filter(pk__in=manga_ids)
+        .select_related("author", "painter")
+        .prefetch_related("genres", "tag")
+        .only("id", "title", "subtitle", "description", "author__name", "painter__name")
+    )
+    for manga in mangas:
+        people = f"{manga.author.name} {manga.painter.name}"
+        tags = " ".join([genre.name for genre in manga.genres.all()] + [tag.name for tag in manga.tag.all()])
+        yield manga.pk, manga.title, manga.subtitle, manga.description, people, tags
+
+
+def remove_manga(manga_ids):
+    if not is_available():
+        return
+    manga_ids = list(manga_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(manga_ids), BATCH_SIZE):
+            batch = manga_ids[start:start + BATCH_SIZE]
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({placeholders})", batch)
+
+
+def index_manga(manga_ids):
+    """(Re)index the given manga; ids that no longer exist are only removed."""
+    if not is_available():
+        return
+    manga_ids = list(manga_ids)
+    remove_manga(manga_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(manga_ids), BATCH_SIZE):
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (rowid, title, subtitle, description, people, tags) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                list(get_documents(manga_ids[start:start + BATCH_SIZE])),
+            )
+
+
+def rebuild():
+    """Create the index if needed and refill it from scratch; returns the number of indexed manga."""
+    global _available
+    if connection.vendor != "sqlite":
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        cursor.execute(f"DELETE FROM {TABLE}")
+    _available = True
+    manga_ids = list(Manga.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(manga_ids), BATCH_SIZE):
+        index_manga(manga_ids[start:start + BATCH_SIZE])
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return len(manga_ids)
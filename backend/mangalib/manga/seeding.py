@@ -0,0 +1,149 @@
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+
+from . import search
+from .facets import invalidate_facets
+from .models import (Author, Chapter, Comment, Genre, Manga, MangaRatingSummary,
+                     Page, Painter, Publisher, Rating, RatingComment, Tag, Volume)
+from .utils import count_of, sum_of
+
+User = get_user_model()
+
+
+def seed_catalog(manga=10, volumes=2, chapters=3, pages=4, comments=3, replies=2,
+                 votes=2, ratings=5, genres=5, tags=5, prefix="seed"):
+    """Create a deterministic catalog with bulk inserts for tests and benchmarks.
+
+    Counts are per parent object: ``volumes`` per manga, ``chapters`` per
+    volume, ``pages`` per chapter, ``comments`` per manga, ``replies`` per
+    comment, ``votes`` per comment and reply, ``ratings`` per manga. Genres
+    and tags form a fixed vocabulary shared by the whole catalog.
+    Denormalized counters are filled in as if the rows had been created
+    through the API.
+    """
+    users = User.objects.bulk_create(
+        User(username=f"{prefix}-user-{i}", password="!")
+        for i in range(max(ratings, votes, 1))
+    )
+    author = Author.objects.create(name=f"{prefix} author")
+    painter = Painter.objects.create(name=f"{prefix} painter")
+    publisher = Publisher.objects.create(name=f"{prefix} publisher")
+    genre_objs = Genre.objects.bulk_create(Genre(name=f"{prefix} genre {i}") for i in range(genres))
+    tag_objs = Tag.objects.bulk_create(Tag(name=f"{prefix} tag {i}") for i in range(tags))
+
+    manga_objs = Manga.objects.bulk_create(
+        Manga(
+            title=f"{prefix} title {i}",
+            subtitle=f"{prefix} subtitle {i}",
+            description=f"Description of {prefix} manga {i}",
+            type=Manga.MANGA_TYPE[i % len(Manga.MANGA_TYPE)][0],
+            age_rating=Manga.AGE_RATING[i % len(Manga.AGE_RATING)][0],
+            status=Manga.MANGA_STATUS[i % len(Manga.MANGA_STATUS)][0],
+            image=f"seed/{prefix}-{i}.jpg",
+            release_year=2000 + i % 20,
+            view_count=i * 7 % 101,
+            chapters_count=volumes * chapters,
+            author=author,
+            painter=painter,
+            slug=f"{prefix}-{i}",
+        )
+        for i in range(manga)
+    )
+    Manga.publisher.through.objects.bulk_create(
+        Manga.publisher.through(manga_id=obj.pk, publisher_id=publisher.pk) for obj in manga_objs
+    )
+    Manga.genres.through.objects.bulk_create(
+        Manga.genres.through(manga_id=obj.pk, genre_id=genre_objs[(i + k) % genres].pk)
+        for i, obj in enumerate(manga_objs)
+        for k in range(min(2, genres))
+    )
+    Manga.tag.through.objects.bulk_create(
+        Manga.tag.through(manga_id=obj.pk, tag_id=tag_objs[(i + k) % tags].pk)
+        for i, obj in enumerate(manga_objs)
+        for k in range(min(2, tags))
+    )
+    Genre.objects.filter(pk__in=[genre.pk for genre in genre_objs]).update(
+        manga_count=count_of(Manga.genres.through, "genre")
+    )
+    Tag.objects.filter(pk__in=[tag.pk for tag in tag_objs]).update(manga_count=count_of(Manga.tag.through, "tag"))
+    Manga.related_manga.through.objects.bulk_create(
+        Manga.related_manga.through(from_manga_id=obj.pk, to_manga_id=manga_objs[i - 1].pk)
+        for i, obj in enumerate(manga_objs)
+        if i > 0
+    )
+
+    volume_objs = Volume.objects.bulk_create(
+        Volume(manga=obj, volume_number=number)
+        for obj in manga_objs
+        for number in range(1, volumes + 1)
+    )
+    chapter_objs = Chapter.objects.bulk_create(
+        Chapter(
+            volume=volume,
+            manga_id=volume.manga_id,
+            chapter_number=str((volume.volume_number - 1) * chapters + number),
+            volume_number=volume.volume_number,
+            sort_key=(volume.volume_number - 1) * chapters + number,
+            title=f"Chapter {number}",
+            slug=f"chapter-{number}",
+        )
+        for volume in volume_objs
+        for number in range(1, chapters + 1)
+    )
+    page_objs = Page.objects.bulk_create(
+        Page(
+            chapter=chapter,
+            manga_id=chapter.manga_id,
+            page_number=number,
+            image=f"seed/{prefix}-{chapter.pk}-{number}.jpg",
+        )
+        for chapter in chapter_objs
+        for number in range(1, pages + 1)
+    )
+
+    comment_objs = Comment.objects.bulk_create(
+        Comment(author=users[i % len(users)], manga=obj, content=f"Comment {i}")
+        for obj in manga_objs
+        for i in range(comments)
+    )
+    reply_objs = Comment.objects.bulk_create(
+        Comment(
+            author=users[i % len(users)],
+            manga_id=parent.manga_id,
+            parent=parent,
+            is_parent=True,
+            content=f"Reply {i}",
+        )
+        for parent in comment_objs
+        for i in range(replies)
+    )
+    RatingComment.objects.bulk_create(
+        RatingComment(user=users[i], comment=comment, vote=1 if i % 3 else -1)
+        for comment in comment_objs + reply_objs
+        for i in range(votes)
+    )
+    Comment.objects.filter(manga__in=manga_objs).update(score=sum_of(RatingComment, "comment", "vote"))
+
+    Rating.objects.bulk_create(
+        Rating(user=users[i], manga=obj, star=(i + j) % 10 + 1)
+        for j, obj in enumerate(manga_objs)
+        for i in range(ratings)
+    )
+    MangaRatingSummary.rebuild([obj.pk for obj in manga_objs])
+    search.index_manga(obj.pk for obj in manga_objs)
+    invalidate_facets()
+
+    return SimpleNamespace(
+        users=users,
+        author=author,
+        painter=painter,
+        genres=genre_objs,
+        tags=tag_objs,
+        manga=manga_objs,
+        volumes=volume_objs,
+        chapters=chapter_objs,
+        pages=page_objs,
+        comments=comment_objs,
+        replies=reply_objs,
+    )
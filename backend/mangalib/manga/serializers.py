@@ -1,40 +1,60 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from .comment_tree import CommentTree
 from .models import Manga, Comment, Chapter, Genre, Page, Tag, Rating
+from .storage import get_image_storage
+
+
+class SrcsetField(serializers.Field):
+    """Image variants as ``{format: "url 320w, url 640w"}``, ready for ``<source srcset>``."""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get("request")
+        storage = get_image_storage()
+        srcset = {}
+        for variant in variants:
+            url = storage.url(variant["name"])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            srcset.setdefault(variant["format"], []).append(f"{url} {variant['width']}w")
+        return {image_format: ", ".join(sources) for image_format, sources in srcset.items()}
 
 
 class GenreSerializer(serializers.ModelSerializer):
-    total_manga = serializers.SerializerMethodField()
+    total_manga = serializers.IntegerField(source="manga_count", read_only=True)
 
     class Meta:
         model = Genre
         fields = ["id", "name", "total_manga"]
 
-    def get_total_manga(self, obj):
-        return obj.manga_set.count()
-
 
 class TagSerializer(serializers.ModelSerializer):
-    total_manga = serializers.SerializerMethodField()
+    total_manga = serializers.IntegerField(source="manga_count", read_only=True)
 
     class Meta:
         model = Tag
         fields = ["id", "name", "total_manga"]
 
-    def get_total_manga(self, obj):
-        return obj.manga_set.count()
-
 
 class MangaPopularSerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField(source="image_variants")
+
     class Meta:
         model = Manga
-        fields = ["title", "subtitle", "image", "view_count"]
+        fields = ["title", "subtitle", "image", "image_srcset", "view_count"]
 
 
 class MangaNewSerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField(source="image_variants")
+
     class Meta:
         model = Manga
-        fields = ["title", "subtitle", "image"]
+        fields = ["title", "subtitle", "image", "image_srcset"]
 
 
 class MangaShortInfoSerializer(serializers.ModelSerializer):
@@ -51,21 +71,27 @@ class MangaShortInfoSerializer(serializers.ModelSerializer):
 
 
 class MangaListSerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField(source="image_variants")
 
     class Meta:
         model = Manga
-        fields = ["id", "title", "image", "type", "slug"]
+        fields = ["id", "title", "image", "image_srcset", "type", "slug"]
 
 
 class MangaPopularNewChapters(serializers.ModelSerializer):
     last_chapter = serializers.SerializerMethodField()
+    image_srcset = SrcsetField(source="image_variants")
 
     class Meta:
         model = Manga
-        fields = ["title", "image", "last_chapter"]
+        fields = ["title", "image", "image_srcset", "last_chapter"]
 
     def get_last_chapter(self, obj):
-        last_chapter = obj.chapters.last()
+        last_chapters = self.context.get("last_chapters")
+        if last_chapters is not None:
+            last_chapter = last_chapters.get(obj.pk)
+        else:
+            last_chapter = obj.chapters.select_related("volume").order_by(*Chapter.READING_ORDER).last()
         if last_chapter:
             serializer = ChapterSerizaliser(last_chapter)
             return serializer.data
@@ -93,6 +119,8 @@ class MangaDetailSerializer(serializers.ModelSerializer):
     rating = serializers.FloatField(source="get_avg_rating")
     ratings = serializers.DictField(source="get_ratings")
     user_list = serializers.DictField(source="get_user_list")
+    image_srcset = SrcsetField(source="image_variants")
+    backround_image_srcset = SrcsetField(source="backround_image_variants")
 
     class Meta:
         model = Manga
@@ -102,7 +130,9 @@ class MangaDetailSerializer(serializers.ModelSerializer):
             "subtitle",
             "description",
             "image",
+            "image_srcset",
             "backround_image",
+            "backround_image_srcset",
             "genres",
             "type",
             "release_year",
@@ -135,7 +165,7 @@ class ChapterSerizaliser(serializers.ModelSerializer):
 
 class ChapterSerializer(serializers.ModelSerializer):
     volume_number = serializers.IntegerField(source='volume.volume_number')
-    total_pages = serializers.IntegerField(source='pages.count')
+    total_pages = serializers.IntegerField(source='pages_count', read_only=True)
 
     class Meta:
         model = Chapter
@@ -145,7 +175,7 @@ class ChapterSerializer(serializers.ModelSerializer):
 
 class LatestChapterSerializer(serializers.ModelSerializer):
     volume_number = serializers.IntegerField(source='volume.volume_number')
-    total_pages = serializers.IntegerField(source='pages.count')
+    total_pages = serializers.IntegerField(source='pages_count', read_only=True)
     manga_title = serializers.CharField(source='manga.title')
     manga_subtitle = serializers.CharField(source='manga.subtitle')
 
@@ -156,32 +186,54 @@ class LatestChapterSerializer(serializers.ModelSerializer):
 
 
 class PageSerializer(serializers.ModelSerializer):
+    srcset = SrcsetField(source="image_variants")
+
+    class Meta:
+        model = Page
+        fields = ["id", "image", "srcset", "page_number"]
+
+
+class PageManifestSerializer(serializers.ModelSerializer):
+    srcset = SrcsetField(source="image_variants")
+
     class Meta:
         model = Page
-        fields = ["id", "image", "page_number"]
+        fields = ["id", "image", "srcset", "page_number", "width", "height", "file_size", "content_hash"]
+
+
+class ReaderChapterSerializer(serializers.ModelSerializer):
+    volume_number = serializers.IntegerField(source='volume.volume_number')
+    pages = PageManifestSerializer(many=True)
+
+    class Meta:
+        model = Chapter
+        fields = ["id", "volume_number", "chapter_number", "title", "pages"]
 
 
 class CommentSerializer(serializers.ModelSerializer):
     author = serializers.CharField(source="author.username", read_only=True)
     author_image = serializers.URLField(source="author.avatar", read_only=True)
     replies = serializers.SerializerMethodField(read_only=True)
-    rating = serializers.SerializerMethodField(read_only=True)
+    rating = serializers.IntegerField(source="score", read_only=True)
 
     class Meta:
         model = Comment
         fields = ["id", "content", "author", "author_image",
                   "created_at", "replies", "rating"]
 
+    def get_comment_tree(self, obj):
+        tree = self.context.get("comment_tree")
+        if tree is None or (obj.parent_id is None and obj not in tree):
+            tree = CommentTree.load([obj], max_depth=settings.COMMENT_TREE_MAX_DEPTH,
+                                    max_replies=settings.COMMENT_TREE_MAX_REPLIES)
+            self.context["comment_tree"] = tree
+        return tree
+
     def get_replies(self, obj):
-        replies = obj.replies.all()
-        serializer = CommentSerializer(replies, many=True)
+        replies = self.get_comment_tree(obj).get_replies(obj)
+        serializer = CommentSerializer(replies, many=True, context=self.context)
         return serializer.data
 
-    def get_rating(self, obj):
-        votes = obj.ratings.all()
-        rating = sum(vote.vote for vote in votes)
-        return rating
-
 
 class CommentCreateSerializer(serializers.ModelSerializer):
     manga = serializers.PrimaryKeyRelatedField(
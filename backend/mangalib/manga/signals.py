@@ -0,0 +1,230 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import response_cache, search
+from .facets import invalidate_facets
+from .feeds import invalidate_feeds
+from .suggest import suggest_index
+from .models import Author, Chapter, Genre, Manga, Page, Painter, Rating, Tag, Volume
+
+
+@receiver([post_save, post_delete], sender="users.MangaUserList")
+def invalidate_user_list(sender, instance, **kwargs):
+    # After the commit, or a read in between would cache the old statistics again.
+    key = Manga.user_list_cache_key(instance.manga_id)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=Chapter)
+def count_saved_chapter(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, "saved_manga_id", instance.manga_id)
+    instance.saved_manga_id = instance.manga_id
+    if previous == instance.manga_id:
+        return
+    if previous:
+        # Moved to a volume of another manga.
+        Manga.objects.filter(pk=previous).update(chapters_count=F("chapters_count") - 1)
+        response_cache.invalidate(f"manga:{previous}")
+    if instance.manga_id:
+        Manga.objects.filter(pk=instance.manga_id).update(chapters_count=F("chapters_count") + 1)
+
+
+@receiver(post_delete, sender=Chapter)
+def count_deleted_chapter(sender, instance, **kwargs):
+    if instance.manga_id:
+        Manga.objects.filter(pk=instance.manga_id).update(chapters_count=F("chapters_count") - 1)
+
+
+@receiver([post_save, post_delete], sender=Manga)
+@receiver([post_save, post_delete], sender=Chapter)
+def invalidate_home_feeds(sender, **kwargs):
+    invalidate_feeds()
+
+
+@receiver([post_save, post_delete], sender=Manga)
+def invalidate_manga_responses(sender, instance, **kwargs):
+    related = instance.related_manga.values_list("pk", flat=True) if kwargs["signal"] is post_save else []
+    response_cache.invalidate("catalog", "taxonomy", f"manga:{instance.pk}", *(f"manga:{pk}" for pk in related))
+
+
+@receiver(m2m_changed, sender=Manga.genres.through)
+@receiver(m2m_changed, sender=Manga.tag.through)
+@receiver(m2m_changed, sender=Manga.related_manga.through)
+def invalidate_manga_relation_responses(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    manga_ids = set(pk_set or ())
+    if isinstance(instance, Manga):
+        manga_ids.add(instance.pk)
+    elif not manga_ids:
+        manga_ids.update(instance.manga_set.values_list("pk", flat=True))
+    response_cache.invalidate("catalog", "taxonomy", *(f"manga:{pk}" for pk in manga_ids))
+
+
+@receiver([post_save, post_delete], sender=Chapter)
+def invalidate_chapter_responses(sender, instance, **kwargs):
+    response_cache.invalidate("catalog", f"manga:{instance.manga_id}", f"chapter:{instance.pk}")
+
+
+@receiver(post_save, sender=Volume)
+def invalidate_renumbered_volume_responses(sender, instance, created, **kwargs):
+    if created:
+        return
+    chapter_ids = instance.chapters.values_list("pk", flat=True)
+    response_cache.invalidate("catalog", f"manga:{instance.manga_id}", *(f"chapter:{pk}" for pk in chapter_ids))
+    invalidate_feeds()
+
+
+@receiver([post_save, post_delete], sender=Page)
+def invalidate_page_responses(sender, instance, **kwargs):
+    manga_id = instance.manga_id
+    if manga_id is None:
+        manga_id = Chapter.objects.filter(pk=instance.chapter_id).values_list("manga_id", flat=True).first()
+    response_cache.invalidate(f"manga:{manga_id}", f"chapter:{instance.chapter_id}")
+
+
+@receiver([post_save, post_delete], sender=Rating)
+@receiver([post_save, post_delete], sender="users.MangaUserList")
+def invalidate_rated_manga_responses(sender, instance, **kwargs):
+    # The rating summary is updated later in the same transaction; invalidating
+    # now would let a concurrent request cache the old summary again.
+    scopes = ("catalog", f"manga:{instance.manga_id}")
+    transaction.on_commit(lambda: response_cache.invalidate(*scopes))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Tag)
+def invalidate_taxonomy_responses(sender, **kwargs):
+    response_cache.invalidate("taxonomy")
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Tag)
+def invalidate_untagged_responses(sender, **kwargs):
+    # The deleted links change which manga match a filter and the facet counts.
+    response_cache.invalidate("taxonomy", "catalog")
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Painter)
+def invalidate_credited_manga_responses(sender, instance, **kwargs):
+    manga_ids = instance.manga.values_list("pk", flat=True)
+    response_cache.invalidate("catalog", *(f"manga:{pk}" for pk in manga_ids))
+
+
+@receiver(post_save, sender=Manga)
+def index_saved_manga(sender, instance, **kwargs):
+    search.index_manga([instance.pk])
+
+
+@receiver(post_delete, sender=Manga)
+def remove_deleted_manga(sender, instance, **kwargs):
+    search.remove_manga([instance.pk])
+
+
+@receiver(post_save, sender=Manga)
+def update_suggestions(sender, instance, **kwargs):
+    suggest_index.update(instance)
+
+
+@receiver(post_delete, sender=Manga)
+def remove_suggestions(sender, instance, **kwargs):
+    suggest_index.remove(instance.pk)
+
+
+@receiver(m2m_changed, sender=Manga.genres.through)
+@receiver(m2m_changed, sender=Manga.tag.through)
+def index_retagged_manga(sender, instance, action, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, Manga):
+        search.index_manga([instance.pk])
+    elif pk_set:
+        search.index_manga(pk_set)
+    else:
+        search.index_manga(instance.manga_set.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Painter)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Tag)
+def index_renamed_manga(sender, instance, created, **kwargs):
+    if not created:
+        related = instance.manga if sender in (Author, Painter) else instance.manga_set
+        search.index_manga(related.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Tag)
+def remember_untagged_manga(sender, instance, **kwargs):
+    instance._search_manga_ids = list(instance.manga_set.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Tag)
+def index_untagged_manga(sender, instance, **kwargs):
+    search.index_manga(getattr(instance, "_search_manga_ids", ()))
+
+
+@receiver([post_save, post_delete], sender=Manga)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Tag)
+def invalidate_manga_facets(sender, **kwargs):
+    invalidate_facets()
+
+
+@receiver(m2m_changed, sender=Manga.genres.through)
+@receiver(m2m_changed, sender=Manga.tag.through)
+def invalidate_retagged_manga_facets(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_facets()
+
+
+def count_tagged_manga(model, ids, delta):
+    if ids:
+        model.objects.filter(pk__in=ids).update(manga_count=F("manga_count") + delta)
+
+
+@receiver(m2m_changed, sender=Manga.genres.through)
+@receiver(m2m_changed, sender=Manga.tag.through)
+def count_retagged_manga(sender, instance, action, reverse, pk_set, **kwargs):
+    model = Genre if sender is Manga.genres.through else Tag
+    column = "genre_id" if model is Genre else "tag_id"
+    if action == "pre_clear":
+        if reverse:
+            instance._cleared_manga_count = sender.objects.filter(**{column: instance.pk}).count()
+        else:
+            instance._cleared_tag_ids = list(sender.objects.filter(manga_id=instance.pk).values_list(column, flat=True))
+        return
+    if action == "post_clear":
+        if reverse:
+            count_tagged_manga(model, [instance.pk], -getattr(instance, "_cleared_manga_count", 0))
+        else:
+            count_tagged_manga(model, getattr(instance, "_cleared_tag_ids", ()), -1)
+        return
+    if action == "pre_remove":
+        # pk_set holds every id passed to remove(), linked or not; only the linked ones are counted.
+        if pk_set:
+            owner, target = (column, "manga_id") if reverse else ("manga_id", column)
+            links = sender.objects.filter(**{owner: instance.pk, f"{target}__in": pk_set})
+            instance._removed_tag_ids = set(links.values_list(target, flat=True))
+        return
+    if action == "post_remove":
+        pk_set = getattr(instance, "_removed_tag_ids", set()) & set(pk_set or ())
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    sign = 1 if action == "post_add" else -1
+    if reverse:
+        count_tagged_manga(model, [instance.pk], sign * len(pk_set))
+    else:
+        count_tagged_manga(model, pk_set, sign)
+
+
+@receiver(pre_delete, sender=Manga)
+def uncount_deleted_manga(sender, instance, **kwargs):
+    count_tagged_manga(Genre, list(instance.genres.values_list("pk", flat=True)), -1)
+    count_tagged_manga(Tag, list(instance.tag.values_list("pk", flat=True)), -1)
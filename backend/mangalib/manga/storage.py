@@ -0,0 +1,78 @@
+import hashlib
+import os
+import posixpath
+import re
+import time
+import uuid
+
+from django.core.files.storage import FileSystemStorage, storages
+
+BLOB_PREFIX = "media/blobs"
+TEMPORARY_PREFIX = f"{BLOB_PREFIX}/tmp"
+BLOB_RE = re.compile(rf"^{BLOB_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[0-9a-z]+)?$")
+
+
+def get_image_storage():
+    return storages["images"]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Local storage that keeps every distinct file once, named after its sha256.
+
+    Whatever name the field asks for, the file lands in
+    ``media/blobs/<h[:2]>/<h[2:4]>/<h>.<ext>``; saving content that is
+    already stored just returns the existing name. Blobs can be shared by
+    any number of rows, so ``delete`` leaves them alone: the
+    ``collect_image_blobs`` command removes them once nothing refers to
+    them. Files saved before this storage was used keep their names and
+    are deleted normally.
+    """
+
+    def blob_name(self, digest, extension):
+        return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+    def is_blob(self, name):
+        return bool(BLOB_RE.match(name or ""))
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content, see _save().
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        extension = posixpath.splitext(name)[1].lower()
+        blob = self.blob_name(digest.hexdigest(), extension)
+        if self.exists(blob):
+            # Reset the age collect_image_blobs checks, so a blob that was
+            # unreferenced is not collected before the new row commits.
+            os.utime(self.path(blob))
+            return blob
+        # Write under a unique name first so a concurrent save of the same
+        # content never sees a half-written blob; both renames are identical.
+        temporary = super()._save(f"{TEMPORARY_PREFIX}/{uuid.uuid4().hex}{extension}", content)
+        os.makedirs(os.path.dirname(self.path(blob)), exist_ok=True)
+        os.replace(self.path(temporary), self.path(blob))
+        return blob
+
+    def delete(self, name):
+        if not self.is_blob(name):
+            super().delete(name)
+
+    def purge(self, name):
+        """Delete a blob for good; only safe once no row refers to it."""
+        super().delete(name)
+
+    def iter_blobs(self, temporary=False):
+        """``(name, size, age in seconds)`` of every stored blob, or of leftover temporary files."""
+        root = self.path(TEMPORARY_PREFIX if temporary else BLOB_PREFIX)
+        now = time.time()
+        for directory, dirnames, filenames in os.walk(root):
+            if not temporary:
+                dirnames[:] = [name for name in dirnames if os.path.join(directory, name) != self.path(TEMPORARY_PREFIX)]
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.location).replace(os.sep, "/")
+                stat = os.stat(path)
+                yield name, stat.st_size, now - stat.st_mtime
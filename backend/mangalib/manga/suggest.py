@@ -0,0 +1,231 @@
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+
+from .models import Manga
+
+CYRILLIC = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "і": "i", "ї": "i", "є": "e",
+}
+TRANSLITERATION = str.maketrans(CYRILLIC)
+# Each manga is reachable from the start of its title/subtitle and from the
+# start of this many following words.
+MAX_WORD_KEYS = 6
+# Candidates kept per trie node; also the largest ``limit`` a query may ask for.
+TOP_SIZE = 20
+
+ROW_FIELDS = ("id", "title", "subtitle", "slug", "view_count")
+
+
+def normalize(text):
+    """Lowercase, transliterate Cyrillic to Latin, drop diacritics and punctuation."""
+    text = unicodedata.normalize("NFKD", text.lower().translate(TRANSLITERATION))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def get_keys(*texts):
+    keys = set()
+    for text in texts:
+        words = normalize(text or "").split()
+        for start in range(min(len(words), MAX_WORD_KEYS)):
+            keys.add(" ".join(words[start:]))
+    return keys
+
+
+def max_distance(query):
+    """Typos allowed for a query: none while it is short, then one, then two."""
+    if len(query) < 4:
+        return 0
+    return 1 if len(query) < 8 else 2
+
+
+class Node:
+    __slots__ = ("children", "ids", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()
+        self.top = None
+
+
+class SuggestIndex:
+    """In-memory trie over normalized manga titles and subtitles.
+
+    Every node caches the ``TOP_SIZE`` most viewed manga of its subtree, so
+    an exact prefix lookup costs one walk down the trie. Typos are handled
+    by walking the trie with a Levenshtein row per node and collecting the
+    nodes whose prefix is within the allowed distance. Updates only
+    reset the cached tops on the touched paths.
+    """
+
+    def __init__(self):
+        self.root = Node()
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.build_lock = threading.Lock()
+        self.built_at = None
+        self.changed = None
+
+    def build(self):
+        """Rebuild from the database, then swap the new trie in.
+
+        Lookups keep using the old trie while the new one is built. Manga
+        added or removed meanwhile are re-read after the swap, since the
+        build may have loaded them before the change.
+        """
+        with self.build_lock:
+            self.rebuild()
+
+    def rebuild(self):
+        with self.lock:
+            self.changed = set()
+        try:
+            fresh = SuggestIndex()
+            for row in Manga.objects.values_list(*ROW_FIELDS).iterator():
+                fresh.add(*row)
+        except BaseException:
+            with self.lock:
+                self.changed = None
+            raise
+        with self.lock:
+            self.root, self.entries = fresh.root, fresh.entries
+            changed, self.changed = self.changed, None
+            self.built_at = time.monotonic()
+        if changed:
+            rows = {row[0]: row for row in Manga.objects.filter(pk__in=changed).values_list(*ROW_FIELDS)}
+            with self.lock:
+                for manga_id in changed:
+                    if manga_id in rows:
+                        self.add(*rows[manga_id])
+                    else:
+                        self.remove(manga_id)
+
+    def refresh(self):
+        """Rebuild a stale index; while one thread rebuilds, the others keep reading the old trie."""
+        if not self.is_stale():
+            return
+        if self.built_at is None:
+            # Nothing to serve yet, so wait for whichever thread builds first.
+            with self.build_lock:
+                if self.built_at is None:
+                    self.rebuild()
+            return
+        if self.build_lock.acquire(blocking=False):
+            try:
+                if self.is_stale():
+                    self.rebuild()
+            finally:
+                self.build_lock.release()
+
+    def is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > settings.SUGGEST_REFRESH_INTERVAL
+
+    def add(self, manga_id, title, subtitle, slug, view_count):
+        with self.lock:
+            self.remove(manga_id)
+            keys = get_keys(title, subtitle)
+            self.entries[manga_id] = {
+                "id": manga_id, "title": title, "subtitle": subtitle, "slug": slug,
+                "view_count": view_count, "keys": keys,
+            }
+            for key in keys:
+                node = self.root
+                node.top = None
+                for char in key:
+                    node = node.children.setdefault(char, Node())
+                    node.top = None
+                node.ids.add(manga_id)
+
+    def update(self, manga):
+        if self.built_at is not None:
+            self.add(manga.pk, manga.title, manga.subtitle, manga.slug, manga.view_count)
+
+    def remove(self, manga_id):
+        with self.lock:
+            if self.changed is not None:
+                self.changed.add(manga_id)
+            entry = self.entries.pop(manga_id, None)
+            if entry is None:
+                return
+            for key in entry["keys"]:
+                path = [self.root]
+                for char in key:
+                    path.append(path[-1].children[char])
+                path[-1].ids.discard(manga_id)
+                for node in path:
+                    node.top = None
+                for char, node, parent in zip(reversed(key), reversed(path), reversed(path[:-1])):
+                    if node.ids or node.children:
+                        break
+                    del parent.children[char]
+
+    def rank(self, manga_id):
+        return -self.entries[manga_id]["view_count"], manga_id
+
+    def get_top(self, node):
+        if node.top is None:
+            candidates = set(node.ids)
+            for child in node.children.values():
+                candidates.update(self.get_top(child))
+            node.top = sorted(candidates, key=self.rank)[:TOP_SIZE]
+        return node.top
+
+    def find(self, query, distance):
+        """Return ``{node: distance}`` for the nodes whose prefix is within ``distance`` of ``query``."""
+        found = {}
+        first_row = list(range(len(query) + 1))
+        if first_row[-1] <= distance:
+            return {self.root: first_row[-1]}
+        stack = [(self.root, first_row)]
+        while stack:
+            node, row = stack.pop()
+            for char, child in node.children.items():
+                new_row = [row[0] + 1]
+                for column, query_char in enumerate(query, 1):
+                    new_row.append(min(
+                        row[column] + 1,
+                        new_row[column - 1] + 1,
+                        row[column - 1] + (query_char != char),
+                    ))
+                if new_row[-1] <= distance:
+                    found[child] = new_row[-1]
+                if new_row[-1] > 0 and min(new_row) <= distance:
+                    stack.append((child, new_row))
+        return found
+
+    def suggest(self, text, limit=10):
+        """Return up to ``limit`` manga whose title or subtitle starts like ``text``.
+
+        Exact prefix matches come first, then matches with more typos; each
+        group is ordered by ``view_count``.
+        """
+        query = normalize(text)
+        if not query:
+            return []
+        limit = min(limit, TOP_SIZE)
+        with self.lock:
+            distances = {}
+            for node, distance in self.find(query, max_distance(query)).items():
+                for manga_id in self.get_top(node):
+                    distances[manga_id] = min(distance, distances.get(manga_id, distance))
+            ranked = sorted(distances, key=lambda manga_id: (distances[manga_id], *self.rank(manga_id)))
+            return [
+                {field: self.entries[manga_id][field] for field in ("id", "title", "subtitle", "slug")}
+                for manga_id in ranked[:limit]
+            ]
+
+
+suggest_index = SuggestIndex()
+
+
+def suggest(text, limit=10):
+    suggest_index.refresh()
+    return suggest_index.suggest(text, limit)
@@ -1,3 +1,1255 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import zipfile
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from PIL import Image, ImageDraw
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from users.models import MangaUserList
+
+from . import response_cache
+from .comment_tree import CommentTree
+from .duplicates import MultiIndex, choose_chunks, dhash, find_near_duplicates, hamming
+from .facets import Selection, facet_index, from_bitmap
+from .models import (Author, Chapter, Comment, Genre, Manga, MangaRatingSummary, Page, Rating, RatingComment, Tag,
+                     Volume)
+from .seeding import seed_catalog
+from .suggest import suggest_index
+from .view_counter import ViewCounter, view_counter
+
+User = get_user_model()
+
+
+class MangaAPITestCase(APITestCase):
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        suggest_index.built_at = None
+        view_counter.seen.clear()
+
+
+class QueryBudgetMixin:
+    """Fixed upper bounds on SQL queries per API route.
+
+    The same budgets run against a small and a large seeded catalog, so any
+    serializer or view that issues queries per returned row blows the budget
+    on the large one.
+    """
+
+    catalog_size = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(**cls.catalog_size)
+        cls.manga = cls.catalog.manga[-1]
+        cls.chapter = cls.catalog.chapters[-1]
+        cls.comment = cls.catalog.comments[-1]
+        cls.user = cls.catalog.users[0]
+
+    def assertQueryBudget(self, budget, method, url, data=None, expected_status=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format="json")
+        self.assertEqual(response.status_code, expected_status, getattr(response, "data", None))
+        queries = "\n".join(query["sql"] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            f"{method.upper()} {url} ran {len(context)} queries, budget is {budget}:\n{queries}",
+        )
+        return response
+
+    def test_manga_list(self):
+        self.assertQueryBudget(2, "get", "/api/manga/")
+
+    def test_manga_list_filtered_and_ordered(self):
+        genre = self.catalog.genres[0]
+        self.client.get(f"/api/manga/?genres={genre.pk}")
+        self.assertQueryBudget(
+            2, "get", f"/api/manga/?ordering=-chapters_count&rating_min=1&genres={genre.pk}"
+        )
+
+    def test_manga_facets(self):
+        self.client.get("/api/manga/facets/")
+        self.assertQueryBudget(0, "get", f"/api/manga/facets/?genres={self.catalog.genres[0].pk}")
+        self.assertQueryBudget(1, "get", "/api/manga/facets/?rating_min=1")
+
+    def test_manga_search(self):
+        self.assertQueryBudget(3, "get", "/api/manga/?search=seed tit")
+
+    def test_manga_suggest(self):
+        self.client.get("/api/manga/suggest/?q=seed")
+        self.assertQueryBudget(0, "get", "/api/manga/suggest/?q=sead titl")
+
+    def test_manga_detail(self):
+        # Five to render the page, one to write the view through (no flush interval in tests).
+        self.assertQueryBudget(6, "get", f"/api/manga/{self.manga.slug}/")
+
+    def test_manga_short_info(self):
+        self.assertQueryBudget(3, "get", f"/api/manga/{self.manga.slug}/short_info/")
+
+    def test_manga_list_cursor(self):
+        response = self.assertQueryBudget(1, "get", "/api/manga/?pagination=cursor&ordering=-view_count&page_size=5")
+        self.assertQueryBudget(1, "get", response.data["next"])
+
+    def test_manga_chapters(self):
+        self.assertQueryBudget(2, "get", f"/api/manga/{self.manga.slug}/chapters/")
+
+    def test_popular_manga(self):
+        self.assertQueryBudget(1, "get", "/api/manga/popular_manga/")
+
+    def test_new_manga(self):
+        self.assertQueryBudget(1, "get", "/api/manga/new_manga/")
+
+    def test_popular_manga_chapters(self):
+        self.assertQueryBudget(2, "get", "/api/manga/popular_manga_chapters/")
+
+    def test_chapter_list(self):
+        self.assertQueryBudget(1, "get", "/api/chapters/")
+
+    def test_chapter_detail(self):
+        self.assertQueryBudget(1, "get", f"/api/chapters/{self.chapter.pk}/")
+
+    def test_chapter_pages(self):
+        self.assertQueryBudget(2, "get", f"/api/chapters/{self.chapter.pk}/pages/")
+
+    def test_chapter_bundle(self):
+        url = f"/api/chapters/{self.chapter.pk}/bundle/"
+        etag = self.assertQueryBudget(3, "get", url)["ETag"]
+        self.assertQueryBudget(0, "get", url, expected_status=status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_latest_chapters(self):
+        self.assertQueryBudget(1, "get", "/api/chapters/latest/")
+
+    def test_comment_list(self):
+        self.assertQueryBudget(3, "get", f"/api/comments/?manga={self.manga.slug}")
+
+    def test_comment_list_cursor(self):
+        self.assertQueryBudget(3, "get", f"/api/comments/?manga={self.manga.slug}&pagination=cursor&page_size=2")
+
+    def test_comment_detail(self):
+        self.assertQueryBudget(3, "get", f"/api/comments/{self.comment.pk}/")
+
+    def test_comment_vote(self):
+        self.client.force_authenticate(self.user)
+        self.assertQueryBudget(
+            6, "post", f"/api/comments/{self.comment.pk}/vote/", {"vote": 1},
+            expected_status=status.HTTP_200_OK,
+        )
+
+    def test_user_rating(self):
+        self.client.force_authenticate(self.user)
+        self.assertQueryBudget(1, "get", f"/api/rating/user_rating/{self.manga.pk}/")
+
+    def test_rating_create_update_destroy(self):
+        user = self.catalog.users[-1]
+        Rating.objects.filter(user=user, manga=self.manga).delete()
+        self.client.force_authenticate(user)
+        response = self.assertQueryBudget(
+            8, "post", "/api/ratings/", {"manga": self.manga.pk, "star": 4},
+            expected_status=status.HTTP_201_CREATED,
+        )
+        url = f"/api/ratings/{response.data['id']}/"
+        self.assertQueryBudget(5, "patch", url, {"star": 8})
+        self.assertQueryBudget(6, "delete", url, expected_status=status.HTTP_204_NO_CONTENT)
+
+    def test_genres(self):
+        self.assertQueryBudget(1, "get", "/api/genres/")
+
+    def test_tags(self):
+        self.assertQueryBudget(1, "get", "/api/tags/")
+
+    def test_types(self):
+        self.assertQueryBudget(0, "get", "/api/types/")
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=None)
+class SmallCatalogQueryBudgetTests(QueryBudgetMixin, MangaAPITestCase):
+    catalog_size = {"manga": 6, "volumes": 1, "chapters": 2, "pages": 2, "comments": 1, "replies": 1, "ratings": 2}
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=None)
+class LargeCatalogQueryBudgetTests(QueryBudgetMixin, MangaAPITestCase):
+    catalog_size = {"manga": 60, "volumes": 3, "chapters": 5, "pages": 8, "comments": 8, "replies": 4, "ratings": 12}
+
+
+class RatingSummaryTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=2, ratings=3)
+        cls.manga = cls.catalog.manga[0]
+        cls.user = cls.catalog.users[0]
+        Rating.objects.filter(manga=cls.manga, user=cls.user).delete()
+        MangaRatingSummary.rebuild([cls.manga.pk])
+
+    def assertSummaryMatchesRatings(self):
+        summary = MangaRatingSummary.objects.get(manga=self.manga)
+        rebuilt = MangaRatingSummary.from_ratings(Rating.objects.filter(manga=self.manga)).get(
+            self.manga.pk, MangaRatingSummary(manga=self.manga)
+        )
+        self.assertEqual(summary.get_histogram(), rebuilt.get_histogram())
+        self.assertAlmostEqual(summary.average, rebuilt.average)
+
+    def test_duplicate_rating_rejected_by_database(self):
+        Rating.objects.create(user=self.user, manga=self.manga, star=5)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.create(user=self.user, manga=self.manga, star=7)
+
+    def test_summary_follows_rating_changes(self):
+        self.client.force_authenticate(self.user)
+
+        response = self.client.post("/api/ratings/", {"manga": self.manga.pk, "star": 6}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertSummaryMatchesRatings()
+
+        url = f"/api/ratings/{response.data['id']}/"
+        self.client.patch(url, {"star": 2}, format="json")
+        self.assertSummaryMatchesRatings()
+
+        self.client.delete(url)
+        self.assertSummaryMatchesRatings()
+
+    def test_rating_filter_reads_summary(self):
+        other = self.catalog.manga[1]
+        MangaRatingSummary.objects.filter(manga=other).update(count=0, total=0, average=0)
+        response = self.client.get("/api/manga/?rating_min=1")
+        slugs = {item["slug"] for item in response.data["results"]}
+        self.assertIn(self.manga.slug, slugs)
+        self.assertNotIn(other.slug, slugs)
+
+
+class CatalogOrderingTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=4, volumes=1, chapters=1, ratings=0, votes=3)
+        for extra, manga in enumerate(cls.catalog.manga):
+            volume = manga.volumes.get()
+            for number in range(extra * 2):
+                Chapter.objects.create(volume=volume, chapter_number=f"extra-{number}")
+            for user in cls.catalog.users[:3 - extra]:
+                Rating.objects.create(user=user, manga=manga, star=5)
+        MangaRatingSummary.rebuild()
+
+    def ordered_slugs(self, ordering):
+        response = self.client.get(f"/api/manga/?ordering={ordering}")
+        return [item["slug"] for item in response.data["results"]]
+
+    def test_order_by_chapters_count(self):
+        slugs = [manga.slug for manga in self.catalog.manga]
+        self.assertEqual(self.ordered_slugs("-chapters_count"), slugs[::-1])
+
+    def test_moving_a_chapter_moves_the_count(self):
+        first, second = self.catalog.manga[:2]
+        counts = dict(Manga.objects.values_list("pk", "chapters_count"))
+        chapter = Chapter.objects.filter(manga=first).first()
+        chapter.volume = second.volumes.get()
+        chapter.save()
+        chapter.save()
+        moved = dict(Manga.objects.values_list("pk", "chapters_count"))
+        self.assertEqual((moved[first.pk], moved[second.pk]), (counts[first.pk] - 1, counts[second.pk] + 1))
+        self.assertEqual(chapter.manga_id, second.pk)
+        self.assertEqual(moved[second.pk], second.chapters.count())
+
+    def test_order_by_ratings_count(self):
+        counts = dict(Manga.objects.values_list("slug", "ratings_count"))
+        self.assertEqual(sorted(counts.values()), [0, 1, 2, 3])
+        ordered = self.ordered_slugs("ratings_count")
+        self.assertEqual([counts[slug] for slug in ordered], [0, 1, 2, 3])
+
+
+class KeysetPaginationTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=23, volumes=0, comments=0, ratings=0)
+        Manga.objects.filter(pk__in=[manga.pk for manga in cls.catalog.manga[::2]]).update(view_count=5)
+
+    def walk(self, url):
+        slugs = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            slugs.extend(item["slug"] for item in response.data["results"])
+            url = response.data["next"]
+        return slugs
+
+    def test_pages_follow_ordering_with_id_tiebreak(self):
+        for ordering in ("-view_count", "view_count", "created_at", "-ratings_count"):
+            field = ordering.lstrip("-")
+            expected = list(
+                Manga.objects.order_by(ordering, f"{ordering[:-len(field)]}pk").values_list("slug", flat=True)
+            )
+            self.assertEqual(self.walk(f"/api/manga/?pagination=cursor&ordering={ordering}&page_size=4"), expected)
+
+    def test_unsupported_ordering_falls_back_to_default(self):
+        expected = list(Manga.objects.order_by("-created_at", "-pk").values_list("slug", flat=True))
+        self.assertEqual(self.walk("/api/manga/?pagination=cursor&ordering=ratings__star&page_size=10"), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/manga/?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CommentTreeTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=2, comments=1, replies=3, votes=2)
+        cls.root = cls.catalog.comments[0]
+        parent = cls.catalog.replies[0]
+        cls.chain = []
+        for depth in range(4):
+            parent = Comment.objects.create(
+                author=cls.catalog.users[0], manga_id=cls.root.manga_id,
+                parent=parent, is_parent=True, content=f"Nested {depth}",
+            )
+            cls.chain.append(parent)
+        RatingComment.objects.create(user=cls.catalog.users[0], comment=cls.chain[-1], vote=1)
+        Comment.objects.filter(pk=cls.chain[-1].pk).update(score=1)
+
+    def test_tree_matches_database(self):
+        response = self.client.get(f"/api/comments/{self.root.pk}/")
+
+        def check(node, comment):
+            self.assertEqual(node["id"], comment.pk)
+            self.assertEqual(node["rating"], sum(comment.ratings.values_list("vote", flat=True)))
+            replies = list(comment.replies.order_by("pk"))
+            self.assertEqual([child["id"] for child in node["replies"]], [reply.pk for reply in replies])
+            for child, reply in zip(node["replies"], replies):
+                check(child, reply)
+
+        check(response.data, self.root)
+
+    def test_depth_and_reply_limits(self):
+        response = self.client.get(f"/api/comments/{self.root.pk}/?depth=2&replies=2")
+        first_level = response.data["replies"]
+        self.assertEqual(len(first_level), 2)
+        self.assertEqual([child["id"] for child in first_level[0]["replies"]], [self.chain[0].pk])
+        self.assertEqual(first_level[0]["replies"][0]["replies"], [])
+
+    def test_only_the_rendered_part_of_the_thread_is_loaded(self):
+        other_root = Comment.objects.create(author=self.catalog.users[0], manga_id=self.root.manga_id, content="Other")
+        for number in range(5):
+            Comment.objects.create(author=self.catalog.users[0], manga_id=self.root.manga_id, parent=other_root,
+                                   is_parent=True, content=f"Other reply {number}")
+        with CaptureQueriesContext(connection) as context:
+            tree = CommentTree.load([self.root], max_depth=2, max_replies=2)
+        # One query per level, each restricted to the replies that are kept.
+        self.assertEqual(len(context), 2)
+        loaded = [reply.pk for replies in tree.children.values() for reply in replies]
+        self.assertEqual(loaded, [reply.pk for reply in self.catalog.replies[:2]] + [self.chain[0].pk])
+
+
+class CommentVoteTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=1, comments=1, replies=0, votes=3)
+        cls.comment = cls.catalog.comments[0]
+        cls.user = User.objects.create(username="voter")
+
+    def vote(self, value):
+        self.client.force_authenticate(self.user)
+        return self.client.post(f"/api/comments/{self.comment.pk}/vote/", {"vote": value}, format="json")
+
+    def assertScoreMatchesVotes(self):
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.score, sum(self.comment.ratings.values_list("vote", flat=True)))
+
+    def test_add_switch_and_remove_vote(self):
+        self.assertEqual(self.vote(1).status_code, status.HTTP_201_CREATED)
+        self.assertScoreMatchesVotes()
+        self.assertEqual(self.vote(-1).data["detail"], "Vote updated.")
+        self.assertScoreMatchesVotes()
+        self.assertEqual(self.vote(-1).data["detail"], "Vote removed.")
+        self.assertScoreMatchesVotes()
+
+    def test_duplicate_vote_rejected_by_database(self):
+        RatingComment.objects.create(user=self.user, comment=self.comment, vote=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RatingComment.objects.create(user=self.user, comment=self.comment, vote=1)
+
+    def test_order_by_score(self):
+        Comment.objects.filter(pk=self.comment.pk).update(score=-5)
+        top = Comment.objects.create(author=self.user, manga=self.comment.manga, content="top", score=7)
+        response = self.client.get(f"/api/comments/?manga={self.comment.manga.slug}&ordering=-score")
+        self.assertEqual([item["id"] for item in response.data], [top.pk, self.comment.pk])
+
+
+class ViewCounterTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=3, volumes=0, comments=0, ratings=0)
+
+    def test_views_are_deduplicated_and_flushed_in_bulk(self):
+        counter = ViewCounter(dedup_window=60, batch_size=2)
+        first, second, third = self.catalog.manga
+        for viewer in ("a", "b", "a", "c"):
+            counter.record(first.pk, viewer)
+        counter.record(second.pk, "a")
+        before = dict(Manga.objects.values_list("pk", "view_count"))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(counter.flush(), 4)
+        after = dict(Manga.objects.values_list("pk", "view_count"))
+        self.assertEqual(after[first.pk] - before[first.pk], 3)
+        self.assertEqual(after[second.pk] - before[second.pk], 1)
+        self.assertEqual(after[third.pk], before[third.pk])
+
+        self.assertFalse(counter.record(first.pk, "a"))
+        with self.assertNumQueries(0):
+            self.assertEqual(counter.flush(), 0)
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=None)
+    def test_views_are_written_through_without_a_flush_interval(self):
+        manga = self.catalog.manga[0]
+        self.client.get(f"/api/manga/{manga.slug}/")
+        self.client.get(f"/api/manga/{manga.slug}/")
+        self.assertEqual(Manga.objects.get(pk=manga.pk).view_count, manga.view_count + 1)
+
+
+class HomeFeedTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=3, volumes=1, chapters=1, comments=0, ratings=0)
+
+    def test_feeds_are_served_from_cache_until_a_write(self):
+        for url in ("/api/manga/popular_manga/", "/api/manga/new_manga/",
+                    "/api/manga/popular_manga_chapters/", "/api/chapters/latest/"):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.data, second.data)
+
+        chapter = Chapter.objects.create(volume=self.catalog.volumes[0], chapter_number="99", title="Fresh")
+        response = self.client.get("/api/chapters/latest/")
+        self.assertEqual(response.data[0]["id"], chapter.pk)
+
+    @override_settings(FEED_MAX_STALENESS=0)
+    def test_staleness_bound(self):
+        self.client.get("/api/manga/popular_manga/")
+        with self.assertNumQueries(1):
+            self.client.get("/api/manga/popular_manga/")
+
+
+class ResponseCacheTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=2, comments=0)
+        cls.manga = cls.catalog.manga[0]
+
+    def assertCached(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.data, second.data)
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=None)
+    def test_read_routes_are_cached(self):
+        chapter = self.catalog.chapters[0]
+        for url in ("/api/manga/?ordering=-view_count&page_size=1", f"/api/manga/{self.manga.slug}/",
+                    f"/api/manga/{self.manga.slug}/short_info/", f"/api/manga/{self.manga.slug}/chapters/",
+                    f"/api/chapters/{chapter.pk}/pages/", "/api/genres/", "/api/tags/", "/api/types/"):
+            self.assertCached(url)
+
+    def test_query_params_are_normalized(self):
+        self.client.get("/api/manga/?type=manga&ordering=-view_count")
+        response = self.client.get("/api/manga/?ordering=-view_count&status=&type=manga")
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=None)
+    def test_writes_invalidate_only_dependent_responses(self):
+        url = f"/api/manga/{self.manga.slug}/"
+        other_url = f"/api/manga/{self.catalog.manga[1].slug}/"
+        rated = self.client.get(url).data["ratings"]["total_rated"]
+        self.client.get(other_url)
+
+        user = User.objects.create(username="critic")
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.post("/api/ratings/", {"manga": self.manga.pk, "star": 10}, format="json")
+            # Nothing is invalidated before the rating and its summary commit.
+            self.assertEqual(self.client.get(url)["X-Cache"], "HIT")
+        self.assertTrue(callbacks)
+
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["ratings"]["total_rated"], rated + 1)
+        self.assertEqual(self.client.get(other_url)["X-Cache"], "HIT")
+
+    def test_invalidation_while_a_miss_is_built_is_kept(self):
+        class View:
+            @response_cache.cached_response("catalog")
+            def list(self, request):
+                # Lands after the view read its data, before the entry is stored.
+                response_cache.invalidate("catalog")
+                return Response({})
+
+        def get():
+            return View().list(Request(APIRequestFactory().get("/race/")))
+
+        get()
+        self.assertEqual(get()["X-Cache"], "MISS")
+
+    def test_user_list_statistics_are_dropped_after_the_commit(self):
+        total = self.manga.get_user_list()["total_users"]
+        with self.captureOnCommitCallbacks(execute=True):
+            MangaUserList.objects.create(manga=self.manga, user=User.objects.create(username="reader"),
+                                         list_type="reading")
+            self.assertEqual(self.manga.get_user_list()["total_users"], total)
+        self.assertEqual(self.manga.get_user_list()["total_users"], total + 1)
+
+    def test_lost_generation_never_matches_again(self):
+        self.client.get("/api/genres/")
+        response_cache.invalidate("taxonomy")
+        response_cache.get_cache().delete(response_cache.generation_key("taxonomy"))
+        self.assertEqual(self.client.get("/api/genres/")["X-Cache"], "MISS")
+
+    def test_stats_are_admin_only(self):
+        self.client.get("/api/types/")
+        self.client.get("/api/types/")
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(User.objects.create(username="admin", is_staff=True))
+        response = self.client.get("/api/cache/stats/")
+        self.assertEqual((response.data["hits"], response.data["misses"]), (1, 1))
+
+
+class MangaSearchTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=3, volumes=0, comments=0, ratings=0)
+
+    def search(self, text, **params):
+        response = self.client.get("/api/manga/", {"search": text, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item["slug"] for item in response.data["results"]]
+
+    def test_prefix_matching_and_ranking(self):
+        first, second, third = self.catalog.manga
+        third.description = "Not to be confused with Berserker"
+        third.save()
+        second.title = "Berserk"
+        second.save()
+        self.assertEqual(self.search("bers"), [second.slug, third.slug])
+        self.assertEqual(self.search("BERS ko"), [])
+        self.assertEqual(self.search("bers", ordering="-view_count"), [third.slug, second.slug])
+        self.assertEqual(len(self.search("  ")), 3)
+
+    def test_index_follows_related_names(self):
+        manga = self.catalog.manga[0]
+        author = Author.objects.create(name="Kentaro")
+        manga.author = author
+        manga.save()
+        self.assertEqual(self.search("kenta"), [manga.slug])
+
+        author.name = "Miura"
+        author.save()
+        self.assertEqual(self.search("kenta"), [])
+        self.assertEqual(self.search("miura"), [manga.slug])
+
+        tag = Tag.objects.create(name="Dark fantasy")
+        manga.tag.add(tag)
+        self.assertEqual(self.search("dark fan"), [manga.slug])
+        tag.delete()
+        self.assertEqual(self.search("dark fan"), [])
+
+        manga.delete()
+        self.assertEqual(self.search("miura"), [])
+
+    def test_rebuild_command(self):
+        Manga.objects.filter(pk=self.catalog.manga[0].pk).update(title="Vagabond")
+        self.assertEqual(self.search("vagabond"), [])
+        call_command("rebuild_search_index", stdout=open(os.devnull, "w"))
+        self.assertEqual(self.search("vagabond"), [self.catalog.manga[0].slug])
+
+
+class MangaSuggestTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=3, volumes=0, comments=0, ratings=0)
+        titles = [("Naruto", "Наруто", 10), ("Nana", "Нана", 30), ("One Piece", "Ван-Пис", 20)]
+        for manga, (title, subtitle, view_count) in zip(cls.catalog.manga, titles):
+            Manga.objects.filter(pk=manga.pk).update(title=title, subtitle=subtitle, view_count=view_count)
+
+    def suggest(self, text, **params):
+        response = self.client.get("/api/manga/suggest/", {"q": text, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item["title"] for item in response.data]
+
+    def test_prefixes_transliteration_and_typos(self):
+        self.assertEqual(self.suggest("na"), ["Nana", "Naruto"])
+        self.assertEqual(self.suggest("na", limit=1), ["Nana"])
+        self.assertEqual(self.suggest("НАРУ"), ["Naruto"])
+        self.assertEqual(self.suggest("piece"), ["One Piece"])
+        self.assertEqual(self.suggest("narto"), ["Naruto"])
+        self.assertEqual(self.suggest("nanu"), ["Nana", "Naruto"])
+        self.assertEqual(self.suggest("nx"), [])
+        self.assertEqual(self.suggest(""), [])
+
+    def test_saves_update_the_index(self):
+        self.assertEqual(self.suggest("bers"), [])
+        naruto, nana, _ = Manga.objects.order_by("pk")
+        naruto.title = "Berserk"
+        naruto.subtitle = "Берсерк"
+        naruto.save()
+        self.assertEqual(self.suggest("bers"), ["Berserk"])
+        self.assertEqual(self.suggest("naru"), [])
+        nana.delete()
+        self.assertEqual(self.suggest("nana"), [])
+
+
+@override_settings(FACET_MAX_FILTER_IDS=2)
+class FacetFilterTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=6, volumes=0, comments=0, ratings=0)
+        cls.genres = [genre.pk for genre in cls.catalog.genres]
+        cls.tags = [tag.pk for tag in cls.catalog.tags]
+
+    def expected(self, condition):
+        return sorted(manga.slug for manga in Manga.objects.prefetch_related("genres", "tag") if condition(manga))
+
+    def filtered(self, query):
+        response = self.client.get(f"/api/manga/?page_size=100&{query}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return sorted(item["slug"] for item in response.data["results"])
+
+    def test_combinations_match_the_database(self):
+        g0, g1, g2 = self.genres[:3]
+
+        def genre_ids(manga):
+            return {genre.pk for genre in manga.genres.all()}
+
+        def tag_ids(manga):
+            return {tag.pk for tag in manga.tag.all()}
+
+        cases = [
+            (f"genres={g0}&genres={g1}", lambda m: genre_ids(m) & {g0, g1}),
+            (f"genres={g0},{g1}", lambda m: genre_ids(m) & {g0, g1}),
+            (f"genres_all={g0}&genres_all={g1}", lambda m: {g0, g1} <= genre_ids(m)),
+            (f"genres_exclude={g0}", lambda m: g0 not in genre_ids(m)),
+            (f"genres={g1},{g2}&genres_exclude={g2}&tags_exclude={self.tags[0]}",
+             lambda m: g1 in genre_ids(m) and g2 not in genre_ids(m) and self.tags[0] not in tag_ids(m)),
+            ("type=manga,manhwa&status_exclude=ongoing",
+             lambda m: m.type in ("manga", "manhwa") and m.status != "ongoing"),
+            (f"genres_all={g0}&genres_exclude={g0}", lambda m: False),
+            ("genres=999999", lambda m: False),
+        ]
+        for query, condition in cases:
+            with self.subTest(query=query):
+                self.assertEqual(self.filtered(query), self.expected(condition))
+
+    def test_invalid_values(self):
+        self.assertEqual(self.client.get("/api/manga/?genres=abc").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_counts_ignore_their_own_facet(self):
+        g0, g1 = self.genres[:2]
+        counts = self.client.get(f"/api/manga/facets/?genres={g0}&tags_exclude={self.tags[0]}").data
+        for genre in self.genres:
+            with self.subTest(genre=genre):
+                self.assertEqual(
+                    counts["genres"][genre],
+                    len(self.expected(lambda m: genre in {g.pk for g in m.genres.all()}
+                                      and self.tags[0] not in {t.pk for t in m.tag.all()})),
+                )
+        self.assertEqual(counts["total"], len(self.filtered(f"genres={g0}&tags_exclude={self.tags[0]}")))
+        self.assertEqual(sum(counts["type"].values()), counts["total"])
+
+    def test_writes_refresh_the_index(self):
+        manga = self.catalog.manga[0]
+        genre = self.genres[-1]
+        self.filtered(f"genres={genre}")
+        manga.genres.set([genre])
+        self.assertIn(manga.slug, self.filtered(f"genres={genre}"))
+        manga.genres.clear()
+        self.assertNotIn(manga.slug, self.filtered(f"genres={genre}"))
+
+    def test_writes_from_other_processes_show_up_after_the_staleness_bound(self):
+        manga = self.catalog.manga[0]
+        other = "manhua" if manga.type != "manhua" else "manhwa"
+        selection = Selection()
+        selection.add("type", "any", [other])
+        self.assertNotIn(manga.pk, from_bitmap(facet_index.evaluate(selection)))
+        # A queryset update sends no signal, like a write made by another process.
+        Manga.objects.filter(pk=manga.pk).update(type=other)
+        self.assertNotIn(manga.pk, from_bitmap(facet_index.evaluate(selection)))
+        with override_settings(FACET_MAX_STALENESS=0):
+            self.assertIn(manga.pk, from_bitmap(facet_index.evaluate(selection)))
+
+    def test_deleting_a_genre_refreshes_cached_facets(self):
+        genre = self.genres[-1]
+        self.assertIn(genre, self.client.get("/api/manga/facets/").data["genres"])
+        Genre.objects.get(pk=genre).delete()
+        self.assertNotIn(genre, self.client.get("/api/manga/facets/").data["genres"])
+
+
+class TaxonomyCounterTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=4, volumes=0, comments=0, ratings=0, genres=3, tags=3)
+
+    def assertCountersConsistent(self):
+        for model, relation in ((Genre, "genres"), (Tag, "tag")):
+            for obj in model.objects.all():
+                actual = Manga.objects.filter(**{relation: obj}).count()
+                self.assertEqual(obj.manga_count, actual, f"{model.__name__} {obj.name}")
+
+    def test_counters_follow_m2m_changes(self):
+        self.assertCountersConsistent()
+        first, second = self.catalog.manga[:2]
+        genre = Genre.objects.create(name="Seinen")
+        first.genres.add(genre, *self.catalog.genres)
+        genre.manga_set.add(second)
+        self.assertCountersConsistent()
+        first.genres.remove(self.catalog.genres[0])
+        first.tag.clear()
+        genre.manga_set.clear()
+        self.assertCountersConsistent()
+        first.genres.set([genre])
+        second.delete()
+        self.assertCountersConsistent()
+
+    def test_removing_unlinked_ids_keeps_counters(self):
+        first, second = self.catalog.manga[:2]
+        genre = Genre.objects.create(name="Josei")
+        first.genres.add(genre)
+        second.genres.add(genre)
+        unlinked = self.catalog.manga[2]
+        unlinked.genres.remove(genre)
+        genre.manga_set.remove(unlinked)
+        tag = self.catalog.tags[0]
+        first.tag.remove(*[other for other in self.catalog.tags if other not in first.tag.all()])
+        genre.refresh_from_db()
+        self.assertEqual(genre.manga_count, 2)
+        self.assertCountersConsistent()
+        genre.manga_set.remove(first, unlinked)
+        first.tag.remove(tag)
+        self.assertCountersConsistent()
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=None)
+    def test_list_and_detail_use_the_counters(self):
+        genre = self.catalog.genres[0]
+        response = self.client.get("/api/genres/")
+        self.assertEqual({item["id"]: item["total_manga"] for item in response.data}[genre.pk],
+                         genre.manga_set.count())
+        detail = self.client.get(f"/api/manga/{self.catalog.manga[0].slug}/").data
+        for item in detail["genres"]:
+            self.assertEqual(item["total_manga"], Manga.objects.filter(genres=item["id"]).count())
+
+
+def make_image(width, height, color="white"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class TemporaryMediaMixin:
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+
+class ReaderBundleTests(TemporaryMediaMixin, MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=2, volumes=2, chapters=2, pages=2, comments=0, ratings=0)
+
+    def bundle(self, chapter, **headers):
+        return self.client.get(f"/api/chapters/{chapter.pk}/bundle/", **headers)
+
+    def test_neighbours_follow_reading_order(self):
+        first, second, third, fourth = self.catalog.chapters[:4]
+        data = self.bundle(second).data
+        self.assertEqual(data["chapter"]["id"], second.pk)
+        self.assertEqual(data["previous"]["id"], first.pk)
+        self.assertEqual(data["next"]["id"], third.pk)
+        self.assertEqual([page["page_number"] for page in data["next"]["pages"]], [1, 2])
+        self.assertIsNone(self.bundle(first).data["previous"])
+        self.assertIsNone(self.bundle(fourth).data["next"])
+
+    def test_page_manifest(self):
+        content = make_image(30, 20)
+        page = Page.objects.create(chapter=self.catalog.chapters[0], page_number=3,
+                                   image=SimpleUploadedFile("page.png", content))
+        self.assertEqual((page.width, page.height, page.file_size), (30, 20, len(content)))
+        self.assertEqual(page.content_hash, hashlib.sha256(content).hexdigest())
+        manifest = self.bundle(self.catalog.chapters[0]).data["chapter"]["pages"][-1]
+        self.assertEqual(manifest["content_hash"], page.content_hash)
+        self.assertEqual((manifest["width"], manifest["height"]), (30, 20))
+
+    def test_legacy_page_saves_without_reading_its_file(self):
+        page = Page.objects.get(pk=self.catalog.pages[0].pk)
+        Page.objects.filter(pk=page.pk).update(image="legacy/missing.jpg", content_hash="")
+        page.refresh_from_db()
+        page.page_number = 9
+        page.save()
+        page.refresh_from_db()
+        self.assertEqual((page.page_number, page.content_hash), (9, ""))
+
+    def test_duplicate_page_number_rejected_by_database(self):
+        page = self.catalog.pages[0]
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Page.objects.bulk_create([Page(chapter_id=page.chapter_id, page_number=page.page_number, image="seed/x.jpg")])
+
+    def test_etag_changes_when_neighbour_pages_change(self):
+        first, second = self.catalog.chapters[:2]
+        etag = self.bundle(first)["ETag"]
+        self.assertEqual(self.bundle(first, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        Page.objects.create(chapter=second, page_number=3, image=SimpleUploadedFile("page.png", make_image(5, 5)))
+        response = self.bundle(first, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.data["next"]["pages"]), 3)
+
+
+class ChapterOrderingTests(MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=2, volumes=1, chapters=0, pages=0, comments=0, ratings=0)
+        cls.manga = cls.catalog.manga[0]
+        volume = cls.catalog.volumes[0]
+        cls.chapters = {
+            number: Chapter.objects.create(volume=volume, chapter_number=number, title=number)
+            for number in ("10", "1", "Extra", "10.5", "2", "Глава 3,5")
+        }
+
+    def numbers(self, chapters):
+        return [chapter.chapter_number for chapter in chapters]
+
+    def test_sort_key(self):
+        self.assertEqual(Chapter.parse_sort_key("Глава 3,5"), 3.5)
+        ordered = self.manga.chapters.order_by("sort_key", "pk")
+        self.assertEqual(self.numbers(ordered), ["Extra", "1", "2", "Глава 3,5", "10", "10.5"])
+        self.assertEqual(
+            [item["chapter_number"] for item in self.client.get(f"/api/manga/{self.manga.slug}/chapters/").data],
+            self.numbers(ordered),
+        )
+
+    def test_neighbours_and_last_chapter(self):
+        chapter = self.chapters["10"]
+        with self.assertNumQueries(1):
+            self.assertEqual(self.numbers(chapter.with_neighbours()), ["Глава 3,5", "10", "10.5"])
+        self.assertEqual(chapter.get_next_chapters().first().chapter_number, "10.5")
+        self.assertFalse(self.chapters["10.5"].get_next_chapters().exists())
+        self.assertFalse(self.chapters["Extra"].get_previous_chapters().exists())
+
+        with self.assertNumQueries(1):
+            last_chapters = Chapter.get_last_chapters([manga.pk for manga in self.catalog.manga])
+        self.assertEqual(last_chapters[self.manga.pk].chapter_number, "10.5")
+        self.assertNotIn(self.catalog.manga[1].pk, last_chapters)
+
+    def test_volumes_come_first(self):
+        manga = self.catalog.manga[1]
+        first = Volume.objects.create(manga=manga, volume_number=1)
+        second = Volume.objects.create(manga=manga, volume_number=2)
+        chapters = {
+            label: Chapter.objects.create(volume=volume, chapter_number=number)
+            for label, volume, number in (("2-1", second, "1"), ("1-5", first, "5"), ("2-2", second, "2"),
+                                          ("1-1", first, "1"))
+        }
+        ordered = ["1-1", "1-5", "2-1", "2-2"]
+        labels = {chapter.pk: label for label, chapter in chapters.items()}
+        response = self.client.get(f"/api/manga/{manga.slug}/chapters/")
+        self.assertEqual([labels[item["id"]] for item in response.data], ordered)
+        self.assertEqual([labels[chapter.pk] for chapter in chapters["1-5"].with_neighbours()], ordered[:3])
+        self.assertEqual(labels[Chapter.get_last_chapters([manga.pk])[manga.pk].pk], "2-2")
+
+        first.volume_number = 3
+        first.save()
+        self.assertEqual([labels[chapter.pk] for chapter in chapters["2-2"].get_next_chapters()], ["1-1", "1-5"])
+
+    def test_backfill_command(self):
+        Chapter.objects.update(sort_key=0, volume_number=0)
+        call_command("backfill_chapter_sort_keys", stdout=open(os.devnull, "w"))
+        chapter = Chapter.objects.get(pk=self.chapters["10.5"].pk)
+        self.assertEqual((chapter.sort_key, chapter.volume_number), (10.5, self.catalog.volumes[0].volume_number))
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=0, IMAGE_DERIVATIVE_FORMATS=("webp",),
+                   IMAGE_DERIVATIVE_WIDTHS={"poster": (16, 32, 64), "background": (64,), "page": (50, 100)})
+class ImageDerivativeTests(TemporaryMediaMixin, MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=1, volumes=1, chapters=1, pages=0, comments=0, ratings=0)
+        cls.manga = cls.catalog.manga[0]
+
+    def test_page_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            page = Page.objects.create(chapter=self.catalog.chapters[0], page_number=1,
+                                       image=SimpleUploadedFile("page.png", make_image(80, 120)))
+        page.refresh_from_db()
+        self.assertEqual([(v["width"], v["height"]) for v in page.image_variants], [(50, 75)])
+        with Image.open(os.path.join(self.media_root, page.image_variants[0]["name"])) as variant:
+            self.assertEqual((variant.format, variant.size), ("WEBP", (50, 75)))
+
+        srcset = self.client.get(f"/api/chapters/{page.chapter_id}/pages/").data[0]["srcset"]
+        self.assertRegex(srcset["webp"], r"^/media/blobs/[0-9a-f/]+\.webp 50w$")
+
+    def test_poster_variants_replace_old_ones(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manga.image = SimpleUploadedFile("poster.png", make_image(40, 60, "red"))
+            self.manga.save()
+        self.manga.refresh_from_db()
+        old_names = [variant["name"] for variant in self.manga.image_variants]
+        self.assertEqual([variant["width"] for variant in self.manga.image_variants], [16, 32])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manga.image = SimpleUploadedFile("cover.png", make_image(10, 10))
+            self.manga.save()
+        self.manga.refresh_from_db()
+        self.assertEqual([variant["width"] for variant in self.manga.image_variants], [10])
+        call_command("collect_image_blobs", "--min-age=0", stdout=io.StringIO())
+        for name in old_names:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+        item = self.client.get("/api/manga/").data["results"][0]
+        self.assertIn("10w", item["image_srcset"]["webp"])
+
+    def test_backfill_command(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            page = Page.objects.create(chapter=self.catalog.chapters[0], page_number=1,
+                                       image=SimpleUploadedFile("page.png", make_image(120, 60)))
+        call_command("generate_image_derivatives", "--workers=1", stdout=open(os.devnull, "w"),
+                     stderr=open(os.devnull, "w"))
+        page.refresh_from_db()
+        self.assertEqual([variant["width"] for variant in page.image_variants], [50, 100])
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=0, IMAGE_DERIVATIVE_FORMATS=("webp",),
+                   IMAGE_DERIVATIVE_WIDTHS={"poster": (16,), "background": (64,), "page": (50,)})
+class ChapterIngestTests(TemporaryMediaMixin, MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manga = seed_catalog(manga=1, volumes=0, chapters=0, pages=0, comments=0, ratings=0).manga[0]
+
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        for path, size in (("Vol 1/Chapter 1 - Start/10.png", (80, 120)), ("Vol 1/Chapter 1 - Start/2.png", (80, 60)),
+                           ("Vol 1/Chapter 2/01.png", (60, 90)), ("Vol 2/Ch 2.5/01.png", (60, 90))):
+            os.makedirs(os.path.join(self.source, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(self.source, path), "wb") as file:
+                file.write(make_image(*size))
+        with zipfile.ZipFile(os.path.join(self.source, "Vol 2", "Chapter 3.cbz"), "w") as archive:
+            archive.writestr("001.png", make_image(70, 100))
+            archive.writestr("002.png", make_image(70, 100, "black"))
+
+    def ingest(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command("ingest_chapters", self.manga.slug, self.source, "--workers=1", "--min-width=50",
+                     "--min-height=50", *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_ingest_creates_chapters_and_pages(self):
+        self.client.get(f"/api/manga/{self.manga.slug}/chapters/")
+        output, _ = self.ingest("--variants")
+        # The test settings keep the caches in memory, so the server would not see the invalidation.
+        self.assertIn(response_cache.PROCESS_LOCAL_WARNING, output)
+
+        chapters = list(Chapter.objects.filter(manga=self.manga).order_by("sort_key"))
+        self.assertEqual([(c.volume.volume_number, c.chapter_number, c.sort_key, c.title) for c in chapters],
+                         [(1, "1", 1.0, "Start"), (1, "2", 2.0, None), (2, "2.5", 2.5, None), (2, "3", 3.0, None)])
+        self.manga.refresh_from_db()
+        self.assertEqual(self.manga.chapters_count, 4)
+
+        pages = list(chapters[0].pages.order_by("page_number"))
+        self.assertEqual([(p.page_number, p.width, p.height) for p in pages], [(1, 80, 60), (2, 80, 120)])
+        with open(os.path.join(self.source, "Vol 1/Chapter 1 - Start/2.png"), "rb") as file:
+            data = file.read()
+        self.assertEqual((pages[0].file_size, pages[0].content_hash), (len(data), hashlib.sha256(data).hexdigest()))
+        digest = pages[0].content_hash
+        self.assertEqual(pages[0].image.name, f"media/blobs/{digest[:2]}/{digest[2:4]}/{digest}.png")
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, pages[0].image.name)))
+        self.assertEqual([variant["width"] for variant in pages[0].image_variants], [50])
+        self.assertEqual(Page.objects.filter(manga=self.manga).count(), 6)
+
+        response = self.client.get(f"/api/manga/{self.manga.slug}/chapters/")
+        self.assertEqual(len(response.data), 4)
+
+    def test_ingest_is_resumable(self):
+        self.ingest()
+        Page.objects.filter(chapter__chapter_number="3", page_number=2).delete()
+        output, _ = self.ingest()
+        self.assertIn("Completed volume 2 chapter 3: 1 pages", output)
+        self.assertIn("Imported 1 chapters", output)
+        self.assertEqual(Page.objects.filter(manga=self.manga).count(), 6)
+        self.manga.refresh_from_db()
+        self.assertEqual(self.manga.chapters_count, 4)
+
+    def test_invalid_pages_skip_the_chapter(self):
+        with open(os.path.join(self.source, "Vol 1/Chapter 2/02.png"), "wb") as file:
+            file.write(make_image(20, 20))
+        output, errors = self.ingest()
+        self.assertIn("02.png: 20x20 is smaller than 50x50", errors)
+        self.assertIn("3 chapters", output)
+        self.assertFalse(Chapter.objects.filter(manga=self.manga, chapter_number="2").exists())
+
+
+class ChapterDownloadTests(TemporaryMediaMixin, MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=1, volumes=1, chapters=1, pages=0, comments=0, ratings=0)
+        cls.chapter = cls.catalog.chapters[0]
+
+    def setUp(self):
+        super().setUp()
+        self.files = {}
+        pages = []
+        for number, color in ((1, "red"), (2, "blue"), (10, "green")):
+            name = f"pages/{number}.png"
+            self.files[f"{number:03d}.png"] = data = make_image(30, 40, color)
+            os.makedirs(os.path.join(self.media_root, "pages"), exist_ok=True)
+            with open(os.path.join(self.media_root, name), "wb") as file:
+                file.write(data)
+            pages.append(Page(chapter=self.chapter, manga=self.chapter.manga, page_number=number, image=name))
+        Page.objects.bulk_create(pages)
+
+    def download(self, query="", **headers):
+        response = self.client.get(f"/api/chapters/{self.chapter.pk}/download/{query}", **headers)
+        body = b"".join(response.streaming_content) if response.streaming else b""
+        return response, body
+
+    def test_download_is_a_valid_archive(self):
+        response, body = self.download("?archive=cbz")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/vnd.comicbook+zip")
+        self.assertEqual(int(response["Content-Length"]), len(body))
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="seed subtitle 0 - Vol 1 Ch 1.cbz"')
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), list(self.files))
+            self.assertEqual({name: archive.read(name) for name in archive.namelist()}, self.files)
+
+    def test_ranges(self):
+        _, full = self.download()
+        etag = self.download()[0]["ETag"]
+
+        response, body = self.download(HTTP_RANGE="bytes=10-99")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], f"bytes 10-99/{len(full)}")
+        self.assertEqual(body, full[10:100])
+
+        response, body = self.download(HTTP_RANGE="bytes=-30", HTTP_IF_RANGE=etag)
+        self.assertEqual(body, full[-30:])
+        response, body = self.download(HTTP_RANGE=f"bytes={len(full) - 200}-")
+        self.assertEqual(body, full[-200:])
+
+        response, body = self.download(HTTP_RANGE="bytes=10-99", HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (status.HTTP_200_OK, full))
+        response, _ = self.download(HTTP_RANGE=f"bytes={len(full)}-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(full)}")
+
+    def test_manifest_is_cached_until_pages_change(self):
+        response, _ = self.download()
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response, _ = self.download()
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH=etag)[0].status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Page.objects.get(chapter=self.chapter, page_number=10).delete()
+        response, body = self.download()
+        self.assertNotEqual(response["ETag"], etag)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.namelist(), ["001.png", "002.png"])
+
+
+class ContentAddressedStorageTests(TemporaryMediaMixin, MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=1, volumes=1, chapters=2, pages=0, comments=0, ratings=0)
+
+    def collect(self, *args):
+        output = io.StringIO()
+        call_command("collect_image_blobs", "--min-age=0", *args, stdout=output)
+        return output.getvalue()
+
+    def blob_path(self, data, extension=".png"):
+        digest = hashlib.sha256(data).hexdigest()
+        return os.path.join(self.media_root, "media", "blobs", digest[:2], digest[2:4], digest + extension)
+
+    def test_identical_uploads_share_one_blob(self):
+        data = make_image(30, 40, "red")
+        pages = [Page.objects.create(chapter=chapter, page_number=1, image=SimpleUploadedFile("01.PNG", data))
+                 for chapter in self.catalog.chapters]
+        self.assertEqual(pages[0].image.name, pages[1].image.name)
+        self.assertEqual(os.path.join(self.media_root, pages[0].image.name), self.blob_path(data))
+        self.assertEqual(pages[0].content_hash, hashlib.sha256(data).hexdigest())
+
+        pages[0].image.delete(save=False)
+        pages[0].delete()
+        self.assertIn("1 blobs, 1 references", self.collect())
+        self.assertTrue(os.path.exists(self.blob_path(data)))
+
+        pages[1].delete()
+        self.assertIn("Deleted 1 unreferenced blobs", self.collect())
+        self.assertFalse(os.path.exists(self.blob_path(data)))
+
+    def test_recent_blobs_are_kept(self):
+        data = make_image(30, 40, "blue")
+        Page.objects.create(chapter=self.catalog.chapters[0], page_number=1,
+                            image=SimpleUploadedFile("01.png", data)).delete()
+        call_command("collect_image_blobs", stdout=io.StringIO())
+        self.assertTrue(os.path.exists(self.blob_path(data)))
+
+    def test_reused_blob_is_not_collected_before_its_row_commits(self):
+        data = make_image(30, 40, "yellow")
+        storage = Page._meta.get_field("image").storage
+        name = storage.save("old.png", io.BytesIO(data))
+        os.utime(self.blob_path(data), (0, 0))
+
+        self.assertEqual(storage.save("new.png", io.BytesIO(data)), name)
+        call_command("collect_image_blobs", stdout=io.StringIO())
+        self.assertTrue(os.path.exists(self.blob_path(data)))
+
+    def test_adopt_legacy_files(self):
+        data = make_image(30, 40, "green")
+        legacy = ["media/legacy/a.png", "media/legacy/b.png"]
+        os.makedirs(os.path.join(self.media_root, "media", "legacy"))
+        for name in legacy:
+            with open(os.path.join(self.media_root, name), "wb") as file:
+                file.write(data)
+        Page.objects.bulk_create(Page(chapter=chapter, manga=chapter.manga, page_number=1, image=name)
+                                 for chapter, name in zip(self.catalog.chapters, legacy))
+
+        self.assertIn("Would delete 0", self.collect("--adopt", "--dry-run"))
+        self.assertTrue(all(name.startswith("media/legacy/") for name in Page.objects.values_list("image", flat=True)))
+
+        output = self.collect("--adopt")
+        self.assertIn("Adopted 2 legacy files", output)
+        self.assertIn(f"deduplication saves {len(data)} bytes", output)
+        names = set(Page.objects.values_list("image", flat=True))
+        self.assertEqual([os.path.join(self.media_root, name) for name in names], [self.blob_path(data)])
+        for name in legacy:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+
+def make_pattern(seed, size=(200, 300), image_format="PNG", quality=90):
+    rng = random.Random(seed)
+    image = Image.new("RGB", (200, 300), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(200), rng.randrange(300)
+        draw.rectangle((x, y, x + rng.randrange(20, 80), y + rng.randrange(20, 80)), fill=(rng.randrange(256),) * 3)
+    image = image.resize(size, Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=quality)
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=0, IMAGE_DERIVATIVE_FORMATS=())
+class NearDuplicateTests(TemporaryMediaMixin, MangaAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(manga=1, volumes=1, chapters=3, pages=0, comments=0, ratings=0)
+
+    def hash_of(self, data):
+        with Image.open(io.BytesIO(data)) as image:
+            return dhash(image)
+
+    def test_dhash_survives_reencoding(self):
+        original = self.hash_of(make_pattern(1))
+        self.assertLessEqual(hamming(original, self.hash_of(make_pattern(1, (400, 600), "JPEG", 40))), 4)
+        self.assertGreater(hamming(original, self.hash_of(make_pattern(2))), 12)
+
+    def test_multi_index_matches_brute_force(self):
+        rng = random.Random(0)
+        values = [rng.getrandbits(64) - (1 << 63) for _ in range(300)]
+        values += [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for value in values[:100]]
+        index = MultiIndex()
+        for position, value in enumerate(values):
+            index.add(value, position)
+        for radius in (0, 3, 9, 24):
+            for query in values[:20]:
+                expected = sorted((hamming(query, value), position) for position, value in enumerate(values)
+                                  if hamming(query, value) <= radius)
+                self.assertEqual(sorted(index.search(query, radius)), expected)
+
+    def test_search_falls_back_to_a_scan_when_probing_costs_more(self):
+        self.assertEqual(choose_chunks(100000, 6), 4)
+        self.assertIsNone(choose_chunks(2000, 32))
+        rng = random.Random(1)
+        pages = [(number, 1, rng.getrandbits(64) - (1 << 63)) for number in range(60)]
+        for distance in (6, 32):
+            expected = sorted((hamming(page[2], other[2]), page[0], other[0]) for page in pages for other in pages
+                              if page[0] < other[0] and hamming(page[2], other[2]) <= distance)
+            found = sorted((found, page[0], other[0]) for found, page, other in find_near_duplicates(pages, distance))
+            self.assertEqual(found, expected)
+
+    def test_report_finds_copied_chapter(self):
+        first, second, third = self.catalog.chapters
+        for number, seed in ((1, 10), (2, 11), (3, 12)):
+            Page.objects.create(chapter=first, page_number=number,
+                                image=SimpleUploadedFile(f"{number}.png", make_pattern(seed)))
+            Page.objects.create(chapter=second, page_number=number,
+                                image=SimpleUploadedFile(f"{number}.jpg", make_pattern(seed, (300, 450), "JPEG", 50)))
+        Page.objects.create(chapter=third, page_number=1, image=SimpleUploadedFile("1.png", make_pattern(13)))
+        self.assertFalse(Page.objects.filter(perceptual_hash=None).exists())
+
+        output = io.StringIO()
+        call_command("find_duplicate_pages", stdout=output)
+        output = output.getvalue()
+        self.assertIn("seed subtitle 0 vol. 1 ch. 1 ~ seed subtitle 0 vol. 1 ch. 2: 3 pages (100%)", output)
+        self.assertIn("3 near-duplicate pairs, 1 near-duplicate chapter pairs", output)
+
+        admin_user = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.get("/admin/manga/page/duplicates/?distance=4")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "seed subtitle 0 vol. 1 ch. 1 p. 1")
+        self.assertEqual(len(response.context["pairs"]), 3)
+
+        # The report comes from the cache; only the session and this page's labels are queried.
+        with override_settings(DUPLICATE_REPORT_PAGE_SIZE=2), self.assertNumQueries(6):
+            response = self.client.get("/admin/manga/page/duplicates/?distance=4&page=2")
+        self.assertEqual(len(response.context["pairs"]), 1)
+        self.assertEqual(response.context["page_obj"].paginator.num_pages, 2)
+
+        # Rows deleted while the report is cached are left out instead of failing.
+        Page.objects.filter(chapter=first, page_number=1).delete()
+        second.delete()
+        response = self.client.get("/admin/manga/page/duplicates/?distance=4")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.context["pairs"], response.context["chapters"]), ([], []))
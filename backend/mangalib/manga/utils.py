@@ -1,3 +1,12 @@
+import hashlib
+
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from PIL import Image
+
+from .duplicates import dhash
+
+
 def background_image_upload_path(instance, filename):
     name = instance.subtitle.replace(" ", "-").lower()
     return f"media/manga/{name}/background/{filename}"
@@ -6,10 +15,52 @@ def poster_image_upload_path(instance, filename):
     name = instance.subtitle.replace(" ", "-").lower()
     return f"media/manga/{name}/poster/{filename}"
 
+def page_image_directory(manga_name, volume_number, chapter_number):
+    return f"media/manga/{manga_name}/volume-{volume_number}/chapter-{chapter_number}/pages"
+
 def page_image_upload_path(instance, filename):
     chapter = instance.chapter
     volume = chapter.volume
-    manga_name = volume.manga.subtitle
-    volume_number = volume.volume_number
-    chapter_number = chapter.chapter_number
-    return f"media/manga/{manga_name}/volume-{volume_number}/chapter-{chapter_number}/pages/{filename}"
\ No newline at end of file
+    directory = page_image_directory(volume.manga.subtitle, volume.volume_number, chapter.chapter_number)
+    return f"{directory}/{filename}"
+
+
+def aggregate_of(model, field, aggregate):
+    """Correlated subquery aggregating ``model`` rows whose ``field`` points at the outer row."""
+    rows = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=aggregate)
+        .values("total")
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def count_of(model, field):
+    return aggregate_of(model, field, Count("pk"))
+
+
+def sum_of(model, field, column):
+    return aggregate_of(model, field, Sum(column))
+
+
+def file_sha256(file):
+    """Hex sha256 of a Django ``File``, read in chunks and rewound afterwards."""
+    digest = hashlib.sha256()
+    file.open("rb")
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def file_dhash(file):
+    """Perceptual difference hash of an image ``File``, rewound afterwards."""
+    file.open("rb")
+    file.seek(0)
+    with Image.open(file) as image:
+        value = dhash(image)
+    file.seek(0)
+    return value
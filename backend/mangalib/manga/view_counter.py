@@ -0,0 +1,125 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Manga
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Buffer manga views in memory and write them as batched increments.
+
+    Views are deduplicated per (manga, viewer) within ``dedup_window``
+    seconds and summed per manga. ``flush`` turns the sums into one
+    ``UPDATE ... SET view_count = view_count + CASE id WHEN ... END`` per
+    ``batch_size`` manga, so hot titles cost one write per flush instead of
+    one per request.
+    """
+
+    def __init__(self, dedup_window=30 * 60, batch_size=500):
+        self.dedup_window = dedup_window
+        self.batch_size = batch_size
+        self.pending = Counter()
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def record(self, manga_id, viewer):
+        """Count a view unless ``viewer`` already viewed ``manga_id`` inside the window."""
+        now = time.monotonic()
+        key = (manga_id, viewer)
+        with self.lock:
+            if self.seen.get(key, 0) > now:
+                return False
+            self.seen[key] = now + self.dedup_window
+            self.pending[manga_id] += 1
+        return True
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            now = time.monotonic()
+            self.seen = {key: expires for key, expires in self.seen.items() if expires > now}
+        return pending
+
+    def flush(self):
+        """Write buffered views to the database and return how many were written."""
+        pending = self.drain()
+        items = sorted(pending.items())
+        written = 0
+        try:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                increment = Case(
+                    *[When(pk=manga_id, then=Value(views)) for manga_id, views in batch],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+                Manga.objects.filter(pk__in=[manga_id for manga_id, _ in batch]).update(
+                    view_count=F("view_count") + increment
+                )
+                written += sum(views for _, views in batch)
+        except Exception:
+            with self.lock:
+                self.pending.update(dict(items[start:]))
+            raise
+        return written
+
+    def start(self, interval):
+        """Flush every ``interval`` seconds from a daemon thread and once more at exit."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, args=(interval,), name="view-counter", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def run(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush manga view counts")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush manga view counts")
+
+
+view_counter = ViewCounter(
+    dedup_window=settings.VIEW_COUNT_DEDUP_WINDOW,
+    batch_size=settings.VIEW_COUNT_BATCH_SIZE,
+)
+
+
+def get_viewer_key(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    session_key = getattr(getattr(request, "session", None), "session_key", None)
+    if session_key:
+        return f"session:{session_key}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def record_view(request, manga_id):
+    """Count a view; without a flush interval it is written through right away."""
+    interval = settings.VIEW_COUNT_FLUSH_INTERVAL
+    if interval:
+        view_counter.start(interval)
+    recorded = view_counter.record(manga_id, get_viewer_key(request))
+    if recorded and not interval:
+        view_counter.flush()
+    return recorded
@@ -1,37 +1,47 @@
-from django.db.models import Max, Count
-from rest_framework import viewsets, generics, views, mixins, filters, status
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from rest_framework import viewsets, generics, views, mixins, filters, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Comment, Manga, Genre, Page,  RatingComment, Tag, Rating, Chapter
+from . import archive
+from .models import Comment, Manga, Genre, Page,  RatingComment, Tag, Rating, Chapter, MangaRatingSummary
 from .serializers import (MangaListSerializer,
                           MangaDetailSerializer,
                           GenreSerializer,
-                          MangaPopularSerializer, MangaNewSerializer,
-                          MangaPopularNewChapters,
                           CommentSerializer,
                           TagSerializer,
                           MangaShortInfoSerializer,
                           CommentCreateSerializer,
                           CommentUpdateSerializer,
                           ChapterSerializer,
-                          LatestChapterSerializer,
                           PageSerializer,
+                          ReaderChapterSerializer,
                           RatingSerializer,
                           VoteSerializer
                           )
-from .paginations import MangaPagination
-from .filters import MangaFilter
+from .paginations import MangaPagination, MangaCursorPagination, CommentCursorPagination, CursorPaginationMixin
+from .filters import MangaFilter, MangaSearchFilter
+from .comment_tree import CommentTree
+from .feeds import get_feed
+from .suggest import TOP_SIZE as MAX_SUGGESTIONS, suggest as suggest_titles
+from .view_counter import record_view
+from .response_cache import ResponseCacheMixin, cached_response, get_stats as get_response_cache_stats
 
 
-class MangaViewSet(viewsets.ModelViewSet):
+class MangaViewSet(ResponseCacheMixin, CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Manga.objects.all()
     serializer_class = MangaListSerializer
     lookup_field = 'slug'
     pagination_class = MangaPagination
+    cursor_pagination_class = MangaCursorPagination
     filterset_class = MangaFilter
-    filter_backends = [filters.SearchFilter,
+    filter_backends = [MangaSearchFilter,
                        filters.OrderingFilter, DjangoFilterBackend]
     ordering_fields = ["ratings__star", "created_at", "chapters__created_at",
                        "chapters_count", "view_count", "ratings_count"]
@@ -44,67 +54,155 @@ class MangaViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        queryset = queryset.annotate(ratings_count=Count("ratings"))
-        queryset = queryset.annotate(chapters_count=Count("chapters"))
+        if self.action == "retrieve":
+            return queryset.select_related("author", "painter", "rating_summary").prefetch_related(
+                Prefetch("genres", queryset=Genre.objects.only("id", "name", "manga_count")),
+                Prefetch("tag", queryset=Tag.objects.only("id", "name", "manga_count")),
+                Prefetch("related_manga", queryset=Manga.objects.only("id", "title", "type", "status", "slug")),
+            )
+        if self.action == "short_info":
+            return queryset.select_related("author", "rating_summary").prefetch_related(
+                Prefetch("genres", queryset=Genre.objects.only("id", "name", "manga_count")),
+                Prefetch("tag", queryset=Tag.objects.only("id", "name", "manga_count")),
+            )
+        if self.action == "chapters":
+            return queryset.only("id", "slug")
         return queryset
 
+    @cached_response("catalog", "taxonomy")
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.get_detail_response(request, *args, **kwargs)
+        record_view(request, self.cached_pk)
+        return response
+
+    @cached_response("manga:{pk}", "taxonomy")
+    def get_detail_response(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        return Response(serializer.data)
+
     @action(detail=True, methods=['get'])
+    @cached_response("manga:{pk}")
     def chapters(self, request, slug):
         manga = self.get_object()
-        chapters = manga.chapters.all()
+        chapters = manga.chapters.select_related('volume').annotate(pages_count=Count('pages')).order_by(*Chapter.READING_ORDER)
         serializer = ChapterSerializer(chapters, many=True)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
+    @cached_response("manga:{pk}", "taxonomy")
     def short_info(self, request, slug):
         manga = self.get_object()
         serializer = MangaShortInfoSerializer(manga)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    @cached_response("catalog")
+    def facets(self, request):
+        filterset = self.filterset_class(request.query_params, queryset=Manga.objects.all(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return Response(filterset.get_facet_counts())
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), MAX_SUGGESTIONS) if limit.isdigit() else 10
+        return Response(suggest_titles(request.query_params.get('q', ''), limit))
+
     @action(detail=False, methods=['get'])
     def popular_manga(self, request):
-        queryset = self.get_queryset().order_by('-view_count')[:10]
-        serializer = MangaPopularSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(get_feed('popular_manga'))
 
     @action(detail=False, methods=['get'])
     def new_manga(self, request):
-        queryset = self.get_queryset().order_by('-created_at')[:10]
-        serializer = MangaNewSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(get_feed('new_manga'))
 
     @action(detail=False, methods=['get'])
     def popular_manga_chapters(self, request):
-        queryset = self.get_queryset().annotate(
-            latest_chapter_date=Max('chapters__created_at')
-        ).order_by('-view_count', '-latest_chapter_date')[:6]
-        serializer = MangaPopularNewChapters(queryset, many=True)
-        return Response(serializer.data)
+        return Response(get_feed('popular_manga_chapters'))
 
 
-class ChapterViewSet(viewsets.ReadOnlyModelViewSet):
+class ChapterViewSet(ResponseCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Chapter.objects.all()
     serializer_class = ChapterSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related('volume')
+        if self.action == 'download':
+            return queryset.select_related('manga')
+        if self.action in ('pages', 'bundle'):
+            return queryset
+        return queryset.annotate(pages_count=Count('pages'))
+
     @action(detail=True, methods=['get'])
+    @cached_response("chapter:{pk}")
     def pages(self, request, pk=None):
         chapter = self.get_object()
         pages = Page.objects.filter(chapter=chapter).order_by('page_number')
         serializer = PageSerializer(pages, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    @cached_response("chapter:{pk}", "manga:{obj.manga_id}")
+    def bundle(self, request, pk=None):
+        chapter = self.get_object()
+        chapters = list(chapter.with_neighbours().select_related('volume').prefetch_related(
+            Prefetch('pages', queryset=Page.objects.order_by('page_number'))))
+        index = [obj.pk for obj in chapters].index(chapter.pk)
+
+        def serialize(obj):
+            return ReaderChapterSerializer(obj).data if obj else None
+
+        return Response({
+            'chapter': serialize(chapters[index]),
+            'previous': serialize(chapters[index - 1] if index > 0 else None),
+            'next': serialize(chapters[index + 1] if index + 1 < len(chapters) else None),
+        })
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """The chapter's pages as an uncompressed ZIP (``?archive=cbz`` for a CBZ), with range support."""
+        manifest = archive.get_manifest(pk, self.get_object)
+        etag, size = manifest['etag'], manifest['size']
+        extension = 'cbz' if request.query_params.get('archive') == 'cbz' else 'zip'
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        if etag in (tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        byte_range = None
+        if request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = archive.parse_range(request.headers.get('Range'), size)
+            except ValueError:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+        start, end = byte_range or (0, size - 1)
+        response = StreamingHttpResponse(
+            archive.stream(manifest, start, end),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type='application/vnd.comicbook+zip' if extension == 'cbz' else 'application/zip',
+            headers=headers,
+        )
+        response['Content-Length'] = end - start + 1
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = content_disposition_header(True, f"{manifest['filename']}.{extension}")
+        return response
+
     @action(detail=False, methods=['get'])
     def latest(self, request):
-        latest_chapters = Chapter.objects.order_by('-created_at')[:50]
-        serializer = LatestChapterSerializer(latest_chapters, many=True)
-        return Response(serializer.data)
+        return Response(get_feed('latest_chapters'))
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.filter(is_parent=False)
     serializer_class = CommentSerializer
+    cursor_pagination_class = CommentCursorPagination
     filter_backends = [filters.OrderingFilter]
-    ordering_fields = ["created_at", "ratings__vote"]
+    ordering_fields = ["created_at", "score"]
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -117,7 +215,7 @@ class CommentViewSet(viewsets.ModelViewSet):
         serializer.save(author=self.request.user)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().select_related('author')
         manga_slug = self.request.query_params.get('manga')
         chapter_number = self.request.query_params.get('chapter')
         page_number = self.request.query_params.get('page')
@@ -131,6 +229,35 @@ class CommentViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def get_tree_limit(self, param, maximum):
+        value = self.request.query_params.get(param)
+        if value and value.isdigit():
+            return min(int(value), maximum)
+        return maximum
+
+    def get_tree_serializer(self, comments, many=False):
+        tree = CommentTree.load(
+            comments if many else [comments],
+            max_depth=self.get_tree_limit('depth', settings.COMMENT_TREE_MAX_DEPTH),
+            max_replies=self.get_tree_limit('replies', settings.COMMENT_TREE_MAX_REPLIES),
+        )
+        context = self.get_serializer_context()
+        context['comment_tree'] = tree
+        return self.get_serializer(comments, many=many, context=context)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_tree_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_tree_serializer(list(queryset), many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_tree_serializer(self.get_object())
+        return Response(serializer.data)
+
     @action(detail=True, methods=['post'])
     def vote(self, request, pk=None):
         user = request.user
@@ -140,24 +267,25 @@ class CommentViewSet(viewsets.ModelViewSet):
 
         vote = serializer.validated_data['vote']
 
-        try:
-            comment = Comment.objects.get(pk=pk)
-        except Comment.DoesNotExist:
+        if not Comment.objects.filter(pk=pk).exists():
             return Response({'detail': 'Comment not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        comment_vote, created = RatingComment.objects.get_or_create(
-            user=user, comment=comment, defaults={"vote": vote})
+        with transaction.atomic():
+            comment_vote, created = RatingComment.objects.select_for_update().get_or_create(
+                user=user, comment_id=pk, defaults={"vote": vote})
 
-        if not created:
-            if comment_vote.vote == vote:
+            if created:
+                delta, detail, code = vote, 'Vote added.', status.HTTP_201_CREATED
+            elif comment_vote.vote == vote:
                 comment_vote.delete()
-                return Response({'detail': 'Vote removed.'}, status=status.HTTP_200_OK)
+                delta, detail, code = -vote, 'Vote removed.', status.HTTP_200_OK
             else:
                 comment_vote.vote = vote
-                comment_vote.save()
-                return Response({'detail': 'Vote updated.'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'detail': 'Vote added.'}, status=status.HTTP_201_CREATED)
+                comment_vote.save(update_fields=['vote'])
+                delta, detail, code = 2 * vote, 'Vote updated.', status.HTTP_200_OK
+            Comment.objects.filter(pk=pk).update(score=F('score') + delta)
+
+        return Response({'detail': detail}, status=code)
 
 
 class RatingViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
@@ -166,15 +294,36 @@ class RatingViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
     serializer_class = RatingSerializer
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            rating = serializer.save(user=self.request.user)
+            MangaRatingSummary.apply(rating.manga_id, added=rating.star)
+
+    def perform_update(self, serializer):
+        old_manga_id = serializer.instance.manga_id
+        old_star = serializer.instance.star
+        with transaction.atomic():
+            rating = serializer.save()
+            if rating.manga_id == old_manga_id:
+                MangaRatingSummary.apply(rating.manga_id, added=rating.star, removed=old_star)
+            else:
+                MangaRatingSummary.apply(old_manga_id, removed=old_star)
+                MangaRatingSummary.apply(rating.manga_id, added=rating.star)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            MangaRatingSummary.apply(instance.manga_id, removed=instance.star)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        data = serializer.data
-        if Rating.objects.filter(manga=data['manga'], user=self.request.user).exists():
+        manga = serializer.validated_data['manga']
+        if Rating.objects.filter(manga=manga, user=self.request.user).exists():
+            return Response({'error': 'Rating for this manga already exists.'}, status=400)
+        try:
+            self.perform_create(serializer)
+        except IntegrityError:
             return Response({'error': 'Rating for this manga already exists.'}, status=400)
-        self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -189,6 +338,7 @@ class RatingViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
 
 class MangaTypeAPIView(views.APIView):
 
+    @cached_response()
     def get(self, request):
         manga_types = ["Manga", "Manhwa", "Manhua"]
         return Response(manga_types)
@@ -198,9 +348,13 @@ class GenresListAPIView(generics.ListAPIView):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
 
+    @cached_response("taxonomy")
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         limit = self.request.query_params.get('limit')
-        if limit.isdigit():
+        if limit and limit.isdigit():
             limit = int(limit)
             return super().get_queryset()[:limit]
         return super().get_queryset()
@@ -209,3 +363,14 @@ class GenresListAPIView(generics.ListAPIView):
 class TagListAPIView(generics.ListAPIView):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+
+    @cached_response("taxonomy")
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ResponseCacheStatsAPIView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_response_cache_stats())